@@ -0,0 +1,133 @@
+"""Time catalog pages for each filter and sort combination.
+
+Seeds --products products, then for every combination times the first
+page and the page --pages cursor hops deep through get_catalog_page(),
+against the naive query that scans and sorts the filtered table with
+OFFSET. Shows the index each plan starts from and whether it also has to
+skip rows the index does not filter on or sort the range it reads (newest
+first within a price range), and times the facet counts read from catalog_facets against a
+GROUP BY over products.
+
+    python benchmarks/catalog_filters.py --products 200000 --pages 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "routes", "customers"))
+import customers  # noqa: E402
+
+FACET_SCAN = """SELECT COALESCE(seller_id, 0), {bucket}, COUNT(*) FROM products
+                WHERE stock > 0 AND (?1 IS NULL OR seller_id = ?1) GROUP BY 1, 2"""
+
+
+def combinations(shop):
+    F = customers.CatalogFilters
+    return [
+        ("newest", F()),
+        ("newest, sold out too", F(in_stock=False)),
+        ("price asc", F(sort="price_asc")),
+        ("price desc, 50-250", F(sort="price_desc", min_price=50, max_price=250)),
+        ("price asc, 100-250 bucket", F(sort="price_asc", price_bucket=3)),
+        ("newest, 100+", F(min_price=100)),
+        ("newest, 500-1000", F(min_price=500, max_price=1000)),
+        ("shop, newest", F(shop=shop)),
+        ("shop, price asc", F(shop=shop, sort="price_asc")),
+        ("shop, price desc, 25-100", F(shop=shop, sort="price_desc", min_price=25, max_price=100)),
+    ]
+
+
+def naive_page(db, filters, page, page_size):
+    column, descending = customers.CATALOG_SORTS[filters.sort]
+    order = "DESC" if descending else "ASC"
+    conditions, params = ["1"], []
+    if filters.in_stock:
+        conditions.append("p.stock > 0")
+    for sql, value in (("p.seller_id = ?", filters.shop), ("p.price >= ?", filters.min_price),
+                       ("p.price <= ?", filters.max_price)):
+        if value is not None:
+            conditions.append(sql)
+            params.append(value)
+    if filters.price_bucket is not None:
+        conditions.append(customers.price_bucket_sql("p.price") + " = ?")
+        params.append(filters.price_bucket)
+    return db.execute(f"""SELECT p.*, u.shop_name FROM products p NOT INDEXED
+                          LEFT JOIN users u ON p.seller_id = u.id
+                          WHERE {' AND '.join(conditions)}
+                          ORDER BY p.{column} {order}, p.id {order} LIMIT ? OFFSET ?""",
+                      (*params, page_size, page * page_size)).fetchall()
+
+
+def plan_path(db, filters, page_size):
+    """The index get_catalog_page()'s query walks, and whether it also skips rows or sorts."""
+    statements = []
+    db.set_trace_callback(statements.append)
+    customers.get_catalog_page(db, page_size=page_size, filters=filters)
+    db.set_trace_callback(None)
+    plan = [row[3] for row in db.execute("EXPLAIN QUERY PLAN " + statements[-1])]
+    detail = next((d for d in plan if d.startswith(("SCAN p", "SEARCH p"))), plan[0])
+    index = detail.split(" INDEX ")[-1].split(" ")[0] if " INDEX " in detail else detail
+    searched = detail.partition("(")[2]
+    filtered = ({"price"} if filters.min_price is not None or filters.max_price is not None
+                or filters.price_bucket is not None else set())
+    filtered |= {"seller_id"} if filters.shop is not None else set()
+    if any("TEMP B-TREE FOR ORDER BY" in d for d in plan):
+        return index, "sorts range"
+    return index, "skips rows" if any(column not in searched for column in filtered) else "range"
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=200_000)
+    parser.add_argument("--sellers", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=20, help="cursor hops to the deep page")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    customers.DATABASE = os.path.join(tempfile.mkdtemp(), "bench.db")
+    customers.init_db()
+    db = customers.connect_db()
+    customers.seed_synthetic_data(db, users=100, sellers=args.sellers, products=args.products, orders=0)
+    # Some products sold out, as in a live catalog
+    db.execute("UPDATE products SET stock = 0 WHERE id % 10 = 0")
+    db.commit()
+    page_size = customers.app.config["CATALOG_PAGE_SIZE"]
+    shop = db.execute("""SELECT seller_id FROM catalog_facets GROUP BY seller_id
+                         ORDER BY SUM(product_count) DESC LIMIT 1""").fetchone()[0]
+
+    print(f"{'filters':<26}{'index':<30}{'path':<12}{'first ms':>9}{'naive':>9}{'deep ms':>9}{'naive':>9}")
+    for name, filters in combinations(shop):
+        first, (_, cursor, _) = timed(lambda: customers.get_catalog_page(db, page_size=page_size,
+                                                                          filters=filters), args.repeat)
+        for _ in range(args.pages - 1):
+            if cursor:
+                cursor = customers.get_catalog_page(db, after=cursor, page_size=page_size, filters=filters)[1]
+        deep, _ = timed(lambda: customers.get_catalog_page(db, after=cursor, page_size=page_size,
+                                                           filters=filters), args.repeat)
+        naive_first, _ = timed(lambda: naive_page(db, filters, 0, page_size), args.repeat)
+        naive_deep, _ = timed(lambda: naive_page(db, filters, args.pages, page_size), args.repeat)
+        index, path = plan_path(db, filters, page_size)
+        print(f"{name:<26}{index:<30}{path:<12}{first:>9.2f}{naive_first:>9.1f}"
+              f"{deep:>9.2f}{naive_deep:>9.1f}")
+
+    scan = FACET_SCAN.format(bucket=customers.price_bucket_sql("price"))
+    for label, selected in (("all shops", None), ("one shop", shop)):
+        facets, _ = timed(lambda: customers.get_catalog_facets(db, selected), args.repeat)
+        full, _ = timed(lambda: db.execute(scan, (selected,)).fetchall(), args.repeat)
+        print(f"facets, {label:<18}{'catalog_facets':<30}{'':<12}{facets:>9.2f}{full:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Fire thousands of parallel purchases at one product.
+
+Checks that stock never goes negative and that every unit is sold exactly
+once, then reports checkouts per second.
+
+    python benchmarks/checkout_concurrency.py --purchases 5000 --stock 1000 --threads 32
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "routes", "customers"))
+import customers  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--purchases", type=int, default=5000)
+    parser.add_argument("--stock", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=32)
+    args = parser.parse_args()
+
+    customers.DATABASE = os.path.join(tempfile.mkdtemp(), "bench.db")
+    customers.init_db()
+
+    db = customers.connect_db()
+    product_id = db.execute("INSERT INTO products (name, price, stock) VALUES (?,?,?)",
+                            ("Hot item", 10, args.stock)).lastrowid
+    db.commit()
+
+    per_thread = args.purchases // args.threads
+    sold = []
+    errors = []
+    start_barrier = threading.Barrier(args.threads)
+
+    def buyer(user_id):
+        conn = customers.connect_db()
+        start_barrier.wait()
+        ok = 0
+        for _ in range(per_thread):
+            try:
+                if customers.place_order(conn, user_id, product_id):
+                    ok += 1
+            except Exception as e:
+                errors.append(e)
+        sold.append(ok)
+        conn.close()
+
+    threads = [threading.Thread(target=buyer, args=(i + 1,)) for i in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    attempts = per_thread * args.threads
+    stock = db.execute("SELECT stock FROM products WHERE id=?", (product_id,)).fetchone()[0]
+    orders = db.execute("SELECT COUNT(*) FROM orders WHERE product_id=?", (product_id,)).fetchone()[0]
+
+    print(f"attempts={attempts} sold={sum(sold)} orders={orders} final_stock={stock} errors={len(errors)}")
+    print(f"{attempts / elapsed:,.0f} checkouts/s over {elapsed:.2f}s")
+
+    assert stock >= 0, "stock went negative"
+    assert orders == sum(sold) == min(args.stock, attempts), "oversold or lost orders"
+    assert not errors, errors[:3]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Compare purchases per second with and without flash-sale group commit.
+
+Seeds a small catalog, then sends --requests /buy requests for --hot
+products from --concurrency threads, first through the per-request
+place_order() path and then with FLASH_SALE on (every product hot). Reports
+purchases per second, latency percentiles and, for flash-sale mode, the
+mean batch size. Each run checks that no stock was oversold; give a
+--stock below --requests to exercise the sold-out path too.
+
+    python benchmarks/flash_sale.py --concurrency 1 8 32 --requests 2000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "routes", "customers"))
+import customers  # noqa: E402
+
+
+def run(product_ids, user_ids, requests, concurrency):
+    latencies = []
+    lock = threading.Lock()
+    remaining = [requests]
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(index):
+        rng = random.Random(index)
+        client = customers.app.test_client()
+        with client.session_transaction() as sess:
+            sess.update(user_id=user_ids[index % len(user_ids)], role="user", username="bench")
+        barrier.wait()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            assert client.get(f"/buy/{rng.choice(product_ids)}").status_code == 302
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return (len(latencies) / wall, latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.95)] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=2000, help="purchases per run")
+    parser.add_argument("--hot", type=int, default=1, help="number of products being bought")
+    parser.add_argument("--stock", type=int, default=1_000_000, help="starting stock of each hot product")
+    parser.add_argument("--linger-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    customers.DATABASE = os.path.join(tempfile.mkdtemp(), "bench.db")
+    customers.app.config["OUTBOX_SINK_PATH"] = customers.outbox_sink.path = os.devnull
+    customers.app.config["FLASH_SALE_HOT_RATE"] = 0
+    customers.app.config["FLASH_SALE_LINGER_MS"] = args.linger_ms
+    customers.init_db()
+    db = customers.connect_db()
+    customers.seed_synthetic_data(db, users=1000, sellers=10, products=1000, orders=0)
+    product_ids = [row[0] for row in db.execute("SELECT id FROM products LIMIT ?", (args.hot,))]
+    user_ids = [row[0] for row in db.execute("SELECT id FROM users WHERE role = 'user'")]
+
+    print(f"{'mode':<12}{'threads':>8}{'buys/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'batch':>8}{'sold out':>10}")
+    for concurrency in args.concurrency:
+        for flash_sale in (False, True):
+            db.executemany("UPDATE products SET stock = ? WHERE id = ?", [(args.stock, pid) for pid in product_ids])
+            db.commit()
+            orders_before = db.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+            stats_before = customers.flash_sale_queue.stats()
+            customers.app.config["FLASH_SALE"] = flash_sale
+            rate, p50, p95 = run(product_ids, user_ids, args.requests, concurrency)
+
+            placed = db.execute("SELECT COUNT(*) FROM orders").fetchone()[0] - orders_before
+            left = db.execute(f"SELECT SUM(stock) FROM products WHERE id IN ({','.join('?' * len(product_ids))})",
+                              product_ids).fetchone()[0]
+            assert placed == args.stock * len(product_ids) - left, "stock and orders disagree"
+            assert left >= 0, "oversold"
+            stats = customers.flash_sale_queue.stats()
+            batches = stats["batches"] - stats_before["batches"]
+            batch = f"{(stats['purchases'] - stats_before['purchases']) / batches:.1f}" if batches else "-"
+            print(f"{'flash sale' if flash_sale else 'per-request':<12}{concurrency:>8}{rate:>9.0f}"
+                  f"{p50:>9.2f}{p95:>9.2f}{batch:>8}{args.requests - placed:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""Drive the main routes at a fixed concurrency and record a latency baseline.
+
+Seeds a synthetic dataset (or reuses one), then sends each route's requests
+from --concurrency threads through the Flask test client. Prints p50/p95/p99
+latency and throughput per route and writes them as JSON. With --compare,
+the run is checked against an earlier baseline and exits 1 on regressions.
+
+    python benchmarks/load_test.py --scale small --output baseline.json
+    python benchmarks/load_test.py --db big.db --compare baseline.json
+
+A --db that does not exist yet is created and seeded at --scale; an
+existing one is used as is (buy adds orders to it).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "routes", "customers"))
+import customers  # noqa: E402
+
+SCALES = {
+    "tiny": dict(users=500, sellers=50, products=5_000, orders=50_000),
+    "small": dict(users=5_000, sellers=500, products=50_000, orders=500_000),
+    "large": dict(users=50_000, sellers=5_000, products=300_000, orders=3_000_000),
+}
+
+OK_STATUSES = {200, 302, 304}
+
+
+def pick_identities(db):
+    admin = db.execute("SELECT id FROM users WHERE email='admin@example.com'").fetchone()[0]
+    customers_with_orders = [row[0] for row in db.execute(
+        "SELECT user_id FROM customer_orders ORDER BY order_count DESC LIMIT 1000")]
+    # The biggest seller is the worst case for the seller dashboard
+    seller = db.execute("""SELECT seller_id FROM products WHERE seller_id IS NOT NULL
+                           GROUP BY seller_id ORDER BY COUNT(*) DESC LIMIT 1""").fetchone()
+    customer_emails = [row[0] for row in db.execute(
+        "SELECT email FROM users WHERE email LIKE 'customer%@seed.example' LIMIT 1000")]
+    products = [row[0] for row in db.execute(
+        "SELECT id FROM products WHERE stock > 0 ORDER BY random() LIMIT 1000")]
+    return {
+        "admin": admin,
+        "customers": customers_with_orders or [admin],
+        "seller": seller[0] if seller else None,
+        "emails": customer_emails,
+        "products": products,
+    }
+
+
+def make_routes(ids):
+    """Route name -> (role, request function taking (client, rng))."""
+    def login(client, rng):
+        return client.post("/login", data={"email": rng.choice(ids["emails"]),
+                                           "password": customers.SEED_PASSWORD})
+
+    return {
+        "home": ("user", lambda client, rng: client.get("/home")),
+        "orders": ("user", lambda client, rng: client.get("/orders")),
+        "buy": ("user", lambda client, rng: client.get(f"/buy/{rng.choice(ids['products'])}")),
+        "seller_dashboard": ("seller", lambda client, rng: client.get("/seller")),
+        "admin_dashboard": ("admin", lambda client, rng: client.get("/admin")),
+        "all_orders": ("admin", lambda client, rng: client.get("/admin/all_orders")),
+        "login": (None, login),
+    }
+
+
+def login_as(client, role, ids, rng):
+    if role is None:
+        return
+    user_id = {"user": lambda: rng.choice(ids["customers"]),
+               "seller": lambda: ids["seller"],
+               "admin": lambda: ids["admin"]}[role]()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+        sess["role"] = role
+        sess["username"] = f"bench-{role}"
+        if role == "seller":
+            sess["shop_name"] = "Bench Shop"
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def run_route(name, role, send, ids, requests, concurrency, max_seconds):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    remaining = [requests]
+    deadline = [None]
+    barrier = threading.Barrier(concurrency)
+
+    def worker(index):
+        rng = random.Random(index)
+        client = customers.app.test_client()
+        login_as(client, role, ids, rng)
+        barrier.wait()
+        while True:
+            with lock:
+                if remaining[0] <= 0 or time.perf_counter() > deadline[0]:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            status = send(client, rng).status_code
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if status not in OK_STATUSES:
+                    errors.append(status)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    deadline[0] = started + max_seconds
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ms = [value * 1000 for value in latencies]
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "mean_ms": round(sum(ms) / len(ms), 2) if ms else None,
+        "p50_ms": round(percentile(ms, 0.50), 2) if ms else None,
+        "p95_ms": round(percentile(ms, 0.95), 2) if ms else None,
+        "p99_ms": round(percentile(ms, 0.99), 2) if ms else None,
+        "max_ms": round(ms[-1], 2) if ms else None,
+    }
+
+
+def compare(baseline, current, tolerance):
+    """Print p95/throughput changes per route; return the routes that regressed."""
+    regressions = []
+    print(f"\n{'route':<18}{'p95 before':>12}{'p95 now':>10}{'change':>9}{'rps before':>12}{'rps now':>9}")
+    for name, now in current["routes"].items():
+        before = baseline.get("routes", {}).get(name)
+        if not before or not before.get("p95_ms") or not now.get("p95_ms"):
+            continue
+        change = now["p95_ms"] / before["p95_ms"] - 1
+        flag = "  REGRESSION" if change > tolerance else ""
+        print(f"{name:<18}{before['p95_ms']:>12.1f}{now['p95_ms']:>10.1f}{change:>+8.0%}"
+              f"{before['throughput_rps']:>12.1f}{now['throughput_rps']:>9.1f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--db", help="database file to use or create (default: a temp file)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--max-seconds", type=float, default=60, help="time cap per route")
+    parser.add_argument("--routes", nargs="*", help="subset of routes to run")
+    parser.add_argument("--output", help="write the results as JSON here")
+    parser.add_argument("--compare", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed p95 increase before a route counts as regressed")
+    args = parser.parse_args()
+
+    customers.DATABASE = args.db or os.path.join(tempfile.mkdtemp(), "load.db")
+    fresh = not os.path.exists(customers.DATABASE)
+    customers.init_db()
+    db = customers.connect_db()
+    if fresh:
+        started = time.perf_counter()
+        counts = customers.seed_synthetic_data(db, **SCALES[args.scale])
+        print(f"seeded {counts} in {time.perf_counter() - started:.1f}s")
+
+    ids = pick_identities(db)
+    routes = make_routes(ids)
+    selected = args.routes or list(routes)
+    counts = {table: db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ("users", "products", "orders")}
+
+    results = {
+        "meta": {
+            "scale": args.scale if fresh else "existing",
+            "counts": counts,
+            "concurrency": args.concurrency,
+            "requests_per_route": args.requests,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "cpus": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "routes": {},
+    }
+    print(f"rows: {counts}, concurrency {args.concurrency}")
+    print(f"{'route':<18}{'reqs':>6}{'errors':>7}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name in selected:
+        role, send = routes[name]
+        if role == "seller" and ids["seller"] is None:
+            continue
+        stats = run_route(name, role, send, ids, args.requests, args.concurrency, args.max_seconds)
+        results["routes"][name] = stats
+        print(f"{name:<18}{stats['requests']:>6}{stats['errors']:>7}{stats['throughput_rps'] or 0:>9.1f}"
+              f"{stats['p50_ms'] or 0:>9.1f}{stats['p95_ms'] or 0:>9.1f}{stats['p99_ms'] or 0:>9.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"wrote {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        if regressions:
+            print(f"regressed: {', '.join(regressions)}")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
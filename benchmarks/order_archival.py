@@ -0,0 +1,87 @@
+"""Show that hot-path order views stay flat as archived history grows.
+
+Keeps a fixed number of recent orders, adds older orders in growing steps,
+archives them with archive_orders() and times the default (hot) views and
+the history view after each step.
+
+    python benchmarks/order_archival.py --steps 100000 300000 1000000 --recent 5000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "routes", "customers"))
+import customers  # noqa: E402
+
+
+def add_orders(db, count, newest_days_ago, oldest_days_ago, customer_ids, product_ids, rng, batch=50_000):
+    now = time.time()
+    for start in range(0, count, batch):
+        rows = []
+        for _ in range(min(batch, count - start)):
+            age = rng.uniform(newest_days_ago, oldest_days_ago) * 86400
+            rows.append((customer_ids[int(len(customer_ids) * rng.random() ** 2)],
+                         rng.choice(product_ids), 1,
+                         time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - age))))
+        db.executemany("INSERT INTO orders (user_id, product_id, quantity, order_date) VALUES (?,?,?,?)", rows)
+        db.commit()
+
+
+def timed(client, url, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        assert client.get(url).status_code == 200
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--steps", type=int, nargs="+", default=[100_000, 300_000, 1_000_000],
+                        help="cumulative archived order counts to measure at")
+    parser.add_argument("--recent", type=int, default=5000, help="hot orders, kept constant")
+    parser.add_argument("--archive-days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    customers.DATABASE = os.path.join(tempfile.mkdtemp(), "bench.db")
+    customers.init_db()
+    db = customers.connect_db()
+    customers.seed_synthetic_data(db, users=2000, sellers=100, products=10_000, orders=0)
+    customer_ids = [row[0] for row in db.execute("SELECT id FROM users WHERE role='user' ORDER BY id")]
+    product_ids = [row[0] for row in db.execute("SELECT id FROM products")]
+    rng = random.Random(7)
+    add_orders(db, args.recent, 0, args.archive_days - 1, customer_ids, product_ids, rng)
+
+    customer = customers.app.test_client()
+    with customer.session_transaction() as sess:
+        sess.update(user_id=customer_ids[0], role="user", username="bench")
+    admin = customers.app.test_client()
+    with admin.session_transaction() as sess:
+        sess.update(user_id=1, role="admin", username="admin")
+
+    print(f"{'archived':>10}{'hot':>8}{'archive s':>11}{'orders ms':>11}{'all_orders ms':>15}{'history ms':>12}")
+    added = 0
+    for target in args.steps:
+        add_orders(db, target - added, args.archive_days + 1, 730, customer_ids, product_ids, rng)
+        added = target
+        started = time.perf_counter()
+        customers.archive_orders(db, args.archive_days)
+        archive_seconds = time.perf_counter() - started
+        hot = db.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+        archived = db.execute("SELECT COUNT(*) FROM orders_archive").fetchone()[0]
+        print(f"{archived:>10,}{hot:>8,}{archive_seconds:>11.1f}"
+              f"{timed(customer, '/orders', args.repeat):>11.2f}"
+              f"{timed(admin, '/admin/all_orders', args.repeat):>15.2f}"
+              f"{timed(customer, '/orders?history=1', args.repeat):>12.2f}")
+
+    assert not customers.check_aggregates(db), "archiving changed the dashboard totals"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Show that /buy latency does not grow with post-purchase work.
+
+Registers extra order.placed handlers that each take --handler-ms, then
+times /buy twice: with the work done inline (the request drains the outbox
+itself before returning) and with the background outbox worker. Reports
+median and p95 request latency and how long the worker took to catch up.
+
+    python benchmarks/outbox.py --handlers 0 1 3 5 --handler-ms 20 --requests 100
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "routes", "customers"))
+import customers  # noqa: E402
+
+
+def slow_handler(index, seconds):
+    def handler(event):
+        time.sleep(seconds)
+    handler.__name__ = f"bench_handler_{index}"
+    return handler
+
+
+def pending(db):
+    return db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+
+def time_buys(client, db, product_ids, requests, inline):
+    samples = []
+    for i in range(requests):
+        started = time.perf_counter()
+        assert client.get(f"/buy/{product_ids[i % len(product_ids)]}").status_code == 302
+        if inline:
+            while any(customers.drain_outbox(db)):
+                pass
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.95)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--handlers", type=int, nargs="+", default=[0, 1, 3, 5],
+                        help="numbers of extra handlers to measure with")
+    parser.add_argument("--handler-ms", type=float, default=20)
+    parser.add_argument("--requests", type=int, default=100)
+    args = parser.parse_args()
+
+    customers.DATABASE = os.path.join(tempfile.mkdtemp(), "bench.db")
+    customers.app.config["OUTBOX_SINK_PATH"] = customers.outbox_sink.path = os.devnull
+    customers.init_db()
+    db = customers.connect_db()
+    customers.seed_synthetic_data(db, users=100, sellers=10, products=1000, orders=0)
+    db.execute("UPDATE products SET stock = 1000000")
+    db.commit()
+    product_ids = [row[0] for row in db.execute("SELECT id FROM products")]
+    user_id = db.execute("SELECT id FROM users WHERE role = 'user' LIMIT 1").fetchone()[0]
+    client = customers.app.test_client()
+    with client.session_transaction() as sess:
+        sess.update(user_id=user_id, role="user", username="bench")
+
+    base_handlers = list(customers.OUTBOX_HANDLERS["order.placed"])
+    worker_db = customers.connect_db()
+    print(f"{'handlers':>8}{'inline p50':>12}{'inline p95':>12}{'outbox p50':>12}{'outbox p95':>12}{'catch-up s':>12}")
+    for count in args.handlers:
+        customers.OUTBOX_HANDLERS["order.placed"] = base_handlers + [
+            slow_handler(i, args.handler_ms / 1000) for i in range(count)]
+        inline = time_buys(client, db, product_ids, args.requests, inline=True)
+
+        stop = customers.threading.Event()
+        worker = customers.threading.Thread(target=customers.run_outbox_worker, args=(worker_db, stop))
+        worker.start()
+        outbox = time_buys(client, db, product_ids, args.requests, inline=False)
+        started = time.perf_counter()
+        while pending(db):
+            time.sleep(0.01)
+        catch_up = time.perf_counter() - started
+        stop.set()
+        customers.outbox_wakeup.set()
+        worker.join()
+        print(f"{count:>8}{inline[0]:>12.2f}{inline[1]:>12.2f}{outbox[0]:>12.2f}{outbox[1]:>12.2f}{catch_up:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
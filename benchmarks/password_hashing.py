@@ -0,0 +1,84 @@
+"""Measure /login throughput at several password hashing costs.
+
+For each method, stores one user hashed with it and fires parallel logins
+through the Flask test client. Reports logins per second overall and per
+core used by the hashing pool.
+
+    python benchmarks/password_hashing.py --logins 200 --threads 16
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "routes", "customers"))
+import customers  # noqa: E402
+
+METHODS = [
+    "pbkdf2:sha256:100000",
+    "pbkdf2:sha256:300000",
+    "pbkdf2:sha256:600000",
+    "scrypt:16384:8:1",
+    "scrypt:32768:8:1",
+    "scrypt:65536:8:1",
+]
+
+
+def run_logins(email, password, logins, threads):
+    per_thread = logins // threads
+    failures = []
+    start_barrier = threading.Barrier(threads)
+
+    def client():
+        test_client = customers.app.test_client()
+        start_barrier.wait()
+        for _ in range(per_thread):
+            response = test_client.post("/login", data={"email": email, "password": password})
+            if response.status_code != 302:
+                failures.append(response.status_code)
+
+    workers = [threading.Thread(target=client) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return per_thread * threads, time.perf_counter() - started, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="size of the hashing pool")
+    parser.add_argument("--methods", nargs="*", default=METHODS)
+    args = parser.parse_args()
+
+    customers.DATABASE = os.path.join(tempfile.mkdtemp(), "bench.db")
+    customers.init_db()
+    db = customers.connect_db()
+    cores = min(args.workers, os.cpu_count() or 1)
+
+    print(f"hashing pool: {args.workers} workers on {os.cpu_count()} cores")
+    print(f"{'method':<24}{'ms/hash':>9}{'logins/s':>10}{'per core':>10}")
+    for index, method in enumerate(args.methods):
+        customers.password_hasher = customers.PasswordHasher(method, args.workers, args.threads * 2)
+        email, password = f"bench{index}@example.com", "correct horse"
+        started = time.perf_counter()
+        stored = customers.password_hasher.hash(password)
+        hash_ms = (time.perf_counter() - started) * 1000
+        db.execute("INSERT INTO users (username, email, password, role) VALUES (?,?,?, 'user')",
+                   (f"bench{index}", email, stored))
+        db.commit()
+
+        logins, elapsed, failures = run_logins(email, password, args.logins, args.threads)
+        assert not failures, failures[:5]
+        rate = logins / elapsed
+        print(f"{method:<24}{hash_ms:>9.1f}{rate:>10.1f}{rate / cores:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Compare "frequently bought together" lookups with the naive per-view query.
+
+Seeds orders, times the batched rebuild_recommendations() backfill, then
+times, over random popular products, the naive self-join of orders that a
+product page would otherwise run against the top-K table lookup. Also
+times apply_co_purchases() per new order, the incremental path.
+
+    python benchmarks/recommendations.py --orders 100000 500000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "routes", "customers"))
+import customers  # noqa: E402
+
+NAIVE_QUERY = """SELECT o2.product_id, COUNT(DISTINCT o1.user_id || ' ' || date(o1.order_date)) AS baskets
+                 FROM order_history o1
+                 JOIN order_history o2 ON o2.user_id = o1.user_id
+                      AND date(o2.order_date) = date(o1.order_date) AND o2.product_id != o1.product_id
+                 WHERE o1.product_id = ?
+                 GROUP BY o2.product_id ORDER BY baskets DESC, o2.product_id LIMIT ?"""
+
+
+def median_ms(func, args_list):
+    samples = []
+    for args in args_list:
+        started = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, nargs="+", default=[100_000, 500_000])
+    parser.add_argument("--products", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--samples", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    print(f"{'orders':>9}{'pairs':>10}{'rebuild s':>11}{'naive ms':>10}{'top-k ms':>10}{'apply ms/order':>16}")
+    for orders in args.orders:
+        customers.DATABASE = os.path.join(tempfile.mkdtemp(), "bench.db")
+        customers.init_db()
+        db = customers.connect_db()
+        customers.seed_synthetic_data(db, users=args.users, sellers=200, products=args.products,
+                                      orders=orders, days=365)
+        started = time.perf_counter()
+        pairs, _ = customers.rebuild_recommendations(db)
+        rebuild = time.perf_counter() - started
+
+        # Popular products are the ones that get viewed
+        popular = [row[0] for row in db.execute(
+            "SELECT product_id FROM product_sales ORDER BY order_count DESC LIMIT 200")]
+        sample = [(rng.choice(popular),) for _ in range(args.samples)]
+        shown = customers.app.config["RECOMMENDATIONS_SHOWN"]
+        naive = median_ms(lambda pid: db.execute(NAIVE_QUERY, (pid, shown)).fetchall(), sample)
+        top_k = median_ms(lambda pid: customers.get_recommendations(db, [pid]), sample)
+
+        # New orders for existing customers, applied a batch at a time
+        users = [row[0] for row in db.execute("SELECT id FROM users WHERE role = 'user' LIMIT 500")]
+        db.executemany(customers.ORDER_INSERT, [(rng.choice(users), rng.choice(popular), 1) for _ in range(2000)])
+        db.commit()
+        started = time.perf_counter()
+        applied = 0
+        while True:
+            count = customers.apply_co_purchases(db)
+            applied += count
+            if count < customers.CO_PURCHASE_APPLY_BATCH:
+                break
+        apply = (time.perf_counter() - started) * 1000 / max(applied, 1)
+        print(f"{orders:>9,}{pairs:>10,}{rebuild:>11.1f}{naive:>10.1f}{top_k:>10.2f}{apply:>16.3f}")
+        db.close()
+        customers.close_pools()
+
+
+if __name__ == "__main__":
+    main()
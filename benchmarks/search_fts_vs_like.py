@@ -0,0 +1,93 @@
+"""Compare FTS5 product search with a LIKE '%term%' scan.
+
+Seeds a synthetic catalog (1M products by default), then times the same
+search terms through search_products() and through the naive LIKE query.
+
+    python benchmarks/search_fts_vs_like.py --products 1000000 --repeat 5
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "routes", "customers"))
+import customers  # noqa: E402
+
+COMMON_WORDS = ("wireless bluetooth headphones premium cotton shirt smart home speaker decorative "
+                "table lamp leather wallet steel bottle gaming mouse keyboard mechanical office chair "
+                "running shoes yoga mat coffee grinder ceramic mug laptop stand phone case charger "
+                "camera tripod backpack travel kettle electric blender organic tea notebook").split()
+
+TERMS = ["headphones", "ceramic mug", "gam", "organic tea kettle", "zzzz"]
+
+
+def make_vocabulary(rng, size=20_000):
+    """Real product words plus synthetic brand/model words, drawn Zipf-style."""
+    syllables = ["ka", "lo", "mi", "ra", "to", "zen", "vex", "pro", "lux", "neo", "qua", "dor"]
+    words = list(COMMON_WORDS)
+    while len(words) < size:
+        words.append("".join(rng.choices(syllables, k=rng.randint(2, 4))))
+    rng.shuffle(words)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    return words, cum_weights
+
+
+LIKE_SQL = """SELECT p.id, p.name, p.price FROM products p
+              WHERE (p.name LIKE ? OR p.description LIKE ?) AND p.stock > 0
+              LIMIT ?"""
+
+
+def seed(db, count, batch=50_000):
+    rng = random.Random(42)
+    words, cum_weights = make_vocabulary(rng)
+    for start in range(0, count, batch):
+        rows = []
+        for _ in range(min(batch, count - start)):
+            name = " ".join(rng.choices(words, cum_weights=cum_weights, k=3)).title()
+            description = " ".join(rng.choices(words, cum_weights=cum_weights, k=12))
+            rows.append((name, rng.randint(100, 50_000), rng.randint(0, 50), description))
+        db.executemany("INSERT INTO products (name, price, stock, description) VALUES (?,?,?,?)", rows)
+        db.commit()
+
+
+def timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    customers.DATABASE = os.path.join(tempfile.mkdtemp(), "bench.db")
+    customers.init_db()
+    db = customers.connect_db()
+
+    started = time.perf_counter()
+    seed(db, args.products)
+    print(f"seeded {args.products:,} products in {time.perf_counter() - started:.1f}s")
+
+    page_size = customers.app.config["CATALOG_PAGE_SIZE"]
+    print(f"{'term':<22}{'fts5 ms':>10}{'like ms':>10}{'speedup':>10}{'hits':>6}")
+    for term in TERMS:
+        fts_time, (rows, _) = timed(lambda: customers.search_products(db, term), args.repeat)
+        # LIKE cannot rank, so it only has to find the first page; this
+        # flatters LIKE whenever the term is common
+        pattern = f"%{term}%"
+        like_time, _ = timed(lambda: db.execute(LIKE_SQL, (pattern, pattern, page_size)).fetchall(),
+                             args.repeat)
+        print(f"{term:<22}{fts_time * 1000:>10.2f}{like_time * 1000:>10.2f}"
+              f"{like_time / fts_time:>9.1f}x{len(rows):>6}")
+
+
+if __name__ == "__main__":
+    main()
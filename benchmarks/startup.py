@@ -0,0 +1,98 @@
+"""Measure startup phases and forked workers' first requests, cold vs warmed.
+
+Runs create_app() in this (master) process with and without STARTUP_WARM,
+then forks --workers children the way a pre-fork server does. Each child
+times its first few requests. Prints the master's phase timings and the
+workers' median first-request latency per route.
+
+    python benchmarks/startup.py --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "routes", "customers"))
+import customers  # noqa: E402
+
+ROUTES = {
+    "home": ("user", "/home"),
+    "orders": ("user", "/orders"),
+    "seller": ("seller", "/seller"),
+    "admin": ("admin", "/admin"),
+}
+
+
+def worker(ids, out):
+    results = {}
+    for name, (role, url) in ROUTES.items():
+        client = customers.app.test_client()
+        with client.session_transaction() as sess:
+            sess.update(user_id=ids[role], role=role, username="bench", shop_name="Bench")
+        started = time.perf_counter()
+        assert client.get(url).status_code == 200, url
+        results[name] = (time.perf_counter() - started) * 1000
+    results["worker_ready"] = customers.STARTUP_TIMINGS["worker_ready"] * 1000
+    os.write(out, (json.dumps(results) + "\n").encode())
+
+
+def fork_workers(count, ids):
+    sys.stdout.flush()  # or every child would print the buffered lines again
+    read_end, write_end = os.pipe()
+    pids = []
+    for _ in range(count):
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            try:
+                worker(ids, write_end)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    os.close(write_end)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    with os.fdopen(read_end) as f:
+        return [json.loads(line) for line in f]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    customers.DATABASE = os.path.join(tempfile.mkdtemp(), "bench.db")
+    customers.init_db()
+    db = customers.connect_db()
+    customers.seed_synthetic_data(db, users=2000, sellers=100, products=20_000, orders=200_000)
+    ids = {
+        "user": db.execute("SELECT user_id FROM customer_orders ORDER BY order_count DESC LIMIT 1").fetchone()[0],
+        "seller": db.execute("SELECT seller_id FROM seller_sales WHERE seller_id > 0 LIMIT 1").fetchone()[0],
+        "admin": db.execute("SELECT id FROM users WHERE role = 'admin' LIMIT 1").fetchone()[0],
+    }
+    db.close()
+    customers.close_pools()
+
+    print(f"import: {customers.STARTUP_TIMINGS['import'] * 1000:.0f} ms")
+    print(f"{'mode':<8}{'create_app':>11}{'templates':>10}{'warm_db':>9}"
+          + "".join(f"{name:>9}" for name in ROUTES) + f"{'ready':>8}   (ms, worker medians)")
+    for warm in (False, True):
+        customers.STARTUP_TIMINGS.pop("templates", None)
+        customers.STARTUP_TIMINGS.pop("warm_db", None)
+        customers.app.jinja_env.cache.clear()
+        customers.create_app({"STARTUP_WARM": warm})
+        timings = {k: v * 1000 for k, v in customers.STARTUP_TIMINGS.items()}
+        results = fork_workers(args.workers, ids)
+
+        def median(key):
+            values = sorted(r[key] for r in results)
+            return values[len(values) // 2]
+        print(f"{'warm' if warm else 'cold':<8}{timings['create_app']:>11.1f}{timings.get('templates', 0):>10.1f}"
+              f"{timings.get('warm_db', 0):>9.1f}" + "".join(f"{median(name):>9.1f}" for name in ROUTES)
+              + f"{median('worker_ready'):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
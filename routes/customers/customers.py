@@ -1,156 +1,3296 @@
-from flask import Flask, render_template, request, redirect, url_for, session, g, flash
+import time
+
+# Start of this process (reset in forked workers); see STARTUP_TIMINGS
+_process_started = time.perf_counter()
+
+from flask import (Flask, render_template, request, redirect, url_for, session, g, flash, jsonify, Response,
+                   send_from_directory, get_template_attribute, has_request_context)
 import sqlite3
+import click
 from werkzeug.security import generate_password_hash, check_password_hash
+from markupsafe import Markup, escape
 import os
+import base64
+import csv
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import zlib
+import re
+from collections import OrderedDict, deque, namedtuple
+import queue
+import random
+import threading
 import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip variants are built
+    brotli = None
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional: without it uploads are served as they are
+    Image = ImageOps = None
+from datetime import datetime, timezone
+from jinja2 import TemplateError
+
+# ------------------ Flask App ------------------
+# Get the absolute path to the project root
+try:
+    # If running from routes/customers/ folder
+    PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+except:
+    # If running from project root
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+app = Flask(
+    __name__,
+    template_folder=os.path.join(PROJECT_ROOT, "templates"),
+    static_folder=os.path.join(PROJECT_ROOT, "static")
+)
+app.secret_key = os.environ.get("SECRET_KEY", "supersecretkey123")
+
+# Number of products per catalog page on /home
+app.config["CATALOG_PAGE_SIZE"] = int(os.environ.get("CATALOG_PAGE_SIZE", 24))
+
+# How long a connection waits on a locked database, and how often a
+# write transaction is retried with backoff once that wait runs out
+app.config["DB_BUSY_TIMEOUT_MS"] = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 5000))
+app.config["DB_WRITE_RETRIES"] = int(os.environ.get("DB_WRITE_RETRIES", 5))
+
+# Connection pool and per-connection tuning
+app.config["DB_POOL_SIZE"] = int(os.environ.get("DB_POOL_SIZE", 8))
+app.config["DB_CACHE_SIZE_KB"] = int(os.environ.get("DB_CACHE_SIZE_KB", 64 * 1024))
+app.config["DB_MMAP_SIZE"] = int(os.environ.get("DB_MMAP_SIZE", 256 * 1024 * 1024))
+app.config["DB_STATEMENT_CACHE"] = int(os.environ.get("DB_STATEMENT_CACHE", 256))
+
+# Catalog read cache: entry bound, TTL in seconds, and an optional SQLite
+# file shared by all worker processes to keep invalidations coherent
+app.config["CATALOG_CACHE_SIZE"] = int(os.environ.get("CATALOG_CACHE_SIZE", 512))
+app.config["CATALOG_CACHE_TTL"] = float(os.environ.get("CATALOG_CACHE_TTL", 60))
+app.config["CATALOG_CACHE_SHARED_PATH"] = os.environ.get("CATALOG_CACHE_SHARED_PATH")
+
+# Password hashing: any Werkzeug method string ("scrypt:32768:8:1",
+# "pbkdf2:sha256:600000", ...), the size of the hashing thread pool, and
+# how many hash jobs may wait for it before logins are turned away
+app.config["PASSWORD_HASH_METHOD"] = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
+app.config["PASSWORD_HASH_WORKERS"] = int(os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+app.config["PASSWORD_HASH_MAX_PENDING"] = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 64))
+
+# Rendered product card/grid fragments kept in memory
+app.config["FRAGMENT_CACHE_SIZE"] = int(os.environ.get("FRAGMENT_CACHE_SIZE", 2048))
+
+# Dynamic responses at least this large are gzip/brotli compressed
+app.config["COMPRESS_MIN_SIZE"] = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+app.config["COMPRESS_GZIP_LEVEL"] = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+app.config["COMPRESS_BROTLI_QUALITY"] = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 5))
+
+# Statements slower than this (execute plus fetches) go to the slow-query
+# log with their plan, and at most one a LOG_INTERVAL seconds to the app
+# logger; /metrics requires this bearer token when it is set
+app.config["SLOW_QUERY_MS"] = float(os.environ.get("SLOW_QUERY_MS", 100))
+app.config["SLOW_QUERY_LOG_SIZE"] = int(os.environ.get("SLOW_QUERY_LOG_SIZE", 100))
+app.config["SLOW_QUERY_LOG_INTERVAL"] = float(os.environ.get("SLOW_QUERY_LOG_INTERVAL", 10))
+app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")
+
+# Orders older than ORDER_ARCHIVE_DAYS move to orders_archive in batches;
+# the background archiver runs every ORDER_ARCHIVE_INTERVAL seconds (0 = off)
+app.config["ORDER_ARCHIVE_DAYS"] = int(os.environ.get("ORDER_ARCHIVE_DAYS", 365))
+app.config["ORDER_ARCHIVE_BATCH"] = int(os.environ.get("ORDER_ARCHIVE_BATCH", 5000))
+app.config["ORDER_ARCHIVE_INTERVAL"] = float(os.environ.get("ORDER_ARCHIVE_INTERVAL", 3600))
+
+# Admin dashboard: products per page, and orders per page on /admin/all_orders
+app.config["ADMIN_PAGE_SIZE"] = int(os.environ.get("ADMIN_PAGE_SIZE", 50))
+
+# Seller dashboard: orders per page and rows in the per-product table
+app.config["SELLER_ORDERS_PAGE_SIZE"] = int(os.environ.get("SELLER_ORDERS_PAGE_SIZE", 20))
+app.config["SELLER_TOP_PRODUCTS"] = int(os.environ.get("SELLER_TOP_PRODUCTS", 10))
+
+# Post-purchase outbox: events per batch, retry policy, how often the
+# worker thread polls (0 disables it) and how long done events are kept
+app.config["OUTBOX_BATCH_SIZE"] = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+app.config["OUTBOX_MAX_ATTEMPTS"] = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 8))
+app.config["OUTBOX_RETRY_SECONDS"] = float(os.environ.get("OUTBOX_RETRY_SECONDS", 5))
+app.config["OUTBOX_LEASE_SECONDS"] = float(os.environ.get("OUTBOX_LEASE_SECONDS", 60))
+app.config["OUTBOX_POLL_INTERVAL"] = float(os.environ.get("OUTBOX_POLL_INTERVAL", 1.0))
+app.config["OUTBOX_RETENTION_DAYS"] = int(os.environ.get("OUTBOX_RETENTION_DAYS", 7))
+app.config["OUTBOX_SINK_PATH"] = os.environ.get("OUTBOX_SINK_PATH", os.path.join(PROJECT_ROOT, "outbox_sink.jsonl"))
+
+# Flash-sale mode: purchases of hot products (more than HOT_RATE buys a
+# second; 0 makes every product hot) are queued for one writer thread that
+# commits up to BATCH of them per transaction, lingering LINGER_MS for
+# more. A request waits up to TIMEOUT seconds for the writer to take it.
+app.config["FLASH_SALE"] = bool(int(os.environ.get("FLASH_SALE", 0)))
+app.config["FLASH_SALE_HOT_RATE"] = int(os.environ.get("FLASH_SALE_HOT_RATE", 20))
+app.config["FLASH_SALE_BATCH"] = int(os.environ.get("FLASH_SALE_BATCH", 256))
+app.config["FLASH_SALE_LINGER_MS"] = float(os.environ.get("FLASH_SALE_LINGER_MS", 0))
+app.config["FLASH_SALE_TIMEOUT"] = float(os.environ.get("FLASH_SALE_TIMEOUT", 5.0))
+
+# "Frequently bought together": products kept per product, how many a
+# page shows, and users per transaction when rebuilding from all orders
+app.config["RECOMMENDATIONS_TOP_K"] = int(os.environ.get("RECOMMENDATIONS_TOP_K", 20))
+app.config["RECOMMENDATIONS_SHOWN"] = int(os.environ.get("RECOMMENDATIONS_SHOWN", 4))
+app.config["RECOMMENDATIONS_REBUILD_BATCH"] = int(os.environ.get("RECOMMENDATIONS_REBUILD_BATCH", 5000))
+
+# Uploaded product images: where they are stored, the largest accepted
+# upload and how many processes resize them
+app.config["IMAGE_STORE_DIR"] = os.environ.get("IMAGE_STORE_DIR", os.path.join(PROJECT_ROOT, "media"))
+app.config["IMAGE_MAX_BYTES"] = int(os.environ.get("IMAGE_MAX_BYTES", 8 * 1024 * 1024))
+app.config["IMAGE_WORKERS"] = int(os.environ.get("IMAGE_WORKERS", os.cpu_count() or 1))
+
+# create_app(): compile templates and warm caches before workers fork, and
+# whether each worker runs the archiver thread itself (off when it runs as
+# `flask archive-orders`). Each worker drains the outbox unless
+# OUTBOX_WORKER=0, for when `flask drain-outbox --watch` runs instead;
+# purchases' emails, alerts and recommendations wait on one of the two.
+app.config["STARTUP_WARM"] = bool(int(os.environ.get("STARTUP_WARM", 1)))
+app.config["BACKGROUND_WORKERS"] = bool(int(os.environ.get("BACKGROUND_WORKERS", 0)))
+app.config["OUTBOX_WORKER"] = bool(int(os.environ.get("OUTBOX_WORKER", 1)))
+# What every create_app() call starts from
+_default_config = dict(app.config)
+
+# ---------------- INSTRUMENTATION ------------------
+# Every connection from connect_db() times its statements and counts them
+# against the current request. Request latency is kept as a fixed-bucket
+# histogram per endpoint, so recording is a few additions under a lock.
+# Transaction control is not query work: BEGIN's time is the wait for the
+# write lock, reported as lock wait, and none of them is a slow query.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TRANSACTION_STATEMENTS = ("BEGIN", "COMMIT", "END", "ROLLBACK", "SAVEPOINT", "RELEASE")
+
+def statement_verb(sql):
+    return sql.lstrip()[:9].split(None, 1)[0].upper() if sql.strip() else ""
+
+class SlowQueryLog:
+    def __init__(self, size):
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.total = 0
+        self._logged_at = float("-inf")
+        self._suppressed = 0
+
+    def add(self, db, sql, parameters, seconds):
+        try:
+            plan = [row[3] for row in sqlite3.Connection.execute(
+                db, "EXPLAIN QUERY PLAN " + sql, parameters if parameters is not None else ())]
+        except sqlite3.Error:
+            plan = None
+        entry = {
+            "sql": " ".join(sql.split()),
+            "ms": round(seconds * 1000, 2),
+            "endpoint": request.endpoint if has_request_context() else None,
+            "plan": plan,
+            "at": time.time(),
+        }
+        now = time.monotonic()
+        with self._lock:
+            self._entries.append(entry)
+            self.total += 1
+            suppressed = None
+            if now - self._logged_at >= app.config["SLOW_QUERY_LOG_INTERVAL"]:
+                suppressed, self._suppressed, self._logged_at = self._suppressed, 0, now
+            else:
+                self._suppressed += 1
+        if suppressed is not None:
+            app.logger.warning("Slow query (%s ms): %s plan=%s%s", entry["ms"], entry["sql"][:200], plan,
+                               f" ({suppressed} more since the last report)" if suppressed else "")
+
+    def entries(self):
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+slow_query_log = SlowQueryLog(app.config["SLOW_QUERY_LOG_SIZE"])
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times its statement across execute() and the fetch calls.
+
+    Rows consumed by plain iteration are not timed; that would add a
+    Python call per row. executemany() batches are timed and counted but
+    kept out of the slow-query log, where bulk loads would drown it.
+    """
+    _sql = _parameters = None
+    _seconds = 0.0
+    _slow_logged = False
+
+    def _track(self, elapsed, statement=None, bulk=False):
+        if statement is not None:
+            self._sql, self._parameters = statement
+            self._seconds, self._slow_logged = 0.0, bulk
+            verb = statement_verb(self._sql)
+            if verb in TRANSACTION_STATEMENTS:
+                self._slow_logged = True
+                if verb == "BEGIN":
+                    request_metrics.observe_lock_wait(elapsed)
+                    return
+        self._seconds += elapsed
+        if has_request_context():
+            g.sql_seconds = g.get("sql_seconds", 0.0) + elapsed
+            if statement is not None:
+                g.sql_queries = g.get("sql_queries", 0) + 1
+        if not self._slow_logged and self._seconds * 1000 >= app.config["SLOW_QUERY_MS"]:
+            self._slow_logged = True
+            slow_query_log.add(self.connection, self._sql, self._parameters, self._seconds)
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._track(time.perf_counter() - started, (sql, parameters))
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._track(time.perf_counter() - started, (sql, None), bulk=True)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._track(time.perf_counter() - started)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._track(time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._track(time.perf_counter() - started)
+
+class InstrumentedConnection(sqlite3.Connection):
+    # Connection.execute() does not go through cursor(), so route it here
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+class RequestMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}    # endpoint -> [bucket counts..., +Inf count], sum
+        self._responses = {}  # (endpoint, status) -> count
+        self._sql = {}        # endpoint -> [queries, seconds]
+        self._lock_waits = [0, 0.0]  # BEGIN statements, seconds
+
+    def observe(self, endpoint, status, seconds, queries, sql_seconds):
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound),
+                      len(LATENCY_BUCKETS))
+        with self._lock:
+            counts, total = self._latency.get(endpoint) or ([0] * (len(LATENCY_BUCKETS) + 1), 0.0)
+            counts[bucket] += 1
+            self._latency[endpoint] = (counts, total + seconds)
+            self._responses[(endpoint, status)] = self._responses.get((endpoint, status), 0) + 1
+            sql = self._sql.setdefault(endpoint, [0, 0.0])
+            sql[0] += queries
+            sql[1] += sql_seconds
+
+    def observe_lock_wait(self, seconds):
+        with self._lock:
+            self._lock_waits[0] += 1
+            self._lock_waits[1] += seconds
+
+    def render(self):
+        """Prometheus text exposition of the request, SQL and cache counters."""
+        with self._lock:
+            latency = {k: (list(v[0]), v[1]) for k, v in self._latency.items()}
+            responses = dict(self._responses)
+            sql = {k: list(v) for k, v in self._sql.items()}
+            lock_waits, lock_wait_seconds = self._lock_waits
+
+        lines = ["# HELP http_request_duration_seconds Request latency by endpoint.",
+                 "# TYPE http_request_duration_seconds histogram"]
+        for endpoint, (counts, total) in sorted(latency.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_sum{{endpoint="{endpoint}"}} {total:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{endpoint="{endpoint}"}} {cumulative}')
+        lines += ["# HELP http_responses_total Responses by endpoint and status.",
+                  "# TYPE http_responses_total counter"]
+        for (endpoint, status), count in sorted(responses.items()):
+            lines.append(f'http_responses_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+        lines += ["# HELP sql_queries_total SQL statements run while serving each endpoint.",
+                  "# TYPE sql_queries_total counter"]
+        lines += [f'sql_queries_total{{endpoint="{e}"}} {q}' for e, (q, _) in sorted(sql.items())]
+        lines += ["# HELP sql_query_seconds_total Time spent in SQL while serving each endpoint.",
+                  "# TYPE sql_query_seconds_total counter"]
+        lines += [f'sql_query_seconds_total{{endpoint="{e}"}} {t:.6f}' for e, (_, t) in sorted(sql.items())]
+        lines += ["# HELP sql_slow_queries_total Statements slower than SLOW_QUERY_MS.",
+                  "# TYPE sql_slow_queries_total counter",
+                  f"sql_slow_queries_total {slow_query_log.total}"]
+        lines += ["# HELP sql_lock_waits_total Transactions begun, in requests and background threads.",
+                  "# TYPE sql_lock_waits_total counter",
+                  f"sql_lock_waits_total {lock_waits}",
+                  "# HELP sql_lock_wait_seconds_total Time spent in BEGIN waiting for the database lock.",
+                  "# TYPE sql_lock_wait_seconds_total counter",
+                  f"sql_lock_wait_seconds_total {lock_wait_seconds:.6f}"]
+        lines += ["# HELP app_startup_seconds Time spent in each startup phase of this process.",
+                  "# TYPE app_startup_seconds gauge"]
+        lines += [f'app_startup_seconds{{phase="{phase}"}} {seconds:.6f}'
+                  for phase, seconds in sorted(STARTUP_TIMINGS.items())]
+        for prefix, stats in (("catalog_cache", catalog_cache.stats()),
+                              ("fragment_cache", fragment_cache.stats()),
+                              ("response_compression", compression_stats.stats()),
+                              ("flash_sale", flash_sale_queue.stats())):
+            for name, value in sorted(stats.items()):
+                kind = "gauge" if name == "entries" else "counter"
+                metric = f"{prefix}_{name}" if kind == "gauge" else f"{prefix}_{name}_total"
+                lines += [f"# TYPE {metric} {kind}", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+request_metrics = RequestMetrics()
+
+# Seconds spent in each startup phase of this process: import, templates,
+# warm_db and create_app in the master, worker_ready (fork or import to
+# the first request) in every worker
+STARTUP_TIMINGS = {}
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_seconds = 0.0
+    if "worker_ready" not in STARTUP_TIMINGS:
+        STARTUP_TIMINGS["worker_ready"] = g.request_started - _process_started
+        if app.config["BACKGROUND_WORKERS"]:
+            start_order_archiver()
+        if app.config["OUTBOX_WORKER"]:
+            start_outbox_worker()
+
+# Registered before the other after_request hooks, so it runs last and
+# the latency includes them (compression in particular)
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is not None:
+        request_metrics.observe(request.endpoint or "unmatched", response.status_code,
+                                time.perf_counter() - started, g.sql_queries, g.sql_seconds)
+    return response
+
+# ---------------- DATABASE ------------------
+DATABASE = os.environ.get("DATABASE", os.path.join(PROJECT_ROOT, "customers.db"))
+
+def connect_db(readonly=False):
+    db = sqlite3.connect(DATABASE,
+                         timeout=app.config["DB_BUSY_TIMEOUT_MS"] / 1000,
+                         cached_statements=app.config["DB_STATEMENT_CACHE"],
+                         check_same_thread=False,
+                         factory=InstrumentedConnection)
+    db.row_factory = sqlite3.Row
+    # WAL lets readers run alongside the single writer
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(f"PRAGMA busy_timeout={int(app.config['DB_BUSY_TIMEOUT_MS'])}")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute(f"PRAGMA cache_size=-{int(app.config['DB_CACHE_SIZE_KB'])}")
+    db.execute(f"PRAGMA mmap_size={int(app.config['DB_MMAP_SIZE'])}")
+    db.execute("PRAGMA temp_store=MEMORY")
+    if readonly:
+        db.execute("PRAGMA query_only=ON")
+    return db
+
+class ConnectionPool:
+    """A bounded LIFO pool of tuned connections to one database file.
+
+    LIFO hands back the most recently used connection, whose page cache
+    is the warmest. Connections are only ever used by one thread at a time.
+    """
+
+    def __init__(self, path, readonly, size):
+        self.path = path
+        self.readonly = readonly
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return connect_db(self.readonly)
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get(timeout=app.config["DB_BUSY_TIMEOUT_MS"] / 1000)
+
+    def release(self, db):
+        if db.in_transaction:
+            db.rollback()
+        self._idle.put(db)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(readonly=False):
+    key = (DATABASE, readonly)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(DATABASE, readonly, app.config["DB_POOL_SIZE"])
+    return pool
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+def get_db():
+    db = getattr(g, '_database', None)
+    if db is None:
+        db = g._database = get_pool().acquire()
+    return db
+
+def get_read_db():
+    """Pooled query_only connection for pages that never write."""
+    db = getattr(g, '_read_database', None)
+    if db is None:
+        db = g._read_database = get_pool(readonly=True).acquire()
+    return db
+
+@app.teardown_appcontext
+def close_connection(exception):
+    db = g.pop('_database', None)
+    if db is not None:
+        get_pool().release(db)
+    db = g.pop('_read_database', None)
+    if db is not None:
+        get_pool(readonly=True).release(db)
+
+def is_lock_error(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+def run_write_transaction(db, work):
+    """Run work(db) inside BEGIN IMMEDIATE, retrying with backoff on lock contention.
+
+    work() must not commit; its return value is passed through.
+    """
+    attempts = app.config["DB_WRITE_RETRIES"]
+    for attempt in range(attempts + 1):
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            result = work(db)
+            db.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            if db.in_transaction:
+                db.rollback()
+            if not is_lock_error(e) or attempt == attempts:
+                raise
+            time.sleep(min(0.5, 0.01 * 2 ** attempt) * random.uniform(0.5, 1.5))
+        except Exception:
+            if db.in_transaction:
+                db.rollback()
+            raise
+
+# ---------------- SCHEMA MIGRATIONS ------------------
+# Each migration runs once, in its own transaction, and bumps
+# PRAGMA user_version so existing data is never dropped on restart.
+MIGRATIONS = []
+
+def migration(version):
+    def register(func):
+        MIGRATIONS.append((version, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+@migration(1)
+def create_base_schema(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        username TEXT NOT NULL,
+                        email TEXT UNIQUE NOT NULL,
+                        password TEXT NOT NULL,
+                        role TEXT DEFAULT 'user',
+                        shop_name TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS products (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        name TEXT NOT NULL,
+                        price REAL NOT NULL,
+                        image TEXT,
+                        seller_id INTEGER,
+                        stock INTEGER DEFAULT 0,
+                        description TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY(seller_id) REFERENCES users(id))''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS orders (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER,
+                        product_id INTEGER,
+                        quantity INTEGER DEFAULT 1,
+                        order_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY(user_id) REFERENCES users(id),
+                        FOREIGN KEY(product_id) REFERENCES products(id))''')
+
+    # Seed sample data only into a brand new database
+    if cursor.execute("SELECT COUNT(*) FROM users").fetchone()[0]:
+        return
+
+    sample_products = [
+        ("iPhone 15", 1200, "https://via.placeholder.com/150", None, 10, "Latest iPhone model"),
+        ("Samsung S24", 1100, "https://via.placeholder.com/150", None, 15, "Samsung flagship phone"),
+        ("MacBook Air", 1500, "https://via.placeholder.com/150", None, 5, "Apple laptop"),
+        ("Sony Headphones", 200, "https://via.placeholder.com/150", None, 20, "High quality headphones")
+    ]
+    cursor.executemany("INSERT INTO products (name, price, image, seller_id, stock, description) VALUES (?, ?, ?, ?, ?, ?)", sample_products)
+
+    cursor.execute(
+        "INSERT INTO users (username, email, password, role) VALUES (?, ?, ?, ?)",
+        ("admin", "admin@example.com", generate_password_hash("admin123"), "admin")
+    )
+    cursor.execute(
+        "INSERT INTO users (username, email, password, role, shop_name) VALUES (?, ?, ?, ?, ?)",
+        ("seller1", "seller@example.com", generate_password_hash("seller123"), "seller", "Tech Store")
+    )
+    print("👤 Default accounts created:")
+    print("   🔑 Admin: admin@example.com / admin123")
+    print("   🏪 Seller: seller@example.com / seller123")
+
+@migration(2)
+def create_query_indexes(cursor):
+    # users(email) is already covered by the UNIQUE constraint's autoindex
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_product ON orders(product_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_seller ON products(seller_id)")
+    # Keyset index for the paginated catalog (newest in-stock first)
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_products_catalog
+                      ON products(created_at, id) WHERE stock > 0''')
+
+@migration(3)
+def create_cart(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS cart_items (
+                        user_id INTEGER NOT NULL,
+                        product_id INTEGER NOT NULL,
+                        quantity INTEGER NOT NULL DEFAULT 1 CHECK (quantity > 0),
+                        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (user_id, product_id),
+                        FOREIGN KEY(user_id) REFERENCES users(id),
+                        FOREIGN KEY(product_id) REFERENCES products(id)) WITHOUT ROWID''')
+
+@migration(4)
+def create_product_search(cursor):
+    # External-content FTS5 index over products; triggers keep it in sync.
+    # Stock-only updates do not touch the index.
+    cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                        name, description,
+                        content='products', content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2',
+                        prefix='2 3')''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+                        INSERT INTO products_fts(rowid, name, description)
+                        VALUES (new.id, new.name, new.description);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+                        INSERT INTO products_fts(products_fts, rowid, name, description)
+                        VALUES ('delete', old.id, old.name, old.description);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_update
+                      AFTER UPDATE OF name, description ON products BEGIN
+                        INSERT INTO products_fts(products_fts, rowid, name, description)
+                        VALUES ('delete', old.id, old.name, old.description);
+                        INSERT INTO products_fts(rowid, name, description)
+                        VALUES (new.id, new.name, new.description);
+                      END''')
+    cursor.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+# Products with stock below this count as "low stock" on the seller
+# dashboard. The value is baked into the triggers below.
+LOW_STOCK_THRESHOLD = 5
+
+@migration(5)
+def create_dashboard_aggregates(cursor):
+    # Summary tables for the dashboards. Products without a seller
+    # (added by an admin) are accounted under seller_id 0.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS product_sales (
+                        product_id INTEGER PRIMARY KEY,
+                        order_count INTEGER NOT NULL DEFAULT 0,
+                        units_sold INTEGER NOT NULL DEFAULT 0,
+                        revenue REAL NOT NULL DEFAULT 0)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS seller_sales (
+                        seller_id INTEGER PRIMARY KEY,
+                        order_count INTEGER NOT NULL DEFAULT 0,
+                        units_sold INTEGER NOT NULL DEFAULT 0,
+                        revenue REAL NOT NULL DEFAULT 0)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS daily_orders (
+                        day TEXT PRIMARY KEY,
+                        order_count INTEGER NOT NULL DEFAULT 0,
+                        units INTEGER NOT NULL DEFAULT 0)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS customer_orders (
+                        user_id INTEGER PRIMARY KEY,
+                        order_count INTEGER NOT NULL DEFAULT 0)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS seller_low_stock (
+                        seller_id INTEGER PRIMARY KEY,
+                        low_stock_count INTEGER NOT NULL DEFAULT 0)''')
+
+    # Triggers run inside the writing statement's transaction, so the
+    # aggregates commit or roll back together with buy(), checkout,
+    # delete_order() and product deletes.
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS orders_agg_insert AFTER INSERT ON orders BEGIN
+                        INSERT INTO product_sales (product_id, order_count, units_sold, revenue)
+                        SELECT new.product_id, 1, new.quantity, new.quantity * p.price
+                        FROM products p WHERE p.id = new.product_id
+                        ON CONFLICT(product_id) DO UPDATE SET
+                            order_count = order_count + 1,
+                            units_sold = units_sold + excluded.units_sold,
+                            revenue = revenue + excluded.revenue;
+                        INSERT INTO seller_sales (seller_id, order_count, units_sold, revenue)
+                        SELECT COALESCE(p.seller_id, 0), 1, new.quantity, new.quantity * p.price
+                        FROM products p WHERE p.id = new.product_id
+                        ON CONFLICT(seller_id) DO UPDATE SET
+                            order_count = order_count + 1,
+                            units_sold = units_sold + excluded.units_sold,
+                            revenue = revenue + excluded.revenue;
+                        INSERT INTO daily_orders (day, order_count, units)
+                        VALUES (date(new.order_date), 1, new.quantity)
+                        ON CONFLICT(day) DO UPDATE SET
+                            order_count = order_count + 1,
+                            units = units + excluded.units;
+                        INSERT INTO customer_orders (user_id, order_count) VALUES (new.user_id, 1)
+                        ON CONFLICT(user_id) DO UPDATE SET order_count = order_count + 1;
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS orders_agg_delete AFTER DELETE ON orders BEGIN
+                        UPDATE seller_sales SET
+                            order_count = order_count - 1,
+                            units_sold = units_sold - old.quantity,
+                            revenue = revenue - old.quantity * (SELECT price FROM products WHERE id = old.product_id)
+                        WHERE seller_id = (SELECT COALESCE(seller_id, 0) FROM products WHERE id = old.product_id);
+                        UPDATE product_sales SET
+                            order_count = order_count - 1,
+                            units_sold = units_sold - old.quantity,
+                            revenue = revenue - old.quantity * (SELECT price FROM products WHERE id = old.product_id)
+                        WHERE product_id = old.product_id
+                          AND EXISTS (SELECT 1 FROM products WHERE id = old.product_id);
+                        UPDATE daily_orders SET
+                            order_count = order_count - 1,
+                            units = units - old.quantity
+                        WHERE day = date(old.order_date);
+                        UPDATE customer_orders SET order_count = order_count - 1 WHERE user_id = old.user_id;
+                        DELETE FROM customer_orders WHERE user_id = old.user_id AND order_count <= 0;
+                      END''')
+    # A deleted product takes its sales out of its seller's totals; orders
+    # deleted after it no longer find the product and skip those tables
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_agg_delete AFTER DELETE ON products BEGIN
+                        UPDATE seller_sales SET
+                            order_count = order_count - (SELECT order_count FROM product_sales WHERE product_id = old.id),
+                            units_sold = units_sold - (SELECT units_sold FROM product_sales WHERE product_id = old.id),
+                            revenue = revenue - (SELECT revenue FROM product_sales WHERE product_id = old.id)
+                        WHERE seller_id = COALESCE(old.seller_id, 0)
+                          AND EXISTS (SELECT 1 FROM product_sales WHERE product_id = old.id);
+                        DELETE FROM product_sales WHERE product_id = old.id;
+                        UPDATE seller_low_stock SET low_stock_count = low_stock_count - 1
+                        WHERE seller_id = COALESCE(old.seller_id, 0) AND old.stock < %(low)d;
+                      END''' % {"low": LOW_STOCK_THRESHOLD})
+    # Revenue follows the current product price, as the order views do
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_agg_price AFTER UPDATE OF price ON products
+                      WHEN new.price IS NOT old.price BEGIN
+                        UPDATE seller_sales SET
+                            revenue = revenue + (new.price - old.price) *
+                                (SELECT units_sold FROM product_sales WHERE product_id = new.id)
+                        WHERE seller_id = COALESCE(new.seller_id, 0)
+                          AND EXISTS (SELECT 1 FROM product_sales WHERE product_id = new.id);
+                        UPDATE product_sales SET revenue = revenue + (new.price - old.price) * units_sold
+                        WHERE product_id = new.id;
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_low_stock_insert AFTER INSERT ON products
+                      WHEN new.stock < %(low)d BEGIN
+                        INSERT INTO seller_low_stock (seller_id, low_stock_count)
+                        VALUES (COALESCE(new.seller_id, 0), 1)
+                        ON CONFLICT(seller_id) DO UPDATE SET low_stock_count = low_stock_count + 1;
+                      END''' % {"low": LOW_STOCK_THRESHOLD})
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_low_stock_update AFTER UPDATE OF stock ON products
+                      WHEN (new.stock < %(low)d) IS NOT (old.stock < %(low)d) BEGIN
+                        INSERT INTO seller_low_stock (seller_id, low_stock_count)
+                        VALUES (COALESCE(new.seller_id, 0),
+                                COALESCE(new.stock < %(low)d, 0) - COALESCE(old.stock < %(low)d, 0))
+                        ON CONFLICT(seller_id) DO UPDATE SET
+                            low_stock_count = low_stock_count + excluded.low_stock_count;
+                      END''' % {"low": LOW_STOCK_THRESHOLD})
+
+    # Filled in by migration 14, which rebuilds them from the price
+    # snapshots on the orders
+
+@migration(6)
+def create_order_date_index(cursor):
+    # Serves date-range exports in order_date order without a sort
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_date ON orders(order_date)")
+
+@migration(7)
+def add_product_sku(cursor):
+    # Seller-scoped SKU used by bulk import to upsert
+    cursor.execute("ALTER TABLE products ADD COLUMN sku TEXT")
+    cursor.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_products_seller_sku
+                      ON products(seller_id, sku) WHERE sku IS NOT NULL''')
+
+@migration(8)
+def add_deferrable_search_sync(cursor):
+    # Bulk writers set search_sync.deferred inside their own transaction and
+    # maintain products_fts set-based instead of row by row. Writers are
+    # serialized, so no other transaction ever sees the flag set.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS search_sync (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        deferred INTEGER NOT NULL DEFAULT 0)''')
+    cursor.execute("INSERT OR IGNORE INTO search_sync (id, deferred) VALUES (1, 0)")
+    for name in ("products_fts_insert", "products_fts_delete", "products_fts_update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+    cursor.execute('''CREATE TRIGGER products_fts_insert AFTER INSERT ON products
+                      WHEN (SELECT deferred FROM search_sync) = 0 BEGIN
+                        INSERT INTO products_fts(rowid, name, description)
+                        VALUES (new.id, new.name, new.description);
+                      END''')
+    cursor.execute('''CREATE TRIGGER products_fts_delete AFTER DELETE ON products
+                      WHEN (SELECT deferred FROM search_sync) = 0 BEGIN
+                        INSERT INTO products_fts(products_fts, rowid, name, description)
+                        VALUES ('delete', old.id, old.name, old.description);
+                      END''')
+    cursor.execute('''CREATE TRIGGER products_fts_update AFTER UPDATE OF name, description ON products
+                      WHEN (SELECT deferred FROM search_sync) = 0 BEGIN
+                        INSERT INTO products_fts(products_fts, rowid, name, description)
+                        VALUES ('delete', old.id, old.name, old.description);
+                        INSERT INTO products_fts(rowid, name, description)
+                        VALUES (new.id, new.name, new.description);
+                      END''')
+
+# Bumps one table_versions row; changed_at is unix seconds for Last-Modified
+BUMP_TABLE_VERSION = """UPDATE table_versions SET version = version + 1,
+                            changed_at = CAST(strftime('%%s', 'now') AS INTEGER)
+                        WHERE name = '%s'"""
+
+@migration(9)
+def create_table_versions(cursor):
+    # Change counters behind the catalog API's ETag and Last-Modified.
+    # "users" only tracks changes that show up in product listings. Bulk
+    # import defers the products triggers and bumps once per transaction.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS table_versions (
+                        name TEXT PRIMARY KEY,
+                        version INTEGER NOT NULL DEFAULT 0,
+                        changed_at INTEGER NOT NULL DEFAULT 0)''')
+    cursor.execute("""INSERT OR IGNORE INTO table_versions (name, version, changed_at)
+                      VALUES ('products', 1, CAST(strftime('%s', 'now') AS INTEGER)),
+                             ('users', 1, CAST(strftime('%s', 'now') AS INTEGER))""")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS products_version_{event.lower()}
+                           AFTER {event} ON products
+                           WHEN (SELECT deferred FROM search_sync) = 0 BEGIN
+                             {BUMP_TABLE_VERSION % "products"};
+                           END''')
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS users_version_update
+                       AFTER UPDATE OF shop_name ON users
+                       WHEN new.shop_name IS NOT old.shop_name BEGIN
+                         {BUMP_TABLE_VERSION % "users"};
+                       END''')
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS users_version_delete AFTER DELETE ON users BEGIN
+                         {BUMP_TABLE_VERSION % "users"};
+                       END''')
+
+# A deleted order comes out of the summary tables whichever partition it
+# lives in; orders merely moved to the archive stay counted
+ORDER_DELETE_AGGREGATES = """
+    UPDATE seller_sales SET
+        order_count = order_count - 1,
+        units_sold = units_sold - old.quantity,
+        revenue = revenue - old.quantity * (SELECT price FROM products WHERE id = old.product_id)
+    WHERE seller_id = (SELECT COALESCE(seller_id, 0) FROM products WHERE id = old.product_id);
+    UPDATE product_sales SET
+        order_count = order_count - 1,
+        units_sold = units_sold - old.quantity,
+        revenue = revenue - old.quantity * (SELECT price FROM products WHERE id = old.product_id)
+    WHERE product_id = old.product_id
+      AND EXISTS (SELECT 1 FROM products WHERE id = old.product_id);
+    UPDATE daily_orders SET
+        order_count = order_count - 1,
+        units = units - old.quantity
+    WHERE day = date(old.order_date);
+    UPDATE customer_orders SET order_count = order_count - 1 WHERE user_id = old.user_id;
+    DELETE FROM customer_orders WHERE user_id = old.user_id AND order_count <= 0;"""
+
+@migration(10)
+def create_order_archive(cursor):
+    # Cold partition for old orders. AUTOINCREMENT on orders means ids
+    # stay unique across both tables.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS orders_archive (
+                        id INTEGER PRIMARY KEY,
+                        user_id INTEGER,
+                        product_id INTEGER,
+                        quantity INTEGER DEFAULT 1,
+                        order_date TIMESTAMP)''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_user ON orders_archive(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_product ON orders_archive(product_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_date ON orders_archive(order_date)")
+    cursor.execute('''CREATE VIEW IF NOT EXISTS order_history AS
+                      SELECT id, user_id, product_id, quantity, order_date FROM orders
+                      UNION ALL
+                      SELECT id, user_id, product_id, quantity, order_date FROM orders_archive''')
+    # Set by archive_orders() inside its own transaction only
+    cursor.execute('''CREATE TABLE IF NOT EXISTS order_archive_state (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        moving INTEGER NOT NULL DEFAULT 0)''')
+    cursor.execute("INSERT OR IGNORE INTO order_archive_state (id, moving) VALUES (1, 0)")
+    cursor.execute("DROP TRIGGER IF EXISTS orders_agg_delete")
+    cursor.execute(f'''CREATE TRIGGER orders_agg_delete AFTER DELETE ON orders
+                       WHEN (SELECT moving FROM order_archive_state) = 0 BEGIN
+                         {ORDER_DELETE_AGGREGATES}
+                       END''')
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS orders_archive_agg_delete AFTER DELETE ON orders_archive BEGIN
+                         {ORDER_DELETE_AGGREGATES}
+                       END''')
+
+@migration(11)
+def add_order_seller(cursor):
+    # Orders carry their product's seller, so the seller dashboard pages
+    # and filters them off one index however many products the seller
+    # has. Both indexes cover the dashboard's filters, list and totals.
+    for table in ("orders", "orders_archive"):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN seller_id INTEGER")
+        cursor.execute(f"""UPDATE {table} SET seller_id =
+                           (SELECT seller_id FROM products WHERE products.id = {table}.product_id)""")
+        cursor.execute(f"DROP INDEX IF EXISTS idx_{table}_product")
+        cursor.execute(f"""CREATE INDEX IF NOT EXISTS idx_{table}_seller_date
+                           ON {table}(seller_id, order_date, id, product_id, quantity, user_id)""")
+        cursor.execute(f"""CREATE INDEX IF NOT EXISTS idx_{table}_product_date
+                           ON {table}(product_id, order_date, id, quantity, user_id, seller_id)""")
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS orders_set_seller AFTER INSERT ON orders
+                      WHEN new.seller_id IS NULL BEGIN
+                        UPDATE orders SET seller_id = (SELECT seller_id FROM products WHERE id = new.product_id)
+                        WHERE id = new.id;
+                      END''')
+    cursor.execute("DROP VIEW IF EXISTS order_history")
+    cursor.execute('''CREATE VIEW order_history AS
+                      SELECT id, user_id, product_id, quantity, order_date, seller_id FROM orders
+                      UNION ALL
+                      SELECT id, user_id, product_id, quantity, order_date, seller_id FROM orders_archive''')
+
+@migration(12)
+def create_outbox(cursor):
+    # Events written in the same transaction as the change they describe,
+    # drained later by the outbox worker. available_at is unix time; a
+    # claimed event is pushed forward by the lease so no other worker
+    # picks it up meanwhile.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS outbox (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        topic TEXT NOT NULL,
+                        idempotency_key TEXT NOT NULL UNIQUE,
+                        payload TEXT NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'pending'
+                            CHECK (status IN ('pending', 'done', 'failed')),
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        available_at REAL NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS REAL)),
+                        processed_at REAL,
+                        last_error TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_outbox_pending
+                      ON outbox(available_at, id) WHERE status = 'pending'""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_processed ON outbox(processed_at) WHERE status = 'done'")
+    # One row per handler that has seen an event, so a retry only reruns
+    # the handlers that failed
+    cursor.execute('''CREATE TABLE IF NOT EXISTS outbox_deliveries (
+                        event_id INTEGER NOT NULL,
+                        handler TEXT NOT NULL,
+                        delivered_at REAL NOT NULL,
+                        PRIMARY KEY (event_id, handler)) WITHOUT ROWID''')
+
+# Summary updates for a deleted order from its own snapshot, so they hold
+# even after the product itself is gone
+SNAPSHOT_DELETE_AGGREGATES = """
+    UPDATE seller_sales SET
+        order_count = order_count - 1,
+        units_sold = units_sold - old.quantity,
+        revenue = revenue - old.quantity * COALESCE(old.unit_price, 0)
+    WHERE seller_id = COALESCE(old.seller_id, 0);
+    UPDATE product_sales SET
+        order_count = order_count - 1,
+        units_sold = units_sold - old.quantity,
+        revenue = revenue - old.quantity * COALESCE(old.unit_price, 0)
+    WHERE product_id = old.product_id;
+    UPDATE daily_orders SET
+        order_count = order_count - 1,
+        units = units - old.quantity
+    WHERE day = date(old.order_date);
+    UPDATE customer_orders SET order_count = order_count - 1 WHERE user_id = old.user_id;
+    DELETE FROM customer_orders WHERE user_id = old.user_id AND order_count <= 0;"""
+
+@migration(13)
+def create_product_images(cursor):
+    # Uploaded images, keyed by content hash. A product using one points at
+    # the original through image, and image_variants lists the thumbnail
+    # widths once the image pool has written them.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS product_images (
+                        hash TEXT PRIMARY KEY,
+                        ext TEXT NOT NULL,
+                        width INTEGER,
+                        height INTEGER,
+                        variants TEXT,
+                        status TEXT NOT NULL DEFAULT 'pending'
+                            CHECK (status IN ('pending', 'ready', 'failed')),
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP) WITHOUT ROWID''')
+    cursor.execute("ALTER TABLE products ADD COLUMN image_key TEXT")
+    cursor.execute("ALTER TABLE products ADD COLUMN image_variants TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_image_key ON products(image_key) WHERE image_key IS NOT NULL")
+
+@migration(14)
+def snapshot_order_prices(cursor):
+    # Orders keep the name and unit price they were bought at, so order
+    # views and revenue read the orders alone, old orders no longer change
+    # with today's price, and a deleted product leaves its orders (and
+    # their sales) in place. Existing orders get the current values, the
+    # best there are.
+    for table in ("orders", "orders_archive"):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN unit_price REAL")
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN product_name TEXT")
+        cursor.execute(f"""UPDATE {table} SET (unit_price, product_name) =
+                           (SELECT price, name FROM products WHERE products.id = {table}.product_id)""")
+        # The dashboard's revenue sums are now covered by these as well
+        for index, columns in (("seller_date", "seller_id, order_date, id, product_id, quantity, user_id"),
+                               ("product_date", "product_id, order_date, id, quantity, user_id, seller_id")):
+            cursor.execute(f"DROP INDEX IF EXISTS idx_{table}_{index}")
+            cursor.execute(f"CREATE INDEX idx_{table}_{index} ON {table}({columns}, unit_price)")
+
+    # Writers stamp the snapshot through ORDER_INSERT; this fills it in for
+    # any other insert
+    cursor.execute("DROP TRIGGER IF EXISTS orders_set_seller")
+    cursor.execute('''CREATE TRIGGER orders_fill_snapshot AFTER INSERT ON orders
+                      WHEN new.unit_price IS NULL BEGIN
+                        UPDATE orders SET (seller_id, unit_price, product_name) =
+                            (SELECT COALESCE(new.seller_id, seller_id), price, name
+                             FROM products WHERE id = new.product_id)
+                        WHERE id = new.id;
+                      END''')
+    # new is the row as inserted, before orders_fill_snapshot ran
+    cursor.execute("DROP TRIGGER IF EXISTS orders_agg_insert")
+    cursor.execute('''CREATE TRIGGER orders_agg_insert AFTER INSERT ON orders BEGIN
+                        INSERT INTO product_sales (product_id, order_count, units_sold, revenue)
+                        VALUES (new.product_id, 1, new.quantity, new.quantity *
+                                COALESCE(new.unit_price, (SELECT price FROM products WHERE id = new.product_id), 0))
+                        ON CONFLICT(product_id) DO UPDATE SET
+                            order_count = order_count + 1,
+                            units_sold = units_sold + excluded.units_sold,
+                            revenue = revenue + excluded.revenue;
+                        INSERT INTO seller_sales (seller_id, order_count, units_sold, revenue)
+                        VALUES (COALESCE(new.seller_id, (SELECT seller_id FROM products WHERE id = new.product_id), 0),
+                                1, new.quantity, new.quantity *
+                                COALESCE(new.unit_price, (SELECT price FROM products WHERE id = new.product_id), 0))
+                        ON CONFLICT(seller_id) DO UPDATE SET
+                            order_count = order_count + 1,
+                            units_sold = units_sold + excluded.units_sold,
+                            revenue = revenue + excluded.revenue;
+                        INSERT INTO daily_orders (day, order_count, units)
+                        VALUES (date(new.order_date), 1, new.quantity)
+                        ON CONFLICT(day) DO UPDATE SET
+                            order_count = order_count + 1,
+                            units = units + excluded.units;
+                        INSERT INTO customer_orders (user_id, order_count) VALUES (new.user_id, 1)
+                        ON CONFLICT(user_id) DO UPDATE SET order_count = order_count + 1;
+                      END''')
+    cursor.execute("DROP TRIGGER IF EXISTS orders_agg_delete")
+    cursor.execute(f'''CREATE TRIGGER orders_agg_delete AFTER DELETE ON orders
+                       WHEN (SELECT moving FROM order_archive_state) = 0 BEGIN
+                         {SNAPSHOT_DELETE_AGGREGATES}
+                       END''')
+    cursor.execute("DROP TRIGGER IF EXISTS orders_archive_agg_delete")
+    cursor.execute(f'''CREATE TRIGGER orders_archive_agg_delete AFTER DELETE ON orders_archive BEGIN
+                         {SNAPSHOT_DELETE_AGGREGATES}
+                       END''')
+    # Sales no longer follow the product: a price change leaves past
+    # revenue alone and a deleted product keeps its sales
+    cursor.execute("DROP TRIGGER IF EXISTS products_agg_price")
+    cursor.execute("DROP TRIGGER IF EXISTS products_agg_delete")
+    cursor.execute('''CREATE TRIGGER products_low_stock_delete AFTER DELETE ON products
+                      WHEN old.stock < %(low)d BEGIN
+                        UPDATE seller_low_stock SET low_stock_count = low_stock_count - 1
+                        WHERE seller_id = COALESCE(old.seller_id, 0);
+                      END''' % {"low": LOW_STOCK_THRESHOLD})
+
+    cursor.execute("DROP VIEW IF EXISTS order_history")
+    cursor.execute('''CREATE VIEW order_history AS
+                      SELECT id, user_id, product_id, quantity, order_date, seller_id, unit_price, product_name
+                      FROM orders
+                      UNION ALL
+                      SELECT id, user_id, product_id, quantity, order_date, seller_id, unit_price, product_name
+                      FROM orders_archive''')
+    # Recount from the snapshots; spelled out rather than taken from
+    # AGGREGATE_QUERIES, which may change after this migration ships
+    for table in ("product_sales", "seller_sales", "daily_orders", "customer_orders", "seller_low_stock"):
+        cursor.execute(f"DELETE FROM {table}")
+    cursor.execute('''INSERT INTO product_sales (product_id, order_count, units_sold, revenue)
+                      SELECT product_id, COUNT(*), SUM(quantity), COALESCE(SUM(quantity * unit_price), 0)
+                      FROM order_history GROUP BY product_id''')
+    cursor.execute('''INSERT INTO seller_sales (seller_id, order_count, units_sold, revenue)
+                      SELECT COALESCE(seller_id, 0), COUNT(*), SUM(quantity), COALESCE(SUM(quantity * unit_price), 0)
+                      FROM order_history GROUP BY COALESCE(seller_id, 0)''')
+    cursor.execute('''INSERT INTO daily_orders (day, order_count, units)
+                      SELECT date(order_date), COUNT(*), SUM(quantity)
+                      FROM order_history GROUP BY date(order_date)''')
+    cursor.execute('''INSERT INTO customer_orders (user_id, order_count)
+                      SELECT user_id, COUNT(*) FROM order_history GROUP BY user_id''')
+    cursor.execute('''INSERT INTO seller_low_stock (seller_id, low_stock_count)
+                      SELECT COALESCE(seller_id, 0), COUNT(*) FROM products
+                      WHERE stock < %(low)d GROUP BY COALESCE(seller_id, 0)''' % {"low": LOW_STOCK_THRESHOLD})
+
+@migration(15)
+def create_co_purchases(cursor):
+    # co_purchases counts the baskets (one user's orders on one day) each
+    # pair of products shares, both ways round; product_recommendations
+    # keeps each product's top pairs in rank order. applied_through is the
+    # last order counted. Existing orders are left to
+    # `flask rebuild-recommendations`.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS co_purchases (
+                        product_id INTEGER NOT NULL,
+                        other_id INTEGER NOT NULL,
+                        baskets INTEGER NOT NULL,
+                        PRIMARY KEY (product_id, other_id)) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS product_recommendations (
+                        product_id INTEGER NOT NULL,
+                        rank INTEGER NOT NULL,
+                        other_id INTEGER NOT NULL,
+                        baskets INTEGER NOT NULL,
+                        PRIMARY KEY (product_id, rank)) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS recommendation_state (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        applied_through INTEGER NOT NULL DEFAULT 0)''')
+    cursor.execute("""INSERT OR IGNORE INTO recommendation_state (id, applied_through)
+                      SELECT 1, COALESCE(MAX(id), 0) FROM orders""")
+
+# Lower bounds of the catalog's price facets; the last bucket has no upper
+# bound. The values are baked into the triggers below.
+PRICE_BUCKETS = (0, 25, 50, 100, 250, 500, 1000)
+
+def price_bucket_sql(price):
+    """SQL expression for the PRICE_BUCKETS index that price falls in."""
+    return "(" + " + ".join(f"({price} >= {low})" for low in PRICE_BUCKETS[1:]) + ")"
+
+@migration(16)
+def create_catalog_facets(cursor):
+    # One index per filter/sort path of the catalog, each ending in id for
+    # the keyset cursor. Stock is left out of them, so a purchase's stock
+    # update never has to touch them; sold-out rows are skipped while
+    # walking the index. Newest in-stock first stays on idx_products_catalog.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_price ON products(price, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_created ON products(created_at, id)")
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_products_seller_created
+                      ON products(seller_id, created_at, id)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_products_seller_price
+                      ON products(seller_id, price, id)''')
+
+    # In-stock products per seller and price bucket, for the facet counts.
+    # Only a product coming into or going out of stock, or changing price
+    # or seller, moves a count.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS catalog_facets (
+                        seller_id INTEGER NOT NULL,
+                        price_bucket INTEGER NOT NULL,
+                        product_count INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (seller_id, price_bucket)) WITHOUT ROWID''')
+    facet_add = '''INSERT INTO catalog_facets (seller_id, price_bucket, product_count)
+                   VALUES (COALESCE(new.seller_id, 0), %s, 1)
+                   ON CONFLICT(seller_id, price_bucket) DO UPDATE SET
+                       product_count = product_count + 1;''' % price_bucket_sql("new.price")
+    facet_remove = '''UPDATE catalog_facets SET product_count = product_count - 1
+                      WHERE seller_id = COALESCE(old.seller_id, 0)
+                        AND price_bucket = %s;''' % price_bucket_sql("old.price")
+    moved = "new.price IS NOT old.price OR new.seller_id IS NOT old.seller_id"
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS products_facets_insert AFTER INSERT ON products
+                       WHEN new.stock > 0 BEGIN {facet_add} END''')
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS products_facets_delete AFTER DELETE ON products
+                       WHEN old.stock > 0 BEGIN {facet_remove} END''')
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS products_facets_leave
+                       AFTER UPDATE OF stock, price, seller_id ON products
+                       WHEN old.stock > 0 AND (COALESCE(new.stock > 0, 0) = 0 OR {moved})
+                       BEGIN {facet_remove} END''')
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS products_facets_enter
+                       AFTER UPDATE OF stock, price, seller_id ON products
+                       WHEN new.stock > 0 AND (COALESCE(old.stock > 0, 0) = 0 OR {moved})
+                       BEGIN {facet_add} END''')
+    cursor.execute("DELETE FROM catalog_facets")
+    cursor.execute('''INSERT INTO catalog_facets (seller_id, price_bucket, product_count)
+                      SELECT COALESCE(seller_id, 0), %s, COUNT(*) FROM products
+                      WHERE stock > 0 GROUP BY 1, 2''' % price_bucket_sql("price"))
+
+@migration(17)
+def drop_deleted_products_from_carts(cursor):
+    # A cart line for a deleted product is hidden by the cart view but made
+    # every checkout fail, so a product delete takes its cart lines with it
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cart_items_product ON cart_items(product_id)")
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_cart_delete AFTER DELETE ON products BEGIN
+                        DELETE FROM cart_items WHERE product_id = old.id;
+                      END''')
+    cursor.execute("DELETE FROM cart_items WHERE product_id NOT IN (SELECT id FROM products)")
+
+def run_migrations(db):
+    """Apply pending migrations and return the resulting schema version."""
+    current = db.execute("PRAGMA user_version").fetchone()[0]
+    for version, func in MIGRATIONS:
+        if version <= current:
+            continue
+        cursor = db.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            func(cursor)
+            cursor.execute(f"PRAGMA user_version = {int(version)}")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        print(f"🔧 Applied migration {version}: {func.__name__}")
+        current = version
+    return current
+
+# Hot queries and the index each one is expected to search through
+HOT_QUERIES = [
+    ("user by email", "SELECT * FROM users WHERE email = ?", ("x",),
+     "sqlite_autoindex_users_1"),
+    ("user orders", """SELECT orders.id, orders.product_name, products.image FROM orders
+                       LEFT JOIN products ON orders.product_id = products.id
+                       WHERE orders.user_id=?""", (1,), "idx_orders_user"),
+    ("seller products", "SELECT * FROM products WHERE seller_id=?", (1,),
+     "idx_products_seller"),
+    ("seller orders", """SELECT o.id, o.product_name FROM orders o
+                         JOIN users u ON o.user_id = u.id
+                         WHERE o.seller_id=? AND o.order_date >= ?
+                         ORDER BY o.order_date DESC, o.id DESC LIMIT ?""",
+     (1, "2000-01-01", 21), "idx_orders_seller_date"),
+    ("product orders", """SELECT o.id FROM orders o
+                          WHERE o.product_id=? AND +o.seller_id=? AND o.order_date >= ?
+                          ORDER BY o.order_date DESC, o.id DESC LIMIT ?""",
+     (1, 1, "2000-01-01", 21), "idx_orders_product_date"),
+    ("catalog page", """SELECT p.*, u.shop_name FROM products p
+                        LEFT JOIN users u ON p.seller_id = u.id
+                        WHERE p.stock > 0 AND (p.created_at, p.id) < (?, ?)
+                        ORDER BY p.created_at DESC, p.id DESC LIMIT ?""",
+     ("9999", 0, 25), "idx_products_catalog"),
+    ("catalog by price", """SELECT p.*, u.shop_name FROM products p
+                            LEFT JOIN users u ON p.seller_id = u.id
+                            WHERE p.stock > 0 AND p.price >= ? AND p.price <= ?
+                            ORDER BY p.price ASC, p.id ASC LIMIT ?""",
+     (0, 100, 25), "idx_products_price"),
+    ("catalog with sold out", """SELECT p.*, u.shop_name FROM products p
+                                 LEFT JOIN users u ON p.seller_id = u.id
+                                 ORDER BY p.created_at DESC, p.id DESC LIMIT ?""",
+     (25,), "idx_products_created"),
+    ("shop catalog", """SELECT p.*, u.shop_name FROM products p
+                        LEFT JOIN users u ON p.seller_id = u.id
+                        WHERE p.stock > 0 AND p.seller_id = ? AND (p.created_at, p.id) < (?, ?)
+                        ORDER BY p.created_at DESC, p.id DESC LIMIT ?""",
+     (1, "9999", 0, 25), "idx_products_seller_created"),
+    ("shop catalog by price", """SELECT p.*, u.shop_name FROM products p
+                                 LEFT JOIN users u ON p.seller_id = u.id
+                                 WHERE p.stock > 0 AND p.seller_id = ? AND p.price >= ?
+                                 ORDER BY p.price DESC, p.id DESC LIMIT ?""",
+     (1, 0, 25), "idx_products_seller_price"),
+]
+
+def check_query_plans(db):
+    """Return a list of hot queries whose plan misses its expected index."""
+    problems = []
+    # A cached EXPLAIN keeps the plan it was prepared with, even after the
+    # schema changes; the schema cookie in the text gives each schema its own
+    schema = db.execute("PRAGMA schema_version").fetchone()[0]
+    for name, sql, params, index in HOT_QUERIES:
+        plan = [row[3] for row in db.execute(f"EXPLAIN QUERY PLAN /* schema {schema} */ {sql}", params)]
+        if not any(index in detail for detail in plan):
+            problems.append((name, index, plan))
+    return problems
+
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    """Fail if a hot query no longer uses its index."""
+    db = get_db()
+    run_migrations(db)
+    problems = check_query_plans(db)
+    for name, index, plan in problems:
+        print(f"❌ {name}: expected {index}, got {plan}")
+    if problems:
+        raise SystemExit(1)
+    print(f"✅ All {len(HOT_QUERIES)} hot queries use their indexes")
+
+# ---------------- DASHBOARD AGGREGATES ------------------
+# Full recomputation of every summary table, keyed the same way as the
+# incremental triggers. Used for the initial backfill and for checks.
+# {orders} is the order_history view, hot and archived orders together.
+AGGREGATE_QUERIES = {
+    "product_sales": ("product_id", """
+        SELECT product_id, COUNT(*), SUM(quantity), COALESCE(SUM(quantity * unit_price), 0)
+        FROM {orders} GROUP BY product_id"""),
+    "seller_sales": ("seller_id", """
+        SELECT COALESCE(seller_id, 0), COUNT(*), SUM(quantity), COALESCE(SUM(quantity * unit_price), 0)
+        FROM {orders} GROUP BY COALESCE(seller_id, 0)"""),
+    "daily_orders": ("day", """
+        SELECT date(order_date), COUNT(*), SUM(quantity)
+        FROM {orders} GROUP BY date(order_date)"""),
+    "customer_orders": ("user_id", """
+        SELECT user_id, COUNT(*) FROM {orders} GROUP BY user_id"""),
+    "seller_low_stock": ("seller_id", f"""
+        SELECT COALESCE(seller_id, 0), COUNT(*) FROM products
+        WHERE stock < {LOW_STOCK_THRESHOLD} GROUP BY COALESCE(seller_id, 0)"""),
+    "catalog_facets": (("seller_id", "price_bucket"), f"""
+        SELECT COALESCE(seller_id, 0), {price_bucket_sql("price")}, COUNT(*) FROM products
+        WHERE stock > 0 GROUP BY 1, 2"""),
+}
+
+def rebuild_aggregates(cursor, orders="order_history", tables=None):
+    for table, (_, query) in AGGREGATE_QUERIES.items():
+        if tables is not None and table not in tables:
+            continue
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"INSERT INTO {table} {query.format(orders=orders)}")
+
+def check_aggregates(db):
+    """Compare every summary table with a full recompute; return the mismatches."""
+    def non_zero(rows, width):
+        return {row[0] if width == 1 else tuple(row[:width]): tuple(row[width:])
+                for row in rows if any(row[width:])}
+
+    def same(a, b):
+        return all(abs((x or 0) - (y or 0)) <= 1e-6 * max(1.0, abs(x or 0)) for x, y in zip(a, b))
+
+    mismatches = []
+    for table, (key, query) in AGGREGATE_QUERIES.items():
+        width = len(key) if isinstance(key, tuple) else 1
+        stored = non_zero(db.execute(f"SELECT * FROM {table}").fetchall(), width)
+        expected = non_zero(db.execute(query.format(orders="order_history")).fetchall(), width)
+        key = ", ".join(key) if width > 1 else key
+        for k in stored.keys() | expected.keys():
+            if not same(stored.get(k, ()), expected.get(k, ())) or (k in stored) != (k in expected):
+                mismatches.append((table, key, k, stored.get(k), expected.get(k)))
+    return mismatches
+
+@app.cli.command("rebuild-aggregates")
+@click.option("--check-only", is_flag=True, help="Only compare the summary tables with a full recompute.")
+def rebuild_aggregates_command(check_only):
+    """Rebuild the dashboard summary tables and verify them."""
+    db = get_db()
+    run_migrations(db)
+    if not check_only:
+        run_write_transaction(db, lambda db: rebuild_aggregates(db.cursor()))
+        print("🔧 Rebuilt dashboard aggregates")
+    mismatches = check_aggregates(db)
+    for table, key, value, stored, expected in mismatches:
+        print(f"❌ {table} {key}={value}: stored {stored}, expected {expected}")
+    if mismatches:
+        raise SystemExit(1)
+    print("✅ Dashboard aggregates match a full recompute")
+
+def get_admin_summary(db):
+    totals = db.execute("""SELECT COALESCE(SUM(order_count), 0) AS order_count,
+                                  COALESCE(SUM(units_sold), 0) AS units_sold,
+                                  COALESCE(SUM(revenue), 0) AS revenue
+                           FROM seller_sales""").fetchone()
+    return {
+        "order_count": totals["order_count"],
+        "units_sold": totals["units_sold"],
+        "revenue": totals["revenue"],
+        "active_customers": db.execute("SELECT COUNT(*) FROM customer_orders").fetchone()[0],
+    }
+
+def get_seller_summary(db, seller_id):
+    sales = db.execute("SELECT order_count, units_sold, revenue FROM seller_sales WHERE seller_id=?",
+                       (seller_id,)).fetchone()
+    low = db.execute("SELECT low_stock_count FROM seller_low_stock WHERE seller_id=?",
+                     (seller_id,)).fetchone()
+    product_count = db.execute("SELECT COUNT(*) FROM products WHERE seller_id=?", (seller_id,)).fetchone()[0]
+    return {
+        "product_count": product_count,
+        "order_count": sales["order_count"] if sales else 0,
+        "units_sold": sales["units_sold"] if sales else 0,
+        "revenue": sales["revenue"] if sales else 0,
+        "low_stock_count": low["low_stock_count"] if low else 0,
+    }
+
+# ---------------- ORDER ARCHIVAL ------------------
+# Orders are split into a hot table, which every default view reads, and
+# orders_archive for history. Old orders move over oldest first in small
+# transactions, so writers are never blocked for long and every archived
+# order is older than every hot one.
+ORDER_COLUMNS = "id, user_id, product_id, quantity, order_date, seller_id, unit_price, product_name"
+
+# Snapshots the product's seller, price and name on the order as it is
+# written, which saves the orders_fill_snapshot trigger a second write
+ORDER_INSERT = """INSERT INTO orders (user_id, product_id, quantity, seller_id, unit_price, product_name)
+                  SELECT ?1, ?2, ?3, seller_id, price, name FROM products WHERE id = ?2"""
+
+def archive_orders(db, older_than_days=None, batch_size=None, pause=0.0):
+    """Move orders older than the cutoff into orders_archive; return how many moved."""
+    days = app.config["ORDER_ARCHIVE_DAYS"] if older_than_days is None else older_than_days
+    batch_size = batch_size or app.config["ORDER_ARCHIVE_BATCH"]
+    db.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+
+    def move_batch(db):
+        db.execute("DELETE FROM temp.archive_batch")
+        db.execute("""INSERT INTO temp.archive_batch (id)
+                      SELECT id FROM orders WHERE order_date < datetime('now', ?)
+                      ORDER BY order_date LIMIT ?""", (f"-{int(days)} days", batch_size))
+        count = db.execute("SELECT COUNT(*) FROM temp.archive_batch").fetchone()[0]
+        if count:
+            # The orders stay in the summary tables: only a real delete
+            # should take them out
+            db.execute("UPDATE order_archive_state SET moving = 1")
+            db.execute(f"""INSERT INTO orders_archive ({ORDER_COLUMNS})
+                           SELECT {ORDER_COLUMNS} FROM orders
+                           WHERE id IN (SELECT id FROM temp.archive_batch)""")
+            db.execute("DELETE FROM orders WHERE id IN (SELECT id FROM temp.archive_batch)")
+            db.execute("UPDATE order_archive_state SET moving = 0")
+        return count
+
+    moved = 0
+    while True:
+        count = run_write_transaction(db, move_batch)
+        moved += count
+        if count < batch_size:
+            return moved
+        if pause:
+            time.sleep(pause)
+
+def order_source(history):
+    """Table or view an order listing reads: hot orders, or hot plus archived."""
+    return "order_history" if history else "orders"
+
+_archiver_started = threading.Event()
+
+def start_order_archiver():
+    """Run archive_orders() every ORDER_ARCHIVE_INTERVAL seconds on a daemon thread."""
+    interval = app.config["ORDER_ARCHIVE_INTERVAL"]
+    if interval <= 0 or _archiver_started.is_set():
+        return
+    _archiver_started.set()
+
+    def loop():
+        while True:
+            db = None
+            try:
+                db = connect_db()
+                moved = archive_orders(db, pause=0.05)
+                if moved:
+                    print(f"📦 Archived {moved} orders")
+            except Exception as e:
+                print(f"Error archiving orders: {e}")
+            finally:
+                if db is not None:
+                    db.close()
+            time.sleep(interval)
+
+    threading.Thread(target=loop, name="order-archiver", daemon=True).start()
+
+@app.cli.command("archive-orders")
+@click.option("--days", type=int, help="Archive orders older than this (default ORDER_ARCHIVE_DAYS).")
+@click.option("--batch-size", type=int, help="Orders per transaction (default ORDER_ARCHIVE_BATCH).")
+def archive_orders_command(days, batch_size):
+    """Move old orders from the hot orders table into orders_archive."""
+    db = get_db()
+    run_migrations(db)
+    started = time.perf_counter()
+    moved = archive_orders(db, days, batch_size)
+    print(f"📦 Archived {moved} orders in {time.perf_counter() - started:.1f}s")
+
+# ---------------- STREAMING EXPORTS ------------------
+EXPORT_BATCH_SIZE = 1000
+
+class _CSVLine:
+    """File-like sink that hands csv.writer output straight back."""
+    def write(self, value):
+        return value
+
+def stream_rows(sql, params, columns, fmt):
+    """Yield export chunks for a query, reading it batch by batch.
+
+    The header goes out before the query runs, and only one batch of
+    rows is held in memory at a time. A download lasts as long as the
+    client takes to read it, so it gets its own connection rather than
+    holding one of the read pool's.
+    """
+    writer = csv.writer(_CSVLine())
+    if fmt == "csv":
+        yield writer.writerow(columns)
+
+    db = connect_db(readonly=True)
+    try:
+        cursor = db.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            if fmt == "csv":
+                yield "".join(writer.writerow(tuple(row)) for row in rows)
+            else:
+                yield "".join(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows)
+    finally:
+        db.close()
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_response(name, sql, params, columns):
+    fmt = "ndjson" if request.args.get("format") == "ndjson" else "csv"
+    chunks = stream_rows(sql, params, columns, fmt)
+    filename = f"{name}.{fmt}"
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    if request.args.get("gzip") == "1":
+        chunks = gzip_stream(chunks)
+        filename += ".gz"
+        mimetype = "application/gzip"
+    return Response(chunks, mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+# ---------------- BULK PRODUCT IMPORT ------------------
+IMPORT_BATCH_SIZE = 5000          # rows per executemany
+IMPORT_TRANSACTION_ROWS = 100000  # rows per commit
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+def parse_product_numbers(price, stock):
+    """Apply the product form's price/stock rules; raises ValueError."""
+    return float(price), int(stock)
+
+def read_import_rows(stream, fmt):
+    """Yield (line_no, dict) from an uploaded CSV or JSON Lines file, one row at a time."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_no, None
+            continue
+        yield line_no, row if isinstance(row, dict) else None
+
+def import_products(db, seller_id, rows):
+    """Validate and upsert products by (seller_id, sku) in batched executemany calls.
+
+    Returns a summary dict with the imported count and per-row errors.
+    """
+    upsert = """INSERT INTO products (seller_id, sku, name, price, stock, description, image)
+                VALUES (?,?,?,?,?,?,?)
+                ON CONFLICT(seller_id, sku) WHERE sku IS NOT NULL DO UPDATE SET
+                    name=excluded.name, price=excluded.price, stock=excluded.stock,
+                    description=excluded.description, image=excluded.image"""
+    summary = {"imported": 0, "failed": 0, "errors": []}
+    batch, pending = [], []
+    db.execute("CREATE TEMP TABLE IF NOT EXISTS import_skus (sku TEXT PRIMARY KEY)")
+
+    def upsert_chunk(db, chunk):
+        # Per-row FTS triggers are deferred for the import; the search
+        # index is updated once per chunk from the staged SKUs instead.
+        # CROSS JOIN keeps the staged SKUs as the outer loop so each one is
+        # a single idx_products_seller_sku lookup.
+        db.execute("DELETE FROM temp.import_skus")
+        db.executemany("INSERT OR IGNORE INTO temp.import_skus (sku) VALUES (?)",
+                       [(row[1],) for row in chunk])
+        db.execute("""INSERT INTO products_fts(products_fts, rowid, name, description)
+                      SELECT 'delete', p.id, p.name, p.description
+                      FROM temp.import_skus s CROSS JOIN products p ON p.seller_id = ? AND p.sku = s.sku""",
+                   (seller_id,))
+        db.executemany(upsert, chunk)
+        db.execute("""INSERT INTO products_fts(rowid, name, description)
+                      SELECT p.id, p.name, p.description
+                      FROM temp.import_skus s CROSS JOIN products p ON p.seller_id = ? AND p.sku = s.sku""",
+                   (seller_id,))
+
+    def flush_transaction():
+        if not pending:
+            return
+        def work(db):
+            db.execute("UPDATE search_sync SET deferred = 1")
+            for chunk in pending:
+                upsert_chunk(db, chunk)
+            db.execute("UPDATE search_sync SET deferred = 0")
+            db.execute(BUMP_TABLE_VERSION % "products")
+        run_write_transaction(db, work)
+        summary["imported"] += sum(len(chunk) for chunk in pending)
+        pending.clear()
+
+    def reject(line_no, message):
+        summary["failed"] += 1
+        if len(summary["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+            summary["errors"].append({"line": line_no, "error": message})
+
+    for line_no, row in rows:
+        if row is None:
+            reject(line_no, "unreadable row")
+            continue
+        sku = str(row.get("sku") or "").strip()
+        name = str(row.get("name") or "").strip()
+        price, stock = row.get("price"), row.get("stock")
+        if not sku:
+            reject(line_no, "sku is required")
+            continue
+        if not name or price in (None, "") or stock in (None, ""):
+            reject(line_no, "name, price, and stock are required")
+            continue
+        try:
+            price_val, stock_val = parse_product_numbers(price, stock)
+        except (TypeError, ValueError):
+            reject(line_no, "invalid price or stock number")
+            continue
+        batch.append((seller_id, sku, name, price_val, stock_val,
+                      str(row.get("description") or "").strip(),
+                      row.get("image") or "https://via.placeholder.com/150"))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            pending.append(batch)
+            batch = []
+            if len(pending) * IMPORT_BATCH_SIZE >= IMPORT_TRANSACTION_ROWS:
+                flush_transaction()
+    if batch:
+        pending.append(batch)
+    flush_transaction()
+
+    if summary["imported"]:
+        catalog_cache.invalidate()
+    return summary
+
+# ---------------- SYNTHETIC DATA ------------------
+# Bulk generator for load tests and benchmarks. All synthetic accounts
+# share one password hash (SEED_PASSWORD): hashing each one at login cost
+# would take longer than the rest of the seed.
+SEED_PASSWORD = "password123"
+SEED_ADJECTIVES = ("wireless", "premium", "organic", "compact", "smart", "classic", "portable",
+                   "ergonomic", "vintage", "deluxe", "eco", "ultra", "handmade", "rugged", "slim")
+SEED_NOUNS = ("headphones", "shirt", "speaker", "lamp", "wallet", "bottle", "mouse", "keyboard",
+              "chair", "shoes", "mat", "grinder", "mug", "stand", "charger", "tripod", "backpack",
+              "kettle", "blender", "notebook", "watch", "jacket", "pillow", "candle", "router")
+
+def seed_synthetic_data(db, users, sellers, products, orders, days=730, seed=42, batch_size=50000):
+    """Append synthetic rows in batched transactions and return how many of each were added.
+
+    Timestamps are spread over the last `days` days in id order, so old
+    orders have low ids as in a real history. A few products and customers
+    take most of the orders.
+    """
+    rng = random.Random(seed)
+    end = time.time()
+    span = days * 86400
+
+    def stamp(fraction):
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(end - span + fraction * span))
+
+    def product_name():
+        return " ".join((rng.choice(SEED_ADJECTIVES), rng.choice(SEED_ADJECTIVES),
+                         rng.choice(SEED_NOUNS))).title()
+
+    def insert_batches(total, make_row, sql, index_products=False, finish=None):
+        for start in range(0, total, batch_size):
+            rows = [make_row(i) for i in range(start, min(start + batch_size, total))]
+            def work(db):
+                if index_products:
+                    last_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM products").fetchone()[0]
+                    db.execute("UPDATE search_sync SET deferred = 1")
+                db.executemany(sql, rows)
+                if index_products:
+                    db.execute("""INSERT INTO products_fts(rowid, name, description)
+                                  SELECT id, name, description FROM products WHERE id > ?""",
+                               (last_id,))
+                    db.execute("UPDATE search_sync SET deferred = 0")
+                    db.execute(BUMP_TABLE_VERSION % "products")
+                if finish:
+                    db.execute(finish)
+            run_write_transaction(db, work)
+
+    def new_ids(table, after_id, role=None):
+        sql = f"SELECT id FROM {table} WHERE id > ?" + (" AND role = ?" if role else "")
+        return [row[0] for row in db.execute(sql, (after_id, role) if role else (after_id,))]
+
+    password = password_hasher.hash(SEED_PASSWORD)
+    user_sql = """INSERT INTO users (username, email, password, role, shop_name, created_at)
+                  VALUES (?,?,?,?,?,?)"""
+    offset = db.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+    insert_batches(sellers, lambda i: (
+        f"seller{offset + i}", f"seller{offset + i}@seed.example", password, "seller",
+        f"{rng.choice(SEED_ADJECTIVES).title()} {rng.choice(SEED_NOUNS).title()} {offset + i}",
+        stamp(i / max(sellers, 1) / 2)), user_sql)
+    insert_batches(users, lambda i: (
+        f"customer{offset + sellers + i}", f"customer{offset + sellers + i}@seed.example", password,
+        "user", None, stamp(i / max(users, 1))), user_sql)
+    seller_ids = new_ids("users", offset, "seller")
+    customer_ids = new_ids("users", offset, "user")
+
+    # Products go in with the per-row search triggers deferred and are
+    # indexed set-based per batch, as bulk import does. The flag is set and
+    # cleared inside each batch's transaction, so writers between batches
+    # still index their own rows
+    first_product = db.execute("SELECT COALESCE(MAX(id), 0) FROM products").fetchone()[0]
+    insert_batches(products, lambda i: (
+        rng.choice(seller_ids) if seller_ids else None, product_name(),
+        round(rng.lognormvariate(4, 1.2), 2) + 1, rng.randint(0, 200),
+        " ".join(rng.choices(SEED_ADJECTIVES + SEED_NOUNS, k=12)),
+        "https://via.placeholder.com/150", stamp(i / max(products, 1))),
+        """INSERT INTO products (seller_id, name, price, stock, description, image, created_at)
+           VALUES (?,?,?,?,?,?,?)""", index_products=True)
+    product_ids = new_ids("products", first_product)
+
+    # Seeded orders are left to rebuild_recommendations(); moving the mark
+    # past them keeps the next checkout from counting them one by one
+    if orders and product_ids and customer_ids:
+        insert_batches(orders, lambda i: (
+            customer_ids[int(len(customer_ids) * rng.random() ** 2)],
+            product_ids[int(len(product_ids) * rng.random() ** 3)],
+            rng.choice((1, 1, 1, 2, 3)),
+            stamp((i + rng.random()) / orders)),
+            """INSERT INTO orders (user_id, product_id, quantity, order_date, seller_id, unit_price, product_name)
+               SELECT ?1, ?2, ?3, ?4, seller_id, price, name FROM products WHERE id = ?2""",
+            finish="UPDATE recommendation_state SET applied_through = (SELECT MAX(id) FROM orders)")
+
+    catalog_cache.invalidate()
+    return {"sellers": len(seller_ids), "users": len(customer_ids), "products": len(product_ids),
+            "orders": orders if product_ids and customer_ids else 0}
+
+@app.cli.command("seed-synthetic")
+@click.option("--users", default=20000, show_default=True, help="Customer accounts to add.")
+@click.option("--sellers", default=2000, show_default=True, help="Seller accounts to add.")
+@click.option("--products", default=200000, show_default=True, help="Products to add.")
+@click.option("--orders", default=2000000, show_default=True, help="Orders to add.")
+@click.option("--days", default=730, show_default=True, help="Spread timestamps over this many days.")
+@click.option("--seed", default=42, show_default=True, help="Random seed.")
+def seed_synthetic_command(users, sellers, products, orders, days, seed):
+    """Bulk-generate synthetic users, sellers, products and orders."""
+    db = get_db()
+    run_migrations(db)
+    started = time.perf_counter()
+    counts = seed_synthetic_data(db, users, sellers, products, orders, days=days, seed=seed)
+    if counts["orders"]:
+        rebuild_recommendations(db)
+    print(f"🌱 Seeded {counts} in {time.perf_counter() - started:.1f}s "
+          f"(password for every account: {SEED_PASSWORD})")
+
+# ---------------- SAFE DB INIT ------------------
+def init_db():
+    try:
+        with app.app_context():
+            print("🔧 Initializing database...")
+            version = run_migrations(get_db())
+            print(f"✅ Database ready (schema version {version})")
+
+    except Exception as e:
+        print(f"❌ Database initialization error: {e}")
+        traceback.print_exc()
+
+# ---------------- PASSWORD HASHING ------------------
+# Hashing is deliberately slow, so it runs on a small pool sized to the
+# cores instead of on every request thread at once. hashlib's scrypt and
+# pbkdf2 release the GIL, so the workers hash in parallel while request
+# threads just wait for the result.
+class PasswordHasherBusy(Exception):
+    pass
+
+class PasswordHasher:
+    def __init__(self, method, workers, max_pending):
+        self.method = method
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._prefix = None
+
+    def _run(self, func, *args):
+        # Fail fast instead of queueing without bound during a login storm
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy("password hashing pool is full")
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, stored_hash, password):
+        return self._run(check_password_hash, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        """True when stored_hash was made with another method or cost."""
+        if self._prefix is None:
+            # Werkzeug fills in default parameters, so take the canonical
+            # prefix from a real hash rather than from the method string
+            self._prefix = self.hash("").split("$", 1)[0]
+        return stored_hash.split("$", 1)[0] != self._prefix
+
+def make_password_hasher():
+    return PasswordHasher(app.config["PASSWORD_HASH_METHOD"], app.config["PASSWORD_HASH_WORKERS"],
+                          app.config["PASSWORD_HASH_MAX_PENDING"])
+
+password_hasher = make_password_hasher()
+
+# ---------------- AUTH FUNCTIONS ------------------
+def get_user_by_email(email):
+    try:
+        db = get_read_db()
+        row = db.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+        if row:
+            user_dict = dict(row)
+            if 'role' not in user_dict or user_dict['role'] is None:
+                user_dict['role'] = 'user'
+            return user_dict
+        return None
+    except Exception as e:
+        print(f"Error getting user: {e}")
+        return None
+
+def add_user(username, email, password, role="user", shop_name=None):
+    try:
+        db = get_db()
+        db.execute(
+            "INSERT INTO users (username, email, password, role, shop_name) VALUES (?, ?, ?, ?, ?)",
+            (username, email, password_hasher.hash(password), role, shop_name)
+        )
+        db.commit()
+        return True
+    except sqlite3.IntegrityError:
+        return False
+    except Exception as e:
+        print(f"Error adding user: {e}")
+        return False
+
+def upgrade_password_hash(user, password):
+    """Rehash with the configured method after a successful login."""
+    try:
+        if not password_hasher.needs_rehash(user['password']):
+            return
+        new_hash = password_hasher.hash(password)
+        # Only replace the hash that was just verified, in case the
+        # password changed in the meantime
+        run_write_transaction(get_db(), lambda db: db.execute(
+            "UPDATE users SET password=? WHERE id=? AND password=?",
+            (new_hash, user['id'], user['password'])))
+    except Exception as e:
+        print(f"Error upgrading password hash: {e}")
+
+# ---------------- CATALOG CACHE ------------------
+# Product listings are read far more often than they change, so they are
+# kept in a bounded in-process LRU with a TTL. Every product write bumps
+# a generation number; cached entries from older generations are never
+# served again. A purchase only changes stock, which listings do not show,
+# so it bumps the separate "stock" generation, and only when a product
+# sells out: that drops it from in-stock listings and the facet counts and
+# leaves every other entry alone. With CATALOG_CACHE_SHARED_PATH set, the
+# generations live in a small shared SQLite file so all worker processes
+# see each bump.
+GENERATIONS = ("catalog", "stock")
+
+class LocalGeneration:
+    def __init__(self):
+        self._values = dict.fromkeys(GENERATIONS, 0)
+        self._lock = threading.Lock()
+
+    def current(self):
+        """Return (catalog, stock) generations."""
+        return tuple(self._values[name] for name in GENERATIONS)
+
+    def bump(self, name="catalog"):
+        with self._lock:
+            self._values[name] += 1
+            return self._values[name]
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+class SharedGeneration:
+    """Generation counter stored in a SQLite file shared by all workers.
+
+    The connection is opened on first use in each process: a SQLite
+    connection must not be carried across fork().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS cache_generation (
+                              name TEXT PRIMARY KEY,
+                              generation INTEGER NOT NULL)""")
+            db.executemany("INSERT OR IGNORE INTO cache_generation VALUES (?, 0)",
+                           [(name,) for name in GENERATIONS])
+            self._db = db
+        return self._db
+
+    def current(self):
+        """Return (catalog, stock) generations."""
+        with self._lock:
+            values = dict(self._connection().execute("SELECT name, generation FROM cache_generation"))
+        return tuple(values[name] for name in GENERATIONS)
+
+    def bump(self, name="catalog"):
+        with self._lock:
+            return self._connection().execute("""UPDATE cache_generation SET generation = generation + 1
+                                                  WHERE name=? RETURNING generation""", (name,)).fetchone()[0]
+
+    def after_fork(self):
+        # Dropped, not closed: closing would touch the parent's connection
+        self._db = None
+        self._lock = threading.Lock()
+
+class CatalogCache:
+    def __init__(self, max_entries, ttl, generation):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = generation
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = self.stock_invalidations = 0
+
+    def get(self, key, loader, in_stock=False):
+        """Return the cached value for key, calling loader() on a miss.
+
+        in_stock marks values that depend on which products are in stock;
+        only those are dropped by invalidate_stock().
+        """
+        catalog, stock = self.generation.current()
+        generation = (catalog, stock if in_stock else None)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry and entry[0][0] == catalog and entry[0][1] in (None, stock)
+                    and entry[1] > now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        value = loader()
+        with self._lock:
+            self._entries[key] = (generation, now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self):
+        self.generation.bump()
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def invalidate_stock(self):
+        """Drop the entries that depend on which products are in stock."""
+        self.generation.bump("stock")
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[0][1] is not None]:
+                del self._entries[key]
+            self.stock_invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "invalidations": self.invalidations,
+                    "stock_invalidations": self.stock_invalidations,
+                    "entries": len(self._entries)}
+
+    def after_fork(self):
+        # Entries filled in the master stay, so workers start warm; the
+        # locks and the shared generation's connection are the child's own
+        self._lock = threading.Lock()
+        self.generation.after_fork()
+
+def make_catalog_cache():
+    shared_path = app.config["CATALOG_CACHE_SHARED_PATH"]
+    generation = SharedGeneration(shared_path) if shared_path else LocalGeneration()
+    return CatalogCache(app.config["CATALOG_CACHE_SIZE"], app.config["CATALOG_CACHE_TTL"], generation)
+
+catalog_cache = make_catalog_cache()
+
+# ---------------- CATALOG PAGINATION ------------------
+# The catalog is paged with a keyset cursor on (sort key, id) instead of
+# OFFSET, so every page is a bounded index range scan however deep it is.
+# Each sort, alone or within one shop, and a price range sorted by price,
+# has a composite index that returns rows in display order (see migration
+# 16), so nothing is sorted per request. Newest first within a price range
+# cannot be both a price range and created_at order in one index: it walks
+# the newest-first index and skips rows outside the range, which costs
+# more the narrower the range is.
+def encode_cursor(row, key="created_at"):
+    raw = f"{row[key]}|{row['id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        created_at, product_id = raw.rsplit("|", 1)
+        return created_at, int(product_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+# Sort name: (column, descending)
+CATALOG_SORTS = {
+    "newest": ("created_at", True),
+    "price_asc": ("price", False),
+    "price_desc": ("price", True),
+}
+
+CatalogFilters = namedtuple("CatalogFilters", "min_price max_price price_bucket shop in_stock sort",
+                            defaults=(None, None, None, None, True, "newest"))
+
+def get_catalog_filters(args):
+    """Parse the catalog filter and sort arguments; bad values are ignored."""
+    def price(name):
+        value = args.get(name, type=float)
+        return value if value is not None and 0 <= value < float("inf") else None
+
+    sort = args.get("sort")
+    bucket = args.get("price_bucket", type=int)
+    return CatalogFilters(min_price=price("min_price"), max_price=price("max_price"),
+                          price_bucket=bucket if bucket in range(len(PRICE_BUCKETS)) else None,
+                          shop=args.get("shop", type=int), in_stock=args.get("in_stock") != "0",
+                          sort=sort if sort in CATALOG_SORTS else "newest")
+
+def catalog_filter_args(filters):
+    """Query arguments that reproduce filters, for links that keep them."""
+    return {name: int(value) if isinstance(value, bool) else value
+            for name, value in filters._asdict().items()
+            if value != CatalogFilters._field_defaults[name]}
+
+def get_catalog_page(db, after=None, before=None, page_size=None, filters=None):
+    """Return (products, next_cursor, prev_cursor) for one catalog page."""
+    page_size = page_size or app.config["CATALOG_PAGE_SIZE"]
+    filters = filters or CatalogFilters()
+    column, descending = CATALOG_SORTS[filters.sort]
+
+    conditions, params = [], []
+    if filters.in_stock:
+        conditions.append("p.stock > 0")
+    if filters.shop is not None:
+        conditions.append("p.seller_id = ?")
+        params.append(filters.shop)
+    if filters.min_price is not None:
+        conditions.append("p.price >= ?")
+        params.append(filters.min_price)
+    if filters.max_price is not None:
+        conditions.append("p.price <= ?")
+        params.append(filters.max_price)
+    if filters.price_bucket is not None:
+        # Half-open [low, high), the same comparisons price_bucket_sql()
+        # counts the facets with
+        index = filters.price_bucket
+        if index > 0:
+            conditions.append("p.price >= ?")
+            params.append(PRICE_BUCKETS[index])
+        if index + 1 < len(PRICE_BUCKETS):
+            conditions.append("p.price < ?")
+            params.append(PRICE_BUCKETS[index + 1])
+
+    def decode(token):
+        key = decode_cursor(token) if token else None
+        if key and column == "price":
+            try:
+                return float(key[0]), key[1]
+            except ValueError:
+                return None
+        return key
+
+    def fetch(key, desc):
+        where = list(conditions)
+        if key:
+            where.append(f"(p.{column}, p.id) {'<' if desc else '>'} (?, ?)")
+        order = "DESC" if desc else "ASC"
+        sql = "SELECT p.*, u.shop_name FROM products p LEFT JOIN users u ON p.seller_id = u.id"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY p.{column} {order}, p.id {order} LIMIT ?"
+        return db.execute(sql, (*params, *(key or ()), page_size + 1)).fetchall()
+
+    after_key = decode(after)
+    before_key = decode(before)
+
+    if before_key:
+        # Walk backwards from the cursor, then flip back to display order
+        rows = fetch(before_key, not descending)
+        has_more = len(rows) > page_size
+        products = list(reversed(rows[:page_size]))
+        has_next, has_prev = True, has_more
+    else:
+        rows = fetch(after_key, descending)
+        has_more = len(rows) > page_size
+        products = rows[:page_size]
+        has_next, has_prev = has_more, bool(after_key)
+
+    next_cursor = encode_cursor(products[-1], column) if products and has_next else None
+    prev_cursor = encode_cursor(products[0], column) if products and has_prev else None
+    return products, next_cursor, prev_cursor
+
+def get_catalog_facets(db, shop=None):
+    """Return in-stock product counts per shop and per price bucket.
+
+    Both come from the catalog_facets summary table rather than products.
+    Price buckets are counted within the selected shop, if any.
+    """
+    shops = db.execute("""SELECT f.seller_id, u.shop_name, SUM(f.product_count) AS product_count
+                          FROM catalog_facets f JOIN users u ON u.id = f.seller_id
+                          GROUP BY f.seller_id HAVING SUM(f.product_count) > 0
+                          ORDER BY u.shop_name""").fetchall()
+    counts = dict(db.execute("""SELECT price_bucket, SUM(product_count) FROM catalog_facets
+                                WHERE ?1 IS NULL OR seller_id = ?1
+                                GROUP BY price_bucket""", (shop,)).fetchall())
+    prices = []
+    for index, low in enumerate(PRICE_BUCKETS):
+        high = PRICE_BUCKETS[index + 1] if index + 1 < len(PRICE_BUCKETS) else None
+        if high is None:
+            label = f"₹{low}+"
+        else:
+            label = f"Under ₹{high}" if low == 0 else f"₹{low} – ₹{high}"
+        prices.append({"label": label, "bucket": index, "product_count": counts.get(index, 0)})
+    return {"shops": [dict(row) for row in shops], "prices": prices}
+
+# ---------------- SELLER DASHBOARD ------------------
+# Every dashboard query reads at most a page of rows or one seller's index
+# range. Orders are paged with a keyset cursor on (order_date, id) off
+# idx_orders_seller_date, or idx_orders_product_date when filtered to one
+# product. Totals for a date range are summed over those covering indexes,
+# across archived orders too, so they match the all-time summary tables.
+def parse_day(value):
+    """Return value as YYYY-MM-DD if it is a valid date, else None."""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+def get_seller_filters(args):
+    return {
+        "start": parse_day(args.get("start")),
+        "end": parse_day(args.get("end")),
+        "product_id": args.get("product_id", type=int),
+    }
+
+def seller_order_conditions(seller_id, filters):
+    """Return the WHERE clause and params selecting a seller's filtered orders."""
+    if filters["product_id"]:
+        # The unary + keeps the planner on idx_orders_product_date, which
+        # is far narrower than the seller's whole date range
+        clauses, params = ["o.product_id = ?", "+o.seller_id = ?"], [filters["product_id"], seller_id]
+    else:
+        clauses, params = ["o.seller_id = ?"], [seller_id]
+    if filters["start"]:
+        clauses.append("o.order_date >= ?")
+        params.append(filters["start"])
+    if filters["end"]:
+        clauses.append("o.order_date < date(?, '+1 day')")
+        params.append(filters["end"])
+    return " AND ".join(clauses), params
+
+def get_seller_orders_page(db, seller_id, filters, after=None, before=None, page_size=None, history=False):
+    """Return (orders, next_cursor, prev_cursor) for one page of a seller's orders, newest first."""
+    page_size = page_size or app.config["SELLER_ORDERS_PAGE_SIZE"]
+    where, params = seller_order_conditions(seller_id, filters)
+    base = f"""SELECT o.id, u.username, o.product_name AS name, o.unit_price AS price, o.quantity, o.order_date
+               FROM {order_source(history)} o
+               JOIN users u ON o.user_id = u.id
+               WHERE {where}"""
+
+    after_key = decode_cursor(after) if after else None
+    before_key = decode_cursor(before) if before else None
+
+    if before_key:
+        rows = db.execute(base + """ AND (o.order_date, o.id) > (?, ?)
+                          ORDER BY o.order_date ASC, o.id ASC LIMIT ?""",
+                          (*params, *before_key, page_size + 1)).fetchall()
+        orders = list(reversed(rows[:page_size]))
+        has_next, has_prev = True, len(rows) > page_size
+    else:
+        keyset = " AND (o.order_date, o.id) < (?, ?)" if after_key else ""
+        rows = db.execute(base + keyset + " ORDER BY o.order_date DESC, o.id DESC LIMIT ?",
+                          (*params, *(after_key or ()), page_size + 1)).fetchall()
+        orders = rows[:page_size]
+        has_next, has_prev = len(rows) > page_size, bool(after_key)
+
+    next_cursor = encode_cursor(orders[-1], "order_date") if orders and has_next else None
+    prev_cursor = encode_cursor(orders[0], "order_date") if orders and has_prev else None
+    return orders, next_cursor, prev_cursor
+
+def get_seller_range_sales(db, seller_id, filters):
+    """Return order_count, units_sold and revenue for the filtered orders."""
+    where, params = seller_order_conditions(seller_id, filters)
+    row = db.execute(f"""SELECT COUNT(*), COALESCE(SUM(o.quantity), 0),
+                                COALESCE(SUM(o.quantity * o.unit_price), 0)
+                         FROM order_history o
+                         WHERE {where}""", params).fetchone()
+    return {"order_count": row[0], "units_sold": row[1], "revenue": row[2]}
+
+def get_seller_top_products(db, seller_id, filters, limit=None):
+    """Return the seller's products by revenue, with units and revenue summed in SQL.
+
+    Without a date range the per-product summary table is read directly;
+    with one, the matching orders are grouped by product first.
+    """
+    limit = limit or app.config["SELLER_TOP_PRODUCTS"]
+    if filters["start"] or filters["end"]:
+        where, params = seller_order_conditions(seller_id, filters)
+        return db.execute(f"""SELECT p.id, p.name, p.price, p.stock, p.image, p.image_key, p.image_variants,
+                                     s.order_count, s.units_sold, s.revenue
+                              FROM (SELECT o.product_id, COUNT(*) AS order_count,
+                                           SUM(o.quantity) AS units_sold,
+                                           SUM(o.quantity * o.unit_price) AS revenue
+                                    FROM order_history o WHERE {where}
+                                    GROUP BY o.product_id) s
+                              JOIN products p ON p.id = s.product_id
+                              ORDER BY revenue DESC, p.id DESC LIMIT ?""",
+                          (*params, limit)).fetchall()
+    product_filter = " AND p.id = ?" if filters["product_id"] else ""
+    return db.execute(f"""SELECT p.id, p.name, p.price, p.stock, p.image, p.image_key, p.image_variants,
+                                 COALESCE(s.order_count, 0) AS order_count,
+                                 COALESCE(s.units_sold, 0) AS units_sold,
+                                 COALESCE(s.revenue, 0) AS revenue
+                          FROM products p LEFT JOIN product_sales s ON s.product_id = p.id
+                          WHERE p.seller_id = ?{product_filter}
+                          ORDER BY revenue DESC, p.id DESC LIMIT ?""",
+                      (seller_id, *([filters["product_id"]] if filters["product_id"] else []), limit)).fetchall()
+
+# ---------------- ADMIN LISTINGS ------------------
+# The admin product and order lists are paged newest first with a keyset
+# on id. Every page is one primary-key range, merged across orders and
+# orders_archive for history, however large the tables grow.
+def get_id_page(db, base, id_column, params=(), after=None, before=None, page_size=None):
+    """Return (rows, next_cursor, prev_cursor) for one page of base, highest id first.
+
+    base is a SELECT without WHERE or ORDER BY; cursors are plain ids.
+    """
+    page_size = page_size or app.config["ADMIN_PAGE_SIZE"]
+    if before is not None:
+        rows = db.execute(f"{base} WHERE {id_column} > ? ORDER BY {id_column} ASC LIMIT ?",
+                          (*params, before, page_size + 1)).fetchall()
+        page = list(reversed(rows[:page_size]))
+        has_next, has_prev = True, len(rows) > page_size
+    else:
+        keyset = f" WHERE {id_column} < ?" if after is not None else ""
+        rows = db.execute(f"{base}{keyset} ORDER BY {id_column} DESC LIMIT ?",
+                          (*params, *(() if after is None else (after,)), page_size + 1)).fetchall()
+        page = rows[:page_size]
+        has_next, has_prev = len(rows) > page_size, after is not None
+
+    next_cursor = page[-1]["id"] if page and has_next else None
+    prev_cursor = page[0]["id"] if page and has_prev else None
+    return page, next_cursor, prev_cursor
+
+# ---------------- CATALOG API ------------------
+# Fields a client may pick with ?fields=; all of them by default
+API_PRODUCT_FIELDS = ("id", "name", "price", "stock", "image", "description",
+                      "seller_id", "shop_name", "sku", "created_at")
+API_MAX_PAGE_SIZE = 100
+
+def parse_api_fields(raw):
+    """Return the requested product fields, or raise ValueError for unknown ones."""
+    if not raw:
+        return API_PRODUCT_FIELDS
+    fields = tuple(dict.fromkeys(f.strip() for f in raw.split(",") if f.strip()))
+    unknown = [f for f in fields if f not in API_PRODUCT_FIELDS]
+    if unknown or not fields:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}" if unknown else "no fields given")
+    return fields
+
+def get_catalog_validators(db):
+    """Return (etag, last_modified, version) for the current request from the change counters.
+
+    The ETag is strong: it changes with either counter and with the query
+    string, since fields, cursor and limit each give a different body.
+    version is the (products, users) counter pair, for keying cached bodies.
+    """
+    versions = {row["name"]: row for row in db.execute(
+        "SELECT name, version, changed_at FROM table_versions WHERE name IN ('products', 'users')")}
+    products, users = versions["products"], versions["users"]
+    etag = "p%d.u%d.%08x" % (products["version"], users["version"],
+                             zlib.crc32(request.query_string))
+    changed_at = max(products["changed_at"], users["changed_at"])
+    return etag, datetime.fromtimestamp(changed_at, timezone.utc), (products["version"], users["version"])
+
+def conditional_json(load):
+    """Answer 304 when the client's copy is current; otherwise jsonify(load(db, version)).
+
+    The validators and the body are read in one read transaction, so the
+    ETag always describes the body it is sent with. load() must read
+    through db, and key anything it caches on version, the counters the
+    ETag was made from. load() returning None means the resource does
+    not exist.
+    """
+    db = get_read_db()
+    db.execute("BEGIN")
+    try:
+        return _conditional_json(db, load)
+    finally:
+        db.rollback()
+
+def _conditional_json(db, load):
+    etag, last_modified, version = get_catalog_validators(db)
+    matched = None
+    if request.if_none_match:
+        # The client may hold the ETag of a compressed variant
+        matched = next((tag for tag in (etag, encoded_etag(etag, "gzip"), encoded_etag(etag, "br"))
+                        if request.if_none_match.contains_weak(tag)), None)
+        fresh = matched is not None
+    else:
+        fresh = bool(request.if_modified_since) and last_modified <= request.if_modified_since
+
+    if fresh:
+        response = Response(status=304)
+        response.set_etag(matched or etag)
+    else:
+        payload = load(db, version)
+        if payload is None:
+            return jsonify(error="not found"), 404
+        response = jsonify(payload)
+        response.set_etag(etag)
+    response.last_modified = last_modified
+    # Clients must revalidate, which the counters make cheap
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+# ---------------- PRODUCT SEARCH ------------------
+SEARCH_WORD = re.compile(r"\w+", re.UNICODE)
+# Control characters mark highlights so product text can be escaped first
+HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE = "\x02", "\x03"
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query: every word must match as a prefix."""
+    words = SEARCH_WORD.findall(text)[:8]
+    return " ".join(f'"{word}"*' for word in words)
+
+def render_highlight(text):
+    escaped = str(escape(text or ""))
+    return Markup(escaped.replace(HIGHLIGHT_OPEN, "<mark>").replace(HIGHLIGHT_CLOSE, "</mark>"))
+
+def search_products(db, text, page=1, page_size=None):
+    """Return (results, has_next) for one BM25-ranked page of in-stock matches."""
+    page_size = page_size or app.config["CATALOG_PAGE_SIZE"]
+    match = build_match_query(text)
+    if not match:
+        return [], False
+    # Rank first and only then build highlights: snippet() is costly, so
+    # it runs for the rows on this page rather than for every match
+    ranked = db.execute("""SELECT p.id, p.name, p.price, p.image, p.stock, u.shop_name,
+                                  bm25(products_fts, 10.0, 1.0) AS rank
+                           FROM products_fts
+                           JOIN products p ON p.id = products_fts.rowid
+                           LEFT JOIN users u ON p.seller_id = u.id
+                           WHERE products_fts MATCH ? AND p.stock > 0
+                           ORDER BY rank
+                           LIMIT ? OFFSET ?""",
+                        (match, page_size + 1, (page - 1) * page_size)).fetchall()
+    has_next = len(ranked) > page_size
+    ranked = ranked[:page_size]
+    if not ranked:
+        return [], False
+
+    ids = [row["id"] for row in ranked]
+    highlights = {row[0]: (row[1], row[2]) for row in db.execute(
+        f"""SELECT rowid,
+                   highlight(products_fts, 0, '{HIGHLIGHT_OPEN}', '{HIGHLIGHT_CLOSE}'),
+                   snippet(products_fts, 1, '{HIGHLIGHT_OPEN}', '{HIGHLIGHT_CLOSE}', '…', 16)
+            FROM products_fts
+            WHERE products_fts MATCH ? AND rowid IN ({",".join("?" * len(ids))})""",
+        (match, *ids))}
+
+    results = []
+    for row in ranked:
+        result = dict(row)
+        result["name_hl"], result["snippet"] = highlights.get(row["id"], (row["name"], ""))
+        results.append(result)
+    return results, has_next
+
+# ---------------- OUTBOX ------------------
+# Post-purchase work (emails, seller alerts, analytics) never runs inside
+# a request. Checkout writes one outbox row per order in its own
+# transaction; the worker drains the table in batches and hands each event
+# to every handler registered for its topic, outside any transaction.
+# Delivery is at least once: handlers get the event's idempotency key to
+# dedupe on, and a handler that succeeded is not called again when
+# another one fails and the event is retried.
+ORDER_EVENTS = """INSERT INTO outbox (topic, idempotency_key, payload)
+                  SELECT 'order.placed', 'order:' || o.id,
+                         json_object('order_id', o.id, 'user_id', o.user_id,
+                                     'product_id', o.product_id, 'seller_id', o.seller_id,
+                                     'quantity', o.quantity, 'product_name', o.product_name,
+                                     'price', o.unit_price, 'stock_left', p.stock,
+                                     'order_date', o.order_date)
+                  FROM orders o JOIN products p ON p.id = o.product_id
+                  WHERE %s ORDER BY o.id"""
+# The order just inserted
+ORDER_EVENT_INSERT = ORDER_EVENTS % "o.id = last_insert_rowid()"
+# Every order past ?, the highest order id before a batch went in; under
+# the write lock a batch's ids are all above it
+ORDER_EVENTS_INSERT = ORDER_EVENTS % "o.id > ?"
+# Longest wait between two attempts at one event
+OUTBOX_MAX_BACKOFF = 3600
+
+OUTBOX_HANDLERS = {}
+outbox_wakeup = threading.Event()
+_outbox_worker_started = threading.Event()
+
+def outbox_handler(topic):
+    """Register func(event) to run for every event on topic."""
+    def register(func):
+        OUTBOX_HANDLERS.setdefault(topic, []).append(func)
+        return func
+    return register
+
+def enqueue_event(db, topic, key, payload):
+    """Add an event inside the caller's transaction; a key already queued is ignored."""
+    db.execute("INSERT OR IGNORE INTO outbox (topic, idempotency_key, payload) VALUES (?,?,?)",
+               (topic, key, json.dumps(payload)))
+
+class LocalSink:
+    """Stand-in for the mail, alerting and analytics services.
+
+    Appends every message as a JSON line. Each carries the idempotency
+    key a real provider would use to drop redelivered events.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, channel, key, message):
+        line = json.dumps({"channel": channel, "key": key, "sent_at": time.time(), **message})
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+outbox_sink = LocalSink(app.config["OUTBOX_SINK_PATH"])
+
+@outbox_handler("order.placed")
+def send_order_confirmation(event):
+    order = event["payload"]
+    outbox_sink.send("email", event["key"], {
+        "user_id": order["user_id"],
+        "subject": f"Order #{order['order_id']} confirmed",
+        "body": f"{order['quantity']} x {order['product_name']} at ${order['price']:.2f}",
+    })
+
+@outbox_handler("order.placed")
+def alert_seller_low_stock(event):
+    order = event["payload"]
+    if order["seller_id"] and order["stock_left"] < LOW_STOCK_THRESHOLD:
+        outbox_sink.send("seller_alert", event["key"], {
+            "seller_id": order["seller_id"],
+            "product_id": order["product_id"],
+            "stock_left": order["stock_left"],
+        })
+
+@outbox_handler("order.placed")
+def record_sale_analytics(event):
+    outbox_sink.send("analytics", event["key"], {"event": event["topic"], **event["payload"]})
+
+def claim_outbox_batch(db, batch_size):
+    """Lease up to batch_size due events to this worker and return them."""
+    now = time.time()
+
+    def work(db):
+        rows = db.execute("""SELECT id, topic, idempotency_key, payload, attempts FROM outbox
+                             WHERE status = 'pending' AND available_at <= ?
+                             ORDER BY available_at, id LIMIT ?""", (now, batch_size)).fetchall()
+        db.executemany("UPDATE outbox SET attempts = attempts + 1, available_at = ? WHERE id = ?",
+                       [(now + app.config["OUTBOX_LEASE_SECONDS"], row["id"]) for row in rows])
+        return rows
+    return run_write_transaction(db, work)
+
+def drain_outbox(db, batch_size=None):
+    """Dispatch one batch of due events; return (delivered, retried, failed) counts."""
+    events = claim_outbox_batch(db, batch_size or app.config["OUTBOX_BATCH_SIZE"])
+    if not events:
+        return 0, 0, 0
+    ids = [event["id"] for event in events]
+    seen = {tuple(row) for row in db.execute(f"""SELECT event_id, handler FROM outbox_deliveries
+                                                 WHERE event_id IN ({",".join("?" * len(ids))})""", ids)}
+
+    deliveries, done, retry, failed = [], [], [], []
+    for event in events:
+        attempt = event["attempts"] + 1
+        message = {"id": event["id"], "topic": event["topic"], "key": event["idempotency_key"],
+                   "payload": json.loads(event["payload"]), "attempt": attempt}
+        errors = []
+        for handler in OUTBOX_HANDLERS.get(event["topic"], []):
+            if (event["id"], handler.__name__) in seen:
+                continue
+            try:
+                handler(message)
+                deliveries.append((event["id"], handler.__name__, time.time()))
+            except Exception as e:
+                errors.append(f"{handler.__name__}: {e}")
+        now = time.time()
+        if not errors:
+            done.append((now, event["id"]))
+        elif attempt >= app.config["OUTBOX_MAX_ATTEMPTS"]:
+            failed.append((now, "; ".join(errors), event["id"]))
+        else:
+            delay = min(app.config["OUTBOX_RETRY_SECONDS"] * 2 ** (attempt - 1), OUTBOX_MAX_BACKOFF)
+            retry.append((now + delay, "; ".join(errors), event["id"]))
+
+    def work(db):
+        db.executemany("INSERT OR IGNORE INTO outbox_deliveries (event_id, handler, delivered_at) VALUES (?,?,?)",
+                       deliveries)
+        db.executemany("UPDATE outbox SET status = 'done', processed_at = ?, last_error = NULL WHERE id = ?", done)
+        db.executemany("UPDATE outbox SET status = 'failed', processed_at = ?, last_error = ? WHERE id = ?", failed)
+        db.executemany("UPDATE outbox SET available_at = ?, last_error = ? WHERE id = ?", retry)
+    run_write_transaction(db, work)
+    for _, error, event_id in failed:
+        print(f"Error delivering outbox event {event_id}, giving up: {error}")
+    return len(done), len(retry), len(failed)
+
+def purge_outbox(db):
+    """Delete delivered events older than OUTBOX_RETENTION_DAYS; return how many went."""
+    cutoff = time.time() - app.config["OUTBOX_RETENTION_DAYS"] * 86400
+
+    def work(db):
+        db.execute("""DELETE FROM outbox_deliveries WHERE event_id IN
+                      (SELECT id FROM outbox WHERE status = 'done' AND processed_at < ?)""", (cutoff,))
+        return db.execute("DELETE FROM outbox WHERE status = 'done' AND processed_at < ?", (cutoff,)).rowcount
+    return run_write_transaction(db, work)
+
+def run_outbox_worker(db, stop=None):
+    """Drain the outbox until stop is set, waiting between polls when it is empty."""
+    last_purge = 0.0
+    while not (stop and stop.is_set()):
+        try:
+            if any(drain_outbox(db)):
+                continue
+            if time.time() - last_purge > 3600:
+                purge_outbox(db)
+                last_purge = time.time()
+        except Exception as e:
+            print(f"Error draining outbox: {e}")
+        # Checkout sets the event, so new orders are picked up right away
+        outbox_wakeup.wait(app.config["OUTBOX_POLL_INTERVAL"])
+        outbox_wakeup.clear()
+
+def warn_undrained_outbox(db):
+    """Log a warning when events sit past their due time and this process will not drain them."""
+    overdue = db.execute("""SELECT COUNT(*) FROM outbox
+                            WHERE status = 'pending' AND available_at < ?""",
+                         (time.time() - app.config["OUTBOX_LEASE_SECONDS"],)).fetchone()[0]
+    if overdue:
+        app.logger.warning("%d outbox events are overdue and this process does not drain the outbox: "
+                           "run `flask drain-outbox --watch` or set OUTBOX_WORKER=1", overdue)
+    return overdue
+
+def start_outbox_worker():
+    """Run the outbox worker on a daemon thread with its own connection."""
+    if app.config["OUTBOX_POLL_INTERVAL"] <= 0 or _outbox_worker_started.is_set():
+        return
+    _outbox_worker_started.set()
+    threading.Thread(target=lambda: run_outbox_worker(connect_db()), name="outbox-worker", daemon=True).start()
+
+@app.cli.command("drain-outbox")
+@click.option("--watch", is_flag=True, help="Keep draining until interrupted.")
+@click.option("--retry-failed", is_flag=True, help="Requeue events that ran out of attempts first.")
+def drain_outbox_command(watch, retry_failed):
+    """Dispatch pending outbox events, from a process of its own."""
+    db = get_db()
+    run_migrations(db)
+    if retry_failed:
+        requeued = run_write_transaction(db, lambda db: db.execute(
+            """UPDATE outbox SET status = 'pending', attempts = 0, available_at = ?
+               WHERE status = 'failed'""", (time.time(),)).rowcount)
+        print(f"🔁 Requeued {requeued} failed events")
+    if watch:
+        run_outbox_worker(db)
+        return
+    totals = [0, 0, 0]
+    while True:
+        counts = drain_outbox(db)
+        if not any(counts):
+            break
+        totals = [a + b for a, b in zip(totals, counts)]
+    print(f"📬 Delivered {totals[0]}, retrying {totals[1]}, failed {totals[2]}")
+
+# ---------------- CHECKOUT ------------------
+def place_order(db, user_id, product_id, quantity=1):
+    """Atomically reserve stock and record the order. Returns False when sold out."""
+    def work(db):
+        # The stock check and the decrement are one statement, so two
+        # buyers can never both take the last unit
+        left = db.execute("UPDATE products SET stock = stock - ? WHERE id=? AND stock >= ? RETURNING stock",
+                          (quantity, product_id, quantity)).fetchone()
+        if left is None:
+            return None
+        db.execute(ORDER_INSERT, (user_id, product_id, quantity))
+        db.execute(ORDER_EVENT_INSERT)
+        count_co_purchases(db)
+        return left[0]
+    left = run_write_transaction(db, work)
+    if left is None:
+        return False
+    if left == 0:
+        catalog_cache.invalidate_stock()
+    outbox_wakeup.set()
+    return True
+
+def place_bulk_order(db, user_id, lines, clear_cart=False):
+    """Check and decrement stock for every (product_id, quantity) line in one transaction.
+
+    Returns a list of product ids that lack stock or no longer exist;
+    nothing is written unless the list is empty.
+    """
+    wanted = {}
+    for product_id, quantity in lines:
+        wanted[product_id] = wanted.get(product_id, 0) + quantity
+    if not wanted:
+        return []
+
+    def work(db):
+        sold_out.clear()
+        ids = list(wanted)
+        placeholders = ",".join("?" * len(ids))
+        stock = dict(db.execute(f"SELECT id, stock FROM products WHERE id IN ({placeholders})", ids).fetchall())
+        short = [pid for pid, qty in wanted.items() if stock.get(pid, 0) < qty]
+        if short:
+            return short
+
+        items = list(wanted.items())
+        cursor = db.executemany("UPDATE products SET stock = stock - ? WHERE id=? AND stock >= ?",
+                                [(qty, pid, qty) for pid, qty in items])
+        if cursor.rowcount != len(items):
+            raise sqlite3.IntegrityError("stock changed during checkout")
+        last_order = db.execute("SELECT COALESCE(MAX(id), 0) FROM orders").fetchone()[0]
+        db.executemany(ORDER_INSERT, [(user_id, pid, qty) for pid, qty in items])
+        db.execute(ORDER_EVENTS_INSERT, (last_order,))
+        count_co_purchases(db)
+        if clear_cart:
+            db.execute("DELETE FROM cart_items WHERE user_id=?", (user_id,))
+        sold_out.extend(pid for pid, qty in items if stock[pid] == qty)
+        return []
+    sold_out = []
+    short = run_write_transaction(db, work)
+    if not short:
+        if sold_out:
+            catalog_cache.invalidate_stock()
+        outbox_wakeup.set()
+    return short
+
+# ---------------- FLASH SALE ------------------
+# When one product sells out in minutes, every place_order() call waits
+# for the same write lock and commits on its own. In flash-sale mode buy()
+# hands purchases of hot products to a single writer thread instead. It
+# takes whatever has queued up while the last batch committed, allocates
+# each product's stock in arrival order, writes the orders and one stock
+# decrement per product in a single transaction, then wakes each waiting
+# request with its own result.
+class FlashSaleBusy(Exception):
+    pass
+
+class PendingPurchase:
+    __slots__ = ("user_id", "product_id", "quantity", "state", "result", "done")
+
+    def __init__(self, user_id, product_id, quantity):
+        self.user_id = user_id
+        self.product_id = product_id
+        self.quantity = quantity
+        self.state = "queued"   # then "taken" by the writer or "cancelled" by the request
+        self.result = None      # True, False when sold out, or the exception that failed it
+        self.done = threading.Event()
+
+class HotProducts:
+    """Per-product buy counts over one-second windows."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._window = 0
+        self._counts = {}
+        self._previous = {}
+
+    def record(self, product_id):
+        """Count a buy; True when this or the previous second is over FLASH_SALE_HOT_RATE."""
+        rate = app.config["FLASH_SALE_HOT_RATE"]
+        if rate <= 0:
+            return True
+        window = int(time.monotonic())
+        with self._lock:
+            if window != self._window:
+                self._previous = self._counts if window == self._window + 1 else {}
+                self._counts = {}
+                self._window = window
+            count = self._counts[product_id] = self._counts.get(product_id, 0) + 1
+            return max(count, self._previous.get(product_id, 0)) > rate
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+class FlashSaleQueue:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches = self.purchases = self.sold_out = self.fallbacks = 0
+
+    def submit(self, purchase):
+        self._queue.put(purchase)
+
+    def take(self, limit, timeout):
+        """Up to limit queued purchases, waiting up to timeout for the first one."""
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        linger_until = time.monotonic() + app.config["FLASH_SALE_LINGER_MS"] / 1000
+        while len(batch) < limit:
+            wait = linger_until - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=wait) if wait > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            batch = [purchase for purchase in batch if purchase.state == "queued"]
+            for purchase in batch:
+                purchase.state = "taken"
+        return batch
+
+    def cancel(self, purchase):
+        """Withdraw a purchase the writer has not taken; False once it has."""
+        with self._lock:
+            if purchase.state != "queued":
+                return False
+            purchase.state = "cancelled"
+            return True
+
+    def record(self, results, fallback):
+        with self._lock:
+            self.batches += 1
+            self.purchases += len(results)
+            self.sold_out += sum(1 for result in results if result is False)
+            self.fallbacks += fallback
+
+    def stats(self):
+        with self._lock:
+            return {"batches": self.batches, "purchases": self.purchases,
+                    "sold_out": self.sold_out, "fallbacks": self.fallbacks}
+
+hot_products = HotProducts()
+flash_sale_queue = FlashSaleQueue()
+_flash_sale_writer_started = threading.Event()
+_flash_sale_writer_lock = threading.Lock()
+
+def commit_flash_sale_batch(db, batch):
+    """Place every purchase in batch in one transaction; return True/False (sold out) for each."""
+    def work(db):
+        sold_out.clear()
+        ids = list({purchase.product_id for purchase in batch})
+        placeholders = ",".join("?" * len(ids))
+        stock = dict(db.execute(f"SELECT id, stock FROM products WHERE id IN ({placeholders})", ids).fetchall())
+        # BEGIN IMMEDIATE holds the write lock, so stock cannot change under us
+        results, taken = [], {}
+        for purchase in batch:
+            placed = stock.get(purchase.product_id, 0) >= purchase.quantity
+            if placed:
+                stock[purchase.product_id] -= purchase.quantity
+                taken[purchase.product_id] = taken.get(purchase.product_id, 0) + purchase.quantity
+            results.append(placed)
+        db.executemany("UPDATE products SET stock = stock - ? WHERE id=?",
+                       [(quantity, pid) for pid, quantity in taken.items()])
+        last_order = db.execute("SELECT COALESCE(MAX(id), 0) FROM orders").fetchone()[0]
+        db.executemany(ORDER_INSERT, [(purchase.user_id, purchase.product_id, purchase.quantity)
+                                      for purchase, placed in zip(batch, results) if placed])
+        db.execute(ORDER_EVENTS_INSERT, (last_order,))
+        count_co_purchases(db)
+        sold_out.extend(pid for pid in taken if stock[pid] == 0)
+        return results
+    sold_out = []
+    results = run_write_transaction(db, work)
+    if sold_out:
+        catalog_cache.invalidate_stock()
+    return results
+
+def run_flash_sale_writer(db, stop=None):
+    """Commit queued flash-sale purchases in batches until stop is set (forever without one)."""
+    while stop is None or not stop.is_set():
+        batch = flash_sale_queue.take(app.config["FLASH_SALE_BATCH"], timeout=1.0)
+        if not batch:
+            continue
+        fallback = False
+        try:
+            results = commit_flash_sale_batch(db, batch)
+            if any(results):
+                outbox_wakeup.set()
+        except Exception as e:
+            # Place them one by one, so one bad purchase fails alone
+            print(f"Error committing flash sale batch of {len(batch)}: {e}")
+            fallback = True
+            results = []
+            for purchase in batch:
+                try:
+                    results.append(place_order(db, purchase.user_id, purchase.product_id, purchase.quantity))
+                except Exception as e:
+                    results.append(e)
+        flash_sale_queue.record(results, fallback)
+        for purchase, result in zip(batch, results):
+            purchase.result = result
+            purchase.done.set()
 
-# ------------------ Flask App ------------------
-# Get the absolute path to the project root
-try:
-    # If running from routes/customers/ folder
-    PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-except:
-    # If running from project root
-    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+def start_flash_sale_writer():
+    """Run the flash-sale writer on a daemon thread with its own connection."""
+    with _flash_sale_writer_lock:
+        if _flash_sale_writer_started.is_set():
+            return
+        _flash_sale_writer_started.set()
+    threading.Thread(target=lambda: run_flash_sale_writer(connect_db()), name="flash-sale-writer",
+                     daemon=True).start()
 
-print(f"📁 Project Root: {PROJECT_ROOT}")
+def place_order_grouped(user_id, product_id, quantity=1):
+    """place_order() through the flash-sale writer.
 
-app = Flask(
-    __name__,
-    template_folder=os.path.join(PROJECT_ROOT, "templates"),
-    static_folder=os.path.join(PROJECT_ROOT, "static")
-)
-app.secret_key = "supersecretkey123"
+    Raises FlashSaleBusy when the writer has not taken the purchase within
+    FLASH_SALE_TIMEOUT; nothing is written in that case.
+    """
+    start_flash_sale_writer()
+    purchase = PendingPurchase(user_id, product_id, quantity)
+    flash_sale_queue.submit(purchase)
+    if not purchase.done.wait(app.config["FLASH_SALE_TIMEOUT"]):
+        if flash_sale_queue.cancel(purchase):
+            raise FlashSaleBusy(f"purchase of product {product_id} not taken in time")
+        purchase.done.wait()  # its batch is committing
+    if isinstance(purchase.result, Exception):
+        raise purchase.result
+    return purchase.result
 
-# ---------------- DATABASE ------------------
-DATABASE = os.path.join(PROJECT_ROOT, "customers.db")
-print(f"🗄️ Database Path: {DATABASE}")
+# ---------------- RECOMMENDATIONS ------------------
+# "Frequently bought together" from co-purchases. Orders carry no session,
+# so a basket is one user's orders on one (UTC) day. A product's
+# recommendations are read from product_recommendations with one primary
+# key range scan; nothing is computed per page view.
+#
+# Every transaction that writes orders then applies every order past
+# applied_through, in id order, and moves the mark, so each order is
+# counted exactly once and recommendations are current when it commits.
+# A pair is counted when the later of its two orders is applied, and only
+# if the product is new to the basket. Cancelled orders stay counted until
+# the next rebuild.
+CO_PURCHASE_APPLY_BATCH = 500
 
-def get_db():
-    db = getattr(g, '_database', None)
-    if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
-    return db
+def refresh_recommendations(db, product_ids):
+    """Rewrite the top-K rows of each product from its co_purchases counts."""
+    db.executemany("DELETE FROM product_recommendations WHERE product_id = ?", [(pid,) for pid in product_ids])
+    db.executemany("""INSERT INTO product_recommendations (product_id, rank, other_id, baskets)
+                      SELECT product_id, ROW_NUMBER() OVER (ORDER BY baskets DESC, other_id), other_id, baskets
+                      FROM co_purchases WHERE product_id = ?1
+                      ORDER BY baskets DESC, other_id LIMIT ?2""",
+                   [(pid, app.config["RECOMMENDATIONS_TOP_K"]) for pid in product_ids])
 
-@app.teardown_appcontext
-def close_connection(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+def count_co_purchases(db, limit=CO_PURCHASE_APPLY_BATCH):
+    """Count up to limit orders past the mark inside the caller's write transaction; return how many."""
+    mark = db.execute("SELECT applied_through FROM recommendation_state").fetchone()[0]
+    new_orders = db.execute("""SELECT id, user_id, product_id, order_date FROM orders
+                               WHERE id > ? ORDER BY id LIMIT ?""", (mark, limit)).fetchall()
+    pairs = {}
+    for order in new_orders:
+        basket = {row[0] for row in db.execute(
+            """SELECT product_id FROM orders
+               WHERE user_id = ?1 AND id < ?2 AND order_date >= date(?3) AND order_date < date(?3, '+1 day')""",
+            (order["user_id"], order["id"], order["order_date"]))}
+        if order["product_id"] in basket:
+            continue
+        for other in basket:
+            for pair in ((order["product_id"], other), (other, order["product_id"])):
+                pairs[pair] = pairs.get(pair, 0) + 1
+    db.executemany("""INSERT INTO co_purchases (product_id, other_id, baskets) VALUES (?, ?, ?)
+                      ON CONFLICT(product_id, other_id) DO UPDATE SET baskets = baskets + excluded.baskets""",
+                   [(*pair, count) for pair, count in pairs.items()])
+    refresh_recommendations(db, {product_id for product_id, _ in pairs})
+    if new_orders:
+        db.execute("UPDATE recommendation_state SET applied_through = ?", (new_orders[-1]["id"],))
+    return len(new_orders)
 
-# ---------------- SAFE DB INIT ------------------
-def init_db():
+def apply_co_purchases(db, limit=CO_PURCHASE_APPLY_BATCH):
+    """Count orders written outside the checkout paths, up to limit; return how many were applied."""
+    return run_write_transaction(db, lambda db: count_co_purchases(db, limit))
+
+def rebuild_recommendations(db, batch_users=None):
+    """Recount co_purchases from every order and rebuild the top-K table; return (pairs, products)."""
+    batch_users = batch_users or app.config["RECOMMENDATIONS_REBUILD_BATCH"]
+
+    def start(db):
+        db.execute("DELETE FROM co_purchases")
+        db.execute("DELETE FROM product_recommendations")
+        mark = db.execute("""SELECT MAX(COALESCE((SELECT MAX(id) FROM orders), 0),
+                                    COALESCE((SELECT MAX(id) FROM orders_archive), 0))""").fetchone()[0]
+        db.execute("UPDATE recommendation_state SET applied_through = ?", (mark,))
+        return mark
+    # Orders after the mark are counted by the transactions that place
+    # them, which may run alongside; both only ever add to the counts
+    mark = run_write_transaction(db, start)
+
+    # Every (user, day, product) basket entry once, built outside any
+    # write transaction; then set-based self-joins over batches of users
+    db.execute("DROP TABLE IF EXISTS temp.baskets")
+    db.execute("""CREATE TEMP TABLE baskets AS
+                  SELECT DISTINCT user_id, date(order_date) AS day, product_id
+                  FROM order_history WHERE id <= ?""", (mark,))
+    db.execute("CREATE INDEX temp.idx_baskets ON baskets(user_id, day, product_id)")
+    users = [row[0] for row in db.execute("SELECT DISTINCT user_id FROM temp.baskets ORDER BY user_id")]
+    for start_index in range(0, len(users), batch_users):
+        chunk = users[start_index:start_index + batch_users]
+        run_write_transaction(db, lambda db: db.execute(
+            """INSERT INTO co_purchases (product_id, other_id, baskets)
+               SELECT a.product_id, b.product_id, COUNT(*)
+               FROM temp.baskets a
+               JOIN temp.baskets b ON b.user_id = a.user_id AND b.day = a.day AND b.product_id != a.product_id
+               WHERE a.user_id BETWEEN ? AND ?
+               GROUP BY a.product_id, b.product_id
+               ON CONFLICT(product_id, other_id) DO UPDATE SET baskets = baskets + excluded.baskets""",
+            (chunk[0], chunk[-1])))
+    db.execute("DROP TABLE temp.baskets")
+
+    def rank(db):
+        db.execute("DELETE FROM product_recommendations")
+        db.execute("""INSERT INTO product_recommendations (product_id, rank, other_id, baskets)
+                      SELECT product_id, rank, other_id, baskets FROM (
+                          SELECT product_id, other_id, baskets,
+                                 ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY baskets DESC, other_id) AS rank
+                          FROM co_purchases)
+                      WHERE rank <= ?""", (app.config["RECOMMENDATIONS_TOP_K"],))
+        return (db.execute("SELECT COUNT(*) FROM co_purchases").fetchone()[0],
+                db.execute("SELECT COUNT(DISTINCT product_id) FROM product_recommendations").fetchone()[0])
+    return run_write_transaction(db, rank)
+
+def get_recommendations(db, product_ids, limit=None):
+    """In-stock products most often bought with any of product_ids, best first, excluding them."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return []
+    placeholders = ",".join("?" * len(product_ids))
+    return db.execute(f"""SELECT p.*, u.shop_name FROM
+                              (SELECT other_id, SUM(baskets) AS score, MIN(rank) AS best
+                               FROM product_recommendations WHERE product_id IN ({placeholders})
+                               GROUP BY other_id) r
+                          JOIN products p ON p.id = r.other_id
+                          LEFT JOIN users u ON p.seller_id = u.id
+                          WHERE p.stock > 0 AND p.id NOT IN ({placeholders})
+                          ORDER BY r.score DESC, r.best, p.id LIMIT ?""",
+                      (*product_ids, *product_ids, limit or app.config["RECOMMENDATIONS_SHOWN"])).fetchall()
+
+def get_user_recommendations(db, user_id, recent=5):
+    """Recommendations from the products of the user's latest orders."""
+    bought = [row[0] for row in db.execute("""SELECT product_id FROM orders WHERE user_id = ?
+                                              GROUP BY product_id ORDER BY MAX(id) DESC LIMIT ?""",
+                                           (user_id, recent))]
+    return get_recommendations(db, bought)
+
+@app.cli.command("rebuild-recommendations")
+def rebuild_recommendations_command():
+    """Recount "frequently bought together" from all orders."""
+    db = get_db()
+    run_migrations(db)
+    started = time.perf_counter()
+    pairs, products = rebuild_recommendations(db)
+    print(f"🛍️ Counted {pairs} product pairs, recommendations for {products} products "
+          f"in {time.perf_counter() - started:.1f}s")
+
+# ---------------- STATIC ASSETS ------------------
+# Stylesheets are served as content-hashed copies under static/dist, so
+# browsers can cache them for a year: changed content gets a new name.
+# gzip (and brotli, when installed) variants are written once at build
+# time rather than compressed per request. create_app() and
+# `flask build-assets` build them; importing the module only reads the
+# manifest the last build left.
+ASSET_SOURCES = ("css", "style")
+ASSET_BUILD_DIR = os.path.join(app.static_folder, "dist")
+ASSET_MANIFEST = os.path.join(ASSET_BUILD_DIR, "manifest.json")
+ASSET_MAX_AGE = 365 * 24 * 3600
+# Preferred first; each entry is (Content-Encoding, file suffix)
+ASSET_ENCODINGS = ((("br", ".br"),) if brotli else ()) + (("gzip", ".gz"),)
+
+def _write_once(path, data):
+    # Built names are content-addressed, so an existing file is current
+    if os.path.exists(path):
+        return
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def build_assets():
+    """Fingerprint and precompress the static assets; return {source path: built path}."""
+    manifest = {}
+    for source in ASSET_SOURCES:
+        for dirpath, _, filenames in os.walk(os.path.join(app.static_folder, source)):
+            for filename in sorted(filenames):
+                if not filename.endswith((".css", ".js")):
+                    continue
+                path = os.path.join(dirpath, filename)
+                logical = os.path.relpath(path, app.static_folder).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    data = f.read()
+                stem, ext = os.path.splitext(logical)
+                built = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+                target = os.path.join(ASSET_BUILD_DIR, built)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                _write_once(target, data)
+                _write_once(target + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli:
+                    _write_once(target + ".br", brotli.compress(data, quality=11))
+                manifest[logical] = built
+    tmp = f"{ASSET_MANIFEST}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, ASSET_MANIFEST)
+    return manifest
+
+def load_asset_manifest():
+    """The manifest of the last build; until there is one, asset_url() serves the plain files."""
     try:
-        with app.app_context():
-            db = get_db()
-            cursor = db.cursor()
-            
-            print("🔧 Initializing database...")
+        with open(ASSET_MANIFEST) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-            # Drop existing tables and recreate them (safest approach)
-            try:
-                cursor.execute("DROP TABLE IF EXISTS orders")
-                cursor.execute("DROP TABLE IF EXISTS products") 
-                cursor.execute("DROP TABLE IF EXISTS users")
-                print("🗑️ Cleared old tables")
-            except:
-                pass
-
-            # Create users table with all required columns
-            cursor.execute('''CREATE TABLE users (
-                                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                username TEXT NOT NULL,
-                                email TEXT UNIQUE NOT NULL,
-                                password TEXT NOT NULL,
-                                role TEXT DEFAULT 'user',
-                                shop_name TEXT,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-
-            # Create products table with all required columns
-            cursor.execute('''CREATE TABLE products (
-                                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                name TEXT NOT NULL,
-                                price REAL NOT NULL,
-                                image TEXT,
-                                seller_id INTEGER,
-                                stock INTEGER DEFAULT 0,
-                                description TEXT,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                FOREIGN KEY(seller_id) REFERENCES users(id))''')
-
-            # Create orders table with all required columns
-            cursor.execute('''CREATE TABLE orders (
-                                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                user_id INTEGER,
-                                product_id INTEGER,
-                                quantity INTEGER DEFAULT 1,
-                                order_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                FOREIGN KEY(user_id) REFERENCES users(id),
-                                FOREIGN KEY(product_id) REFERENCES products(id))''')
-
-            # Insert sample products
-            sample_products = [
-                ("iPhone 15", 1200, "https://via.placeholder.com/150", None, 10, "Latest iPhone model"),
-                ("Samsung S24", 1100, "https://via.placeholder.com/150", None, 15, "Samsung flagship phone"),
-                ("MacBook Air", 1500, "https://via.placeholder.com/150", None, 5, "Apple laptop"),
-                ("Sony Headphones", 200, "https://via.placeholder.com/150", None, 20, "High quality headphones")
-            ]
-            cursor.executemany("INSERT INTO products (name, price, image, seller_id, stock, description) VALUES (?, ?, ?, ?, ?, ?)", sample_products)
-
-            # Create admin account
-            admin_password = generate_password_hash("admin123")
-            cursor.execute(
-                "INSERT INTO users (username, email, password, role) VALUES (?, ?, ?, ?)",
-                ("admin", "admin@example.com", admin_password, "admin")
-            )
+asset_manifest = load_asset_manifest()
+built_assets = set(asset_manifest.values())
 
-            # Create seller account
-            seller_password = generate_password_hash("seller123")
-            cursor.execute(
-                "INSERT INTO users (username, email, password, role, shop_name) VALUES (?, ?, ?, ?, ?)",
-                ("seller1", "seller@example.com", seller_password, "seller", "Tech Store")
-            )
-            
-            db.commit()
-            print("✅ Database created successfully!")
-            print("👤 Default accounts created:")
-            print("   🔑 Admin: admin@example.com / admin123")
-            print("   🏪 Seller: seller@example.com / seller123")
+@app.template_global()
+def asset_url(filename):
+    built = asset_manifest.get(filename)
+    if built is None:
+        return url_for('static', filename=filename)
+    return url_for('asset', filename=built)
 
-    except Exception as e:
-        print(f"❌ Database initialization error: {e}")
-        traceback.print_exc()
+@app.cli.command("build-assets")
+def build_assets_command():
+    """Write fingerprinted, precompressed copies of the static assets."""
+    for logical, built in sorted(build_assets().items()):
+        print(f"📦 {logical} -> dist/{built}")
 
-# ---------------- AUTH FUNCTIONS ------------------
-def get_user_by_email(email):
+# ---------------- PRODUCT IMAGES ------------------
+# Uploads are stored under their content hash, so the original and every
+# thumbnail can be cached forever and a repeated upload is stored once.
+# The original is written only once the product row has committed, so a
+# failed save leaves no file behind. Resizing then runs in a process
+# pool; until it finishes, pages show the original.
+#   <store>/<hash[:2]>/<hash>.<ext>        original
+#   <store>/<hash[:2]>/<hash>-<width>.jpg  one per IMAGE_WIDTHS entry
+IMAGE_WIDTHS = (160, 320, 640, 1280)
+IMAGE_TYPES = ((b"\xff\xd8\xff", "jpg"), (b"\x89PNG\r\n\x1a\n", "png"),
+               (b"GIF87a", "gif"), (b"GIF89a", "gif"))
+IMAGE_QUALITY = 82
+
+class ImageRejected(Exception):
+    pass
+
+ImageUpload = namedtuple("ImageUpload", "url key variants ext data")
+
+_image_pool = None
+_image_pool_lock = threading.Lock()
+
+def sniff_image_type(data):
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return next((ext for magic, ext in IMAGE_TYPES if data.startswith(magic)), None)
+
+def image_path(image_hash, suffix):
+    return os.path.join(app.config["IMAGE_STORE_DIR"], image_hash[:2], image_hash + suffix)
+
+def image_url(image_hash, suffix):
+    return url_for("media", filename=f"{image_hash[:2]}/{image_hash}{suffix}")
+
+def save_product_image(db, upload):
+    """Check an uploaded image and record it in db's open transaction; return an ImageUpload.
+
+    variants is already set when the same image was uploaded and resized
+    before. Nothing is written to disk: call store_image_upload() once the
+    product is committed.
+    """
+    data = upload.stream.read(app.config["IMAGE_MAX_BYTES"] + 1)
+    if len(data) > app.config["IMAGE_MAX_BYTES"]:
+        raise ImageRejected(f"Images must be under {app.config['IMAGE_MAX_BYTES'] // (1024 * 1024)} MB")
+    ext = sniff_image_type(data)
+    if ext is None:
+        raise ImageRejected("Please upload a JPEG, PNG, GIF or WebP image")
+
+    image_hash = hashlib.sha256(data).hexdigest()[:32]
+    db.execute("INSERT OR IGNORE INTO product_images (hash, ext) VALUES (?, ?)", (image_hash, ext))
+    variants = db.execute("SELECT variants FROM product_images WHERE hash=?", (image_hash,)).fetchone()[0]
+    return ImageUpload(image_url(image_hash, f".{ext}"), image_hash, variants, ext, data)
+
+def store_image_upload(upload):
+    """Write the original of a committed ImageUpload and queue its resize if it has none yet."""
     try:
-        db = get_db()
-        row = db.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
-        if row:
-            user_dict = dict(row)
-            if 'role' not in user_dict or user_dict['role'] is None:
-                user_dict['role'] = 'user'
-            return user_dict
+        os.makedirs(os.path.dirname(image_path(upload.key, "")), exist_ok=True)
+        _write_once(image_path(upload.key, f".{upload.ext}"), upload.data)
+    except OSError as e:
+        print(f"Error storing image {upload.key}: {e}")
+        return
+    if not upload.variants:
+        queue_image_variants(upload.key, upload.ext)
+
+def read_image_upload(db):
+    """save_product_image() for the request's image_file field, or None without one."""
+    upload = request.files.get("image_file")
+    if not upload or not upload.filename:
         return None
+    return save_product_image(db, upload)
+
+def make_image_variants(source, prefix, widths, quality):
+    """Write prefix-<width>.jpg for each width the source can fill; return (width, height, widths).
+
+    Runs in the image pool. A source narrower than a width still gets that
+    one variant, at its own size, so every image has at least one.
+    """
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        size = img.size
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            flat = Image.new("RGB", img.size, (255, 255, 255))
+            flat.paste(img, mask=img.getchannel("A"))
+            img = flat
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        widths = [w for w in widths if w < size[0]] + [w for w in widths if w >= size[0]][:1]
+        for width in widths:
+            path = f"{prefix}-{width}.jpg"
+            if os.path.exists(path):
+                continue
+            variant = img.copy()
+            # Keeps the aspect ratio and never upscales
+            variant.thumbnail((width, width * 4), Image.LANCZOS)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            variant.save(tmp, "JPEG", quality=quality, optimize=True, progressive=True)
+            os.replace(tmp, path)
+    return size[0], size[1], widths
+
+def get_image_pool():
+    global _image_pool
+    with _image_pool_lock:
+        if _image_pool is None:
+            # spawn: forking a threaded server process is not safe
+            _image_pool = ProcessPoolExecutor(max_workers=app.config["IMAGE_WORKERS"],
+                                              mp_context=multiprocessing.get_context("spawn"))
+        return _image_pool
+
+def finish_image_variants(image_hash, future):
+    db = None
+    try:
+        error = future.exception()
+        width, height, widths = future.result() if error is None else (None, None, ())
+        variants = ",".join(map(str, widths)) or None
+
+        def work(db):
+            db.execute("UPDATE product_images SET status=?, width=?, height=?, variants=? WHERE hash=?",
+                       ("ready" if error is None else "failed", width, height, variants, image_hash))
+            db.execute("UPDATE products SET image_variants=? WHERE image_key=?", (variants, image_hash))
+        db = connect_db()
+        run_write_transaction(db, work)
+        catalog_cache.invalidate()
+        if error is not None:
+            print(f"Error resizing image {image_hash}: {error}")
     except Exception as e:
-        print(f"Error getting user: {e}")
+        print(f"Error recording image variants for {image_hash}: {e}")
+    finally:
+        if db is not None:
+            db.close()
+
+def queue_image_variants(image_hash, ext):
+    """Resize an image in the background; returns the future, or None without Pillow."""
+    if Image is None:
         return None
+    future = get_image_pool().submit(make_image_variants, image_path(image_hash, f".{ext}"),
+                                     image_path(image_hash, ""), IMAGE_WIDTHS, IMAGE_QUALITY)
+    future.add_done_callback(lambda f: finish_image_variants(image_hash, f))
+    return future
 
-def add_user(username, email, password, role="user", shop_name=None):
+def _product_field(product, name):
     try:
-        db = get_db()
-        db.execute(
-            "INSERT INTO users (username, email, password, role, shop_name) VALUES (?, ?, ?, ?, ?)",
-            (username, email, generate_password_hash(password), role, shop_name)
-        )
-        db.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-    except Exception as e:
-        print(f"Error adding user: {e}")
-        return False
+        return product[name]
+    except (KeyError, IndexError):
+        return None
+
+@app.template_global()
+def product_image(product, width):
+    """URL of the smallest thumbnail at least width pixels wide, else the product's image."""
+    variants = _product_field(product, "image_variants")
+    if not variants:
+        return product["image"]
+    widths = sorted(int(w) for w in variants.split(","))
+    chosen = next((w for w in widths if w >= width), widths[-1])
+    return image_url(product["image_key"], f"-{chosen}.jpg")
+
+@app.template_global()
+def product_image_srcset(product):
+    variants = _product_field(product, "image_variants")
+    if not variants:
+        return ""
+    return ", ".join(f"{image_url(product['image_key'], f'-{w}.jpg')} {w}w"
+                     for w in sorted(int(w) for w in variants.split(",")))
+
+@app.cli.command("process-images")
+def process_images_command():
+    """Resize every uploaded image that has no thumbnails yet (pending or failed)."""
+    if Image is None:
+        raise SystemExit("Pillow is not installed")
+    db = get_db()
+    run_migrations(db)
+    rows = db.execute("SELECT hash, ext FROM product_images WHERE status != 'ready'").fetchall()
+    futures = [queue_image_variants(row["hash"], row["ext"]) for row in rows]
+    failed = sum(1 for future in futures if future.exception() is not None)
+    print(f"🖼️ Resized {len(futures) - failed} images, {failed} failed")
+
+# ---------------- RENDERED FRAGMENTS ------------------
+# Product cards are keyed by the row fields they render, which serve as
+# the row's version: a card is re-rendered only when one of them changes.
+# The grid is keyed by its cards, so an unchanged page skips the loop.
+class FragmentCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        self.render_seconds_saved = 0.0
+
+    def get(self, key, render):
+        """Return the fragment for key, calling render() on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                # A hit saves what rendering it cost the first time
+                self.render_seconds_saved += entry[1]
+                return entry[0]
+            self.misses += 1
+
+        started = time.perf_counter()
+        value = render()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._entries[key] = (value, elapsed)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries),
+                    "render_ms_saved": round(self.render_seconds_saved * 1000, 1)}
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+fragment_cache = FragmentCache(app.config["FRAGMENT_CACHE_SIZE"])
+
+def product_card_version(product):
+    return (product["id"], product["name"], product["price"], product["image"],
+            _product_field(product, "image_variants"))
+
+def render_product_grid(products):
+    card = get_template_attribute("partials/catalog.html", "product_card")
+    grid = get_template_attribute("partials/catalog.html", "product_grid")
+    versions = [product_card_version(product) for product in products]
+
+    def render():
+        cards = [fragment_cache.get(("card", version), lambda product=product: card(product))
+                 for version, product in zip(versions, products)]
+        return grid(Markup("\n".join(cards)))
+
+    return fragment_cache.get(("grid", tuple(versions)), render)
+
+# ---------------- RESPONSE COMPRESSION ------------------
+COMPRESSIBLE_TYPES = {"text/html", "text/plain", "text/css", "text/csv", "application/json",
+                      "application/javascript", "application/x-ndjson"}
+
+class CompressionStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.responses = self.bytes_in = self.bytes_out = 0
+
+    def record(self, size_in, size_out):
+        with self._lock:
+            self.responses += 1
+            self.bytes_in += size_in
+            self.bytes_out += size_out
+
+    def stats(self):
+        with self._lock:
+            return {"responses": self.responses, "bytes_in": self.bytes_in,
+                    "bytes_out": self.bytes_out, "bytes_saved": self.bytes_in - self.bytes_out}
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+compression_stats = CompressionStats()
+
+def encoded_etag(etag, encoding):
+    # Each encoding is a different representation, so it needs its own
+    # strong ETag; conditional_json() accepts any of them back
+    return f"{etag}-{encoding}"
+
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add("Accept-Encoding")
+    if brotli and request.accept_encodings["br"]:
+        encoding = "br"
+    elif request.accept_encodings["gzip"]:
+        encoding = "gzip"
+    else:
+        return response
+    data = response.get_data()
+    if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+        return response
+
+    if encoding == "br":
+        compressed = brotli.compress(data, quality=app.config["COMPRESS_BROTLI_QUALITY"])
+    else:
+        compressed = gzip.compress(data, compresslevel=app.config["COMPRESS_GZIP_LEVEL"])
+    response.set_data(compressed)
+    response.content_encoding = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(encoded_etag(etag, encoding), weak)
+    compression_stats.record(len(data), len(compressed))
+    return response
 
 # ---------------- ROUTES ------------------
 @app.route('/')
@@ -182,7 +3322,8 @@ def login():
                 error = "Email and password are required"
             else:
                 user = get_user_by_email(email)
-                if user and check_password_hash(user['password'], password):
+                if user and password_hasher.verify(user['password'], password):
+                    upgrade_password_hash(user, password)
                     session['user_id'] = user['id']
                     session['username'] = user['username']
                     session['role'] = user.get('role','user')
@@ -201,6 +3342,8 @@ def login():
                     error = "Invalid credentials"
         
         return render_template('auth/login.html', error=error)
+    except PasswordHasherBusy:
+        return render_template('auth/login.html', error="Too many sign-ins right now, please try again"), 503
     except Exception as e:
         print(f"Error in login: {e}")
         return render_template('auth/login.html', error="Login error occurred")
@@ -254,17 +3397,162 @@ def home():
         if "user_id" not in session or session.get("role") != "user":
             return redirect(url_for('login'))
 
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("""SELECT p.*, u.shop_name FROM products p 
-                          LEFT JOIN users u ON p.seller_id = u.id 
-                          WHERE p.stock > 0""")
-        products = cursor.fetchall()
-        return render_template("home.html", products=products, username=session.get("username"))
+        after = request.args.get("after")
+        before = request.args.get("before")
+        filters = get_catalog_filters(request.args)
+        products, next_cursor, prev_cursor = catalog_cache.get(
+            ("home", after, before, app.config["CATALOG_PAGE_SIZE"], filters),
+            lambda: get_catalog_page(get_read_db(), after=after, before=before, filters=filters),
+            in_stock=filters.in_stock,
+        )
+        facets = catalog_cache.get(("facets", filters.shop),
+                                   lambda: get_catalog_facets(get_read_db(), filters.shop), in_stock=True)
+        first_page = not (after or before) and filters == CatalogFilters()
+        recommended = get_user_recommendations(get_read_db(), session['user_id']) if first_page else []
+        return render_template("home.html", products=products,
+                               product_grid=render_product_grid(products),
+                               recommended_grid=render_product_grid(recommended) if recommended else None,
+                               next_cursor=next_cursor, prev_cursor=prev_cursor,
+                               filters=filters, filter_args=catalog_filter_args(filters),
+                               facets=facets,
+                               username=session.get("username"))
     except Exception as e:
         print(f"Error in home: {e}")
         flash("Error loading products", "danger")
-        return render_template("home.html", products=[], username=session.get("username"))
+        return render_template("home.html", products=[], product_grid=render_product_grid([]),
+                               filters=CatalogFilters(), filter_args={}, facets=None,
+                               username=session.get("username"))
+
+# ----------- PRODUCT PAGE -----------
+@app.route('/product/<int:product_id>')
+def product_page(product_id):
+    try:
+        if "user_id" not in session or session.get("role") != "user":
+            return redirect(url_for('login'))
+
+        db = get_read_db()
+        product = db.execute("""SELECT p.*, u.shop_name FROM products p
+                                LEFT JOIN users u ON p.seller_id = u.id
+                                WHERE p.id=?""", (product_id,)).fetchone()
+        if not product:
+            flash("Product not found!", "danger")
+            return redirect(url_for('home'))
+        recommended = get_recommendations(db, [product_id])
+        return render_template("product.html", product=product,
+                               recommended_grid=render_product_grid(recommended) if recommended else None,
+                               username=session.get("username"))
+    except Exception as e:
+        print(f"Error in product page: {e}")
+        flash("Error loading product", "danger")
+        return redirect(url_for('home'))
+
+# ----------- SEARCH -----------
+def get_search_args():
+    text = request.args.get("q", "").strip()
+    try:
+        page = max(1, min(int(request.args.get("page", 1)), 100))
+    except ValueError:
+        page = 1
+    return text, page
+
+@app.route('/search')
+def search():
+    try:
+        if "user_id" not in session or session.get("role") != "user":
+            return redirect(url_for('login'))
+
+        text, page = get_search_args()
+        results, has_next = search_products(get_read_db(), text, page)
+        return render_template("search.html", query=text, results=results, page=page,
+                               has_next=has_next, highlight=render_highlight,
+                               username=session.get("username"))
+    except Exception as e:
+        print(f"Error in search: {e}")
+        flash("Error searching products", "danger")
+        return render_template("search.html", query="", results=[], page=1, has_next=False,
+                               highlight=render_highlight, username=session.get("username"))
+
+@app.route('/api/search')
+def api_search():
+    if "user_id" not in session:
+        return jsonify(error="login required"), 401
+    try:
+        text, page = get_search_args()
+        results, has_next = search_products(get_read_db(), text, page)
+        return jsonify(
+            query=text,
+            page=page,
+            next_page=page + 1 if has_next else None,
+            results=[{
+                "id": row["id"],
+                "name": row["name"],
+                "price": row["price"],
+                "image": row["image"],
+                "shop_name": row["shop_name"],
+                "name_highlight": str(render_highlight(row["name_hl"])),
+                "snippet": str(render_highlight(row["snippet"])),
+                "score": -row["rank"],
+            } for row in results],
+        )
+    except Exception as e:
+        print(f"Error in api search: {e}")
+        return jsonify(error="search failed"), 500
+
+# ----------- CATALOG API -----------
+@app.route('/api/v1/products')
+def api_products():
+    if "user_id" not in session:
+        return jsonify(error="login required"), 401
+    try:
+        fields = parse_api_fields(request.args.get("fields"))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    limit = max(1, min(request.args.get("limit", app.config["CATALOG_PAGE_SIZE"], type=int),
+                       API_MAX_PAGE_SIZE))
+    try:
+        after = request.args.get("after")
+        before = request.args.get("before")
+        filters = get_catalog_filters(request.args)
+
+        def load(db, version):
+            # Keyed on the change counters rather than shared with /home: a
+            # page cached before a write, here or in another worker, is never
+            # served under the ETag of a later version
+            products, next_cursor, prev_cursor = catalog_cache.get(
+                ("api", version, after, before, limit, filters),
+                lambda: get_catalog_page(db, after=after, before=before, page_size=limit, filters=filters),
+                in_stock=filters.in_stock,
+            )
+            return {
+                "products": [{f: row[f] for f in fields} for row in products],
+                "next_cursor": next_cursor,
+                "prev_cursor": prev_cursor,
+            }
+
+        return conditional_json(load)
+    except Exception as e:
+        print(f"Error in api products: {e}")
+        return jsonify(error="could not load products"), 500
+
+@app.route('/api/v1/products/<int:product_id>')
+def api_product(product_id):
+    if "user_id" not in session:
+        return jsonify(error="login required"), 401
+    try:
+        fields = parse_api_fields(request.args.get("fields"))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    try:
+        def load(db, version):
+            row = db.execute("""SELECT p.*, u.shop_name FROM products p
+                                LEFT JOIN users u ON p.seller_id = u.id
+                                WHERE p.id=?""", (product_id,)).fetchone()
+            return {f: row[f] for f in fields} if row else None
+
+        return conditional_json(load)
+    except Exception as e:
+        print(f"Error in api product: {e}")
+        return jsonify(error="could not load product"), 500
 
 # ----------- USER ORDERS -----------
 @app.route('/orders')
@@ -273,18 +3561,23 @@ def orders():
         if "user_id" not in session or session.get("role") != "user":
             return redirect(url_for('login'))
 
-        db = get_db()
+        history = request.args.get("history") == "1"
+        db = get_read_db()
         cursor = db.cursor()
-        cursor.execute("""SELECT orders.id, products.name, products.price, products.image, orders.quantity, orders.order_date
-                          FROM orders 
-                          JOIN products ON orders.product_id = products.id
-                          WHERE orders.user_id=?""", (session['user_id'],))
+        # The product is only looked up for its picture; orders of deleted
+        # products still show
+        cursor.execute(f"""SELECT orders.id, orders.product_name AS name, orders.unit_price AS price, products.image,
+                                  orders.quantity, orders.order_date
+                           FROM {order_source(history)} orders
+                           LEFT JOIN products ON orders.product_id = products.id
+                           WHERE orders.user_id=?""", (session['user_id'],))
         orders = cursor.fetchall()
-        return render_template("order.html", orders=orders, username=session.get("username"))
+        return render_template("order.html", orders=orders, history=history,
+                               username=session.get("username"))
     except Exception as e:
         print(f"Error in orders: {e}")
         flash("Error loading orders", "danger")
-        return render_template("order.html", orders=[], username=session.get("username"))
+        return render_template("order.html", orders=[], history=False, username=session.get("username"))
 
 # ----------- BUY PRODUCT -----------
 @app.route('/buy/<int:product_id>')
@@ -293,28 +3586,147 @@ def buy(product_id):
         if "user_id" not in session or session.get("role") != "user":
             return redirect(url_for('login'))
 
-        db = get_db()
-        cursor = db.cursor()
-        
-        # Check stock
-        cursor.execute("SELECT stock FROM products WHERE id=?", (product_id,))
-        product = cursor.fetchone()
-        
-        if product and product['stock'] > 0:
-            # Insert order and update stock
-            cursor.execute("INSERT INTO orders (user_id, product_id) VALUES (?,?)", (session['user_id'], product_id))
-            cursor.execute("UPDATE products SET stock = stock - 1 WHERE id=?", (product_id,))
-            db.commit()
+        if app.config["FLASH_SALE"] and hot_products.record(product_id):
+            placed = place_order_grouped(session['user_id'], product_id)
+        else:
+            placed = place_order(get_db(), session['user_id'], product_id)
+        if placed:
             flash("Product purchased successfully!","success")
         else:
             flash("Product out of stock!","danger")
         
         return redirect(url_for('orders'))
+    except FlashSaleBusy:
+        flash("So many people are buying this right now - please try again in a moment.", "warning")
+        return redirect(url_for('home'))
     except Exception as e:
         print(f"Error in buy: {e}")
         flash("Purchase error occurred", "danger")
         return redirect(url_for('home'))
 
+# ----------- CART -----------
+@app.route('/cart')
+def cart():
+    try:
+        if "user_id" not in session or session.get("role") != "user":
+            return redirect(url_for('login'))
+
+        db = get_read_db()
+        items = db.execute("""SELECT c.product_id, c.quantity, p.name, p.price, p.stock
+                              FROM cart_items c
+                              JOIN products p ON c.product_id = p.id
+                              WHERE c.user_id=?
+                              ORDER BY c.added_at""", (session['user_id'],)).fetchall()
+        total = sum(item['price'] * item['quantity'] for item in items)
+        return render_template("cart.html", items=items, total=total, username=session.get("username"))
+    except Exception as e:
+        print(f"Error in cart: {e}")
+        flash("Error loading cart", "danger")
+        return render_template("cart.html", items=[], total=0, username=session.get("username"))
+
+@app.route('/cart/add/<int:product_id>', methods=['POST'])
+def cart_add(product_id):
+    try:
+        if "user_id" not in session or session.get("role") != "user":
+            return redirect(url_for('login'))
+
+        try:
+            quantity = int(request.form.get('quantity', 1))
+        except ValueError:
+            quantity = 0
+        if quantity < 1:
+            flash("Please enter a valid quantity!", "danger")
+            return redirect(url_for('cart'))
+
+        db = get_db()
+        # Selecting from products adds nothing for an id that does not
+        # exist, or that was deleted since the page was rendered
+        update = "excluded.quantity" if request.form.get('replace') else "quantity + excluded.quantity"
+        added = db.execute(f"""INSERT INTO cart_items (user_id, product_id, quantity)
+                               SELECT ?, id, ? FROM products WHERE id=?
+                               ON CONFLICT(user_id, product_id) DO UPDATE SET quantity={update}""",
+                           (session['user_id'], quantity, product_id)).rowcount
+        db.commit()
+        if not added:
+            return "Product not found", 404
+        flash("Cart updated!", "success")
+        return redirect(request.referrer or url_for('cart'))
+    except Exception as e:
+        print(f"Error adding to cart: {e}")
+        flash("Error updating cart", "danger")
+        return redirect(url_for('home'))
+
+@app.route('/cart/remove/<int:product_id>', methods=['POST'])
+def cart_remove(product_id):
+    try:
+        if "user_id" not in session or session.get("role") != "user":
+            return redirect(url_for('login'))
+
+        db = get_db()
+        db.execute("DELETE FROM cart_items WHERE user_id=? AND product_id=?", (session['user_id'], product_id))
+        db.commit()
+        flash("Item removed from cart", "info")
+        return redirect(url_for('cart'))
+    except Exception as e:
+        print(f"Error removing from cart: {e}")
+        flash("Error updating cart", "danger")
+        return redirect(url_for('cart'))
+
+# ----------- CHECKOUT -----------
+@app.route('/checkout', methods=['POST'])
+def checkout():
+    """Place one order for many lines.
+
+    Form posts check out the session user's cart. JSON clients may send
+    {"items": [{"product_id": 1, "quantity": 2}, ...]} instead.
+    """
+    if "user_id" not in session or session.get("role") != "user":
+        if request.is_json:
+            return jsonify(error="login required"), 401
+        return redirect(url_for('login'))
+
+    db = get_db()
+    try:
+        if request.is_json:
+            payload = request.get_json(silent=True) or {}
+            try:
+                lines = [(int(item['product_id']), int(item.get('quantity', 1)))
+                         for item in payload.get('items', [])]
+            except (KeyError, TypeError, ValueError):
+                return jsonify(error="invalid items"), 400
+            if not lines or any(qty < 1 for _, qty in lines):
+                return jsonify(error="invalid items"), 400
+            short = place_bulk_order(db, session['user_id'], lines)
+            if short:
+                return jsonify(error="insufficient stock", product_ids=short), 409
+            return jsonify(ok=True, lines=len(lines))
+
+        # Lines whose product is gone can never be bought; drop them rather
+        # than fail the whole order on them
+        gone = db.execute("""DELETE FROM cart_items WHERE user_id=?
+                             AND product_id NOT IN (SELECT id FROM products)""", (session['user_id'],)).rowcount
+        db.commit()
+        if gone:
+            flash(f"{gone} item(s) in your cart are no longer available and were removed.", "warning")
+        lines = [(row['product_id'], row['quantity']) for row in
+                 db.execute("SELECT product_id, quantity FROM cart_items WHERE user_id=?",
+                            (session['user_id'],))]
+        if not lines:
+            flash("Your cart is empty!", "info")
+            return redirect(url_for('cart'))
+        short = place_bulk_order(db, session['user_id'], lines, clear_cart=True)
+        if short:
+            flash("Some items do not have enough stock. Nothing was ordered.", "danger")
+            return redirect(url_for('cart'))
+        flash("Order placed successfully!", "success")
+        return redirect(url_for('orders'))
+    except Exception as e:
+        print(f"Error in checkout: {e}")
+        if request.is_json:
+            return jsonify(error="checkout failed"), 500
+        flash("Checkout error occurred", "danger")
+        return redirect(url_for('cart'))
+
 # ----------- DELETE ORDER -----------
 @app.route('/delete_order/<int:order_id>')
 def delete_order(order_id):
@@ -323,7 +3735,9 @@ def delete_order(order_id):
             return redirect(url_for('login'))
 
         db = get_db()
-        db.execute("DELETE FROM orders WHERE id=? AND user_id=?", (order_id, session['user_id']))
+        if not db.execute("DELETE FROM orders WHERE id=? AND user_id=?",
+                          (order_id, session['user_id'])).rowcount:
+            db.execute("DELETE FROM orders_archive WHERE id=? AND user_id=?", (order_id, session['user_id']))
         db.commit()
         flash("Order deleted successfully","info")
         return redirect(url_for('orders'))
@@ -341,30 +3755,34 @@ def seller_dashboard():
         if "user_id" not in session or session.get("role") != "seller":
             return redirect(url_for('login'))
 
-        db = get_db()
-        cursor = db.cursor()
-        
-        # Get seller's products
-        cursor.execute("SELECT * FROM products WHERE seller_id=?", (session['user_id'],))
-        products = cursor.fetchall()
-        
-        # Get seller's orders
-        cursor.execute("""SELECT o.id, u.username, p.name, p.price, o.quantity, o.order_date
-                          FROM orders o
-                          JOIN users u ON o.user_id = u.id
-                          JOIN products p ON o.product_id = p.id
-                          WHERE p.seller_id=?""", (session['user_id'],))
-        orders = cursor.fetchall()
-        
-        return render_template("seller/dashboard.html", 
-                             products=products, 
-                             orders=orders, 
+        db = get_read_db()
+        seller_id = session['user_id']
+        filters = get_seller_filters(request.args)
+        history = request.args.get("history") == "1"
+
+        stats = get_seller_summary(db, seller_id)
+        if any(filters.values()):
+            stats.update(get_seller_range_sales(db, seller_id, filters))
+        orders, next_cursor, prev_cursor = get_seller_orders_page(
+            db, seller_id, filters, after=request.args.get("after"),
+            before=request.args.get("before"), history=history)
+
+        return render_template("seller/dashboard.html",
+                             products=get_seller_top_products(db, seller_id, filters),
+                             orders=orders,
+                             stats=stats,
+                             filters=filters,
+                             filter_args={k: v for k, v in filters.items() if v},
+                             history=history,
+                             next_cursor=next_cursor,
+                             prev_cursor=prev_cursor,
                              username=session.get("username"),
                              shop_name=session.get("shop_name"))
     except Exception as e:
         print(f"Error in seller dashboard: {e}")
         flash("Error loading dashboard", "danger")
-        return render_template("seller/dashboard.html", products=[], orders=[], 
+        return render_template("seller/dashboard.html", products=[], orders=[], stats=None,
+                             filters=get_seller_filters(request.args), filter_args={}, history=False,
                              username=session.get("username"), shop_name=session.get("shop_name"))
 
 # ----------- SELLER ADD PRODUCT -----------
@@ -383,17 +3801,24 @@ def seller_add_product():
 
             if name and price and stock:
                 try:
-                    price_val = float(price)
-                    stock_val = int(stock)
+                    price_val, stock_val = parse_product_numbers(price, stock)
                     
                     db = get_db()
-                    db.execute("INSERT INTO products (name, price, image, seller_id, stock, description) VALUES (?,?,?,?,?,?)", 
-                              (name, price_val, image, session['user_id'], stock_val, description))
+                    upload = read_image_upload(db)
+                    image, image_key, variants = upload[:3] if upload else (image, None, None)
+                    db.execute("""INSERT INTO products (name, price, image, seller_id, stock, description, image_key, image_variants)
+                                  VALUES (?,?,?,?,?,?,?,?)""",
+                              (name, price_val, image, session['user_id'], stock_val, description, image_key, variants))
                     db.commit()
+                    if upload:
+                        store_image_upload(upload)
+                    catalog_cache.invalidate()
                     flash("Product added successfully!","success")
                     return redirect(url_for('seller_dashboard'))
                 except ValueError:
                     flash("Please enter valid price and stock numbers!","danger")
+                except ImageRejected as e:
+                    flash(str(e), "danger")
             else:
                 flash("Name, price, and stock are required!","danger")
         
@@ -405,6 +3830,46 @@ def seller_add_product():
         flash("Error adding product", "danger")
         return redirect(url_for('seller_dashboard'))
 
+# ----------- SELLER BULK IMPORT -----------
+@app.route('/seller/import_products', methods=['GET','POST'])
+def seller_import_products():
+    """Upsert many products from a CSV or JSON Lines upload.
+
+    Columns: sku, name, price, stock, description, image. Add
+    ?format=json to get the summary back as JSON.
+    """
+    wants_json = request.args.get("format") == "json"
+    if "user_id" not in session or session.get("role") != "seller":
+        if wants_json:
+            return jsonify(error="login required"), 401
+        return redirect(url_for('login'))
+
+    summary = None
+    try:
+        if request.method == 'POST':
+            upload = request.files.get('file')
+            if not upload or not upload.filename:
+                if wants_json:
+                    return jsonify(error="file is required"), 400
+                flash("Please choose a CSV or JSON Lines file!", "danger")
+            else:
+                fmt = "jsonl" if upload.filename.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+                summary = import_products(get_db(), session['user_id'], read_import_rows(upload.stream, fmt))
+                if wants_json:
+                    return jsonify(summary)
+                flash(f"Imported {summary['imported']} products, {summary['failed']} rows failed.",
+                      "success" if not summary['failed'] else "warning")
+
+        return render_template("seller/import_products.html", summary=summary,
+                               username=session.get("username"),
+                               shop_name=session.get("shop_name"))
+    except Exception as e:
+        print(f"Error importing products: {e}")
+        if wants_json:
+            return jsonify(error="import failed"), 500
+        flash("Error importing products", "danger")
+        return redirect(url_for('seller_dashboard'))
+
 # ----------- SELLER MANAGE PRODUCTS -----------
 @app.route('/seller/manage_products')
 def seller_manage_products():
@@ -412,7 +3877,7 @@ def seller_manage_products():
         if "user_id" not in session or session.get("role") != "seller":
             return redirect(url_for('login'))
 
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
         cursor.execute("SELECT * FROM products WHERE seller_id=?", (session['user_id'],))
         products = cursor.fetchall()
@@ -456,15 +3921,30 @@ def seller_update_product(product_id):
                 try:
                     price_val = float(price)
                     stock_val = int(stock)
-                    
-                    cursor.execute("""UPDATE products SET name=?, price=?, stock=?, description=?, image=? 
+
+                    # A new upload replaces the image; an edited URL drops the uploaded one
+                    upload = read_image_upload(db)
+                    if upload:
+                        image, image_key, variants = upload[:3]
+                    elif image == product["image"]:
+                        image_key, variants = product["image_key"], product["image_variants"]
+                    else:
+                        image_key = variants = None
+                    cursor.execute("""UPDATE products SET name=?, price=?, stock=?, description=?, image=?,
+                                     image_key=?, image_variants=?
                                      WHERE id=? AND seller_id=?""", 
-                                  (name, price_val, stock_val, description, image, product_id, session['user_id']))
+                                  (name, price_val, stock_val, description, image, image_key, variants,
+                                   product_id, session['user_id']))
                     db.commit()
+                    if upload:
+                        store_image_upload(upload)
+                    catalog_cache.invalidate()
                     flash("Product updated successfully!","success")
                     return redirect(url_for('seller_manage_products'))
                 except ValueError:
                     flash("Please enter valid price and stock numbers!","danger")
+                except ImageRejected as e:
+                    flash(str(e), "danger")
             else:
                 flash("Name, price, and stock are required!","danger")
         
@@ -491,8 +3971,8 @@ def seller_delete_product(product_id):
         cursor.execute("SELECT id FROM products WHERE id=? AND seller_id=?", (product_id, session['user_id']))
         if cursor.fetchone():
             cursor.execute("DELETE FROM products WHERE id=? AND seller_id=?", (product_id, session['user_id']))
-            cursor.execute("DELETE FROM orders WHERE product_id=?", (product_id,))
             db.commit()
+            catalog_cache.invalidate()
             flash("Product deleted successfully!","info")
         else:
             flash("Product not found or access denied!","danger")
@@ -512,21 +3992,37 @@ def admin_dashboard():
         if "user_id" not in session or session.get("role") != "admin":
             return redirect(url_for('login'))
 
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
-        cursor.execute("""SELECT p.*, u.username as seller_name, u.shop_name FROM products p 
-                          LEFT JOIN users u ON p.seller_id = u.id""")
-        products = cursor.fetchall()
-        cursor.execute("""SELECT orders.id, users.username, products.name, products.price, orders.quantity
+        products, next_cursor, prev_cursor = get_id_page(
+            db, """SELECT p.*, u.username as seller_name, u.shop_name FROM products p
+                   LEFT JOIN users u ON p.seller_id = u.id""", "p.id",
+            after=request.args.get("after", type=int), before=request.args.get("before", type=int))
+        product_count = db.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        cursor.execute("""SELECT orders.id, users.username, orders.product_name AS name,
+                                 orders.unit_price AS price, orders.quantity
                           FROM orders
                           JOIN users ON orders.user_id = users.id
-                          JOIN products ON orders.product_id = products.id""")
+                          ORDER BY orders.id DESC LIMIT 10""")
         orders = cursor.fetchall()
-        return render_template("admin/dashboard.html", products=products, orders=orders, username=session.get("username"))
+        seller_stats = db.execute("""SELECT s.seller_id, s.order_count, s.units_sold, s.revenue,
+                                            u.username AS seller_name, u.shop_name
+                                     FROM seller_sales s
+                                     LEFT JOIN users u ON s.seller_id = u.id
+                                     WHERE s.order_count > 0
+                                     ORDER BY s.revenue DESC""").fetchall()
+        daily_orders = db.execute("""SELECT day, order_count, units FROM daily_orders
+                                     WHERE order_count > 0
+                                     ORDER BY day DESC LIMIT 14""").fetchall()
+        return render_template("admin/dashboard.html", products=products, product_count=product_count,
+                               next_cursor=next_cursor, prev_cursor=prev_cursor, orders=orders,
+                               stats=get_admin_summary(db), seller_stats=seller_stats,
+                               daily_orders=daily_orders, username=session.get("username"))
     except Exception as e:
         print(f"Error in admin dashboard: {e}")
         flash("Error loading admin dashboard", "danger")
-        return render_template("admin/dashboard.html", products=[], orders=[], username=session.get("username"))
+        return render_template("admin/dashboard.html", products=[], product_count=0, orders=[], stats=None,
+                               seller_stats=[], daily_orders=[], username=session.get("username"))
 
 # ----------- ADMIN ADD PRODUCT -----------
 @app.route('/admin/add_product', methods=['GET','POST'])
@@ -548,13 +4044,21 @@ def add_product():
                     stock_val = int(stock)
                     
                     db = get_db()
-                    db.execute("INSERT INTO products (name, price, image, stock, description) VALUES (?,?,?,?,?)", 
-                              (name, price_val, image, stock_val, description))
+                    upload = read_image_upload(db)
+                    image, image_key, variants = upload[:3] if upload else (image, None, None)
+                    db.execute("""INSERT INTO products (name, price, image, stock, description, image_key, image_variants)
+                                  VALUES (?,?,?,?,?,?,?)""",
+                              (name, price_val, image, stock_val, description, image_key, variants))
                     db.commit()
+                    if upload:
+                        store_image_upload(upload)
+                    catalog_cache.invalidate()
                     flash("Product added successfully!","success")
                     return redirect(url_for('admin_dashboard'))
                 except ValueError:
                     flash("Please enter valid price and stock numbers!","danger")
+                except ImageRejected as e:
+                    flash(str(e), "danger")
             else:
                 flash("Name and price are required!","danger")
         
@@ -573,8 +4077,8 @@ def delete_product(product_id):
 
         db = get_db()
         db.execute("DELETE FROM products WHERE id=?",(product_id,))
-        db.execute("DELETE FROM orders WHERE product_id=?",(product_id,))
         db.commit()
+        catalog_cache.invalidate()
         flash("Product deleted successfully!","info")
         return redirect(url_for('admin_dashboard'))
     except Exception as e:
@@ -589,7 +4093,7 @@ def admin_users():
         if "user_id" not in session or session.get("role") != "admin":
             return redirect(url_for('login'))
 
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
         cursor.execute("SELECT id, username, email, role, shop_name FROM users")
         users = cursor.fetchall()
@@ -606,18 +4110,137 @@ def all_orders():
         if "user_id" not in session or session.get("role") != "admin":
             return redirect(url_for('login'))
 
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("""SELECT orders.id, users.username, products.name, products.price, orders.quantity, orders.order_date
-                          FROM orders
-                          JOIN users ON orders.user_id = users.id
-                          JOIN products ON orders.product_id = products.id""")
-        orders = cursor.fetchall()
-        return render_template("admin/all_orders.html", orders=orders, username=session.get("username"))
+        history = request.args.get("history") == "1"
+        db = get_read_db()
+        orders, next_cursor, prev_cursor = get_id_page(
+            db, f"""SELECT orders.id, users.username, orders.product_name AS name,
+                           orders.unit_price AS price, orders.quantity, orders.order_date
+                    FROM {order_source(history)} orders
+                    JOIN users ON orders.user_id = users.id""", "orders.id",
+            after=request.args.get("after", type=int), before=request.args.get("before", type=int))
+        return render_template("admin/all_orders.html", orders=orders, history=history,
+                               next_cursor=next_cursor, prev_cursor=prev_cursor,
+                               stats=get_admin_summary(db), username=session.get("username"))
     except Exception as e:
         print(f"Error loading all orders: {e}")
         flash("Error loading orders", "danger")
-        return render_template("admin/all_orders.html", orders=[], username=session.get("username"))
+        return render_template("admin/all_orders.html", orders=[], history=False,
+                               username=session.get("username"))
+
+# ----------- ADMIN EXPORTS -----------
+@app.route('/admin/export/orders')
+def export_orders():
+    """Stream orders as CSV or NDJSON, optionally filtered by date range and seller."""
+    if "user_id" not in session or session.get("role") != "admin":
+        return redirect(url_for('login'))
+
+    filters, params = [], []
+    if request.args.get("from"):
+        filters.append("o.order_date >= ?")
+        params.append(request.args["from"])
+    if request.args.get("to"):
+        # Inclusive of the whole "to" day
+        filters.append("o.order_date < date(?, '+1 day')")
+        params.append(request.args["to"])
+    if request.args.get("seller_id"):
+        try:
+            params.append(int(request.args["seller_id"]))
+        except ValueError:
+            return jsonify(error="invalid seller_id"), 400
+        filters.append("o.seller_id = ?")
+
+    where = ("WHERE " + " AND ".join(filters)) if filters else ""
+    columns = ["order_id", "order_date", "user_id", "username", "product_id",
+               "product_name", "seller_id", "unit_price", "quantity", "total"]
+
+    def part(table):
+        return f"""SELECT * FROM (
+                       SELECT o.id, o.order_date, o.user_id, u.username, o.product_id,
+                              o.product_name, o.seller_id, o.unit_price, o.quantity, o.quantity * o.unit_price
+                       FROM {table} o
+                       LEFT JOIN users u ON o.user_id = u.id
+                       {where}
+                       ORDER BY o.order_date, o.id)"""
+
+    # Archived orders all predate hot ones, so streaming the archive and
+    # then the hot table keeps date order without sorting the union
+    sql = f"{part('orders_archive')} UNION ALL {part('orders')}"
+    return export_response("orders", sql, params * 2, columns)
+
+@app.route('/admin/export/users')
+def export_users():
+    if "user_id" not in session or session.get("role") != "admin":
+        return redirect(url_for('login'))
+
+    columns = ["id", "username", "email", "role", "shop_name", "created_at"]
+    sql = "SELECT id, username, email, role, shop_name, created_at FROM users ORDER BY id"
+    return export_response("users", sql, (), columns)
+
+# ----------- ADMIN CACHE STATS -----------
+@app.route('/admin/cache_stats')
+def admin_cache_stats():
+    if "user_id" not in session or session.get("role") != "admin":
+        return redirect(url_for('login'))
+    return jsonify(catalog=catalog_cache.stats(), fragments=fragment_cache.stats(),
+                   compression=compression_stats.stats())
+
+# ----------- STATIC ASSETS -----------
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    if filename not in built_assets:
+        return "Not found", 404
+    name, encoding = filename, None
+    for candidate, suffix in ASSET_ENCODINGS:
+        if request.accept_encodings[candidate]:
+            name, encoding = filename + suffix, candidate
+            break
+    response = send_from_directory(ASSET_BUILD_DIR, name, max_age=ASSET_MAX_AGE,
+                                   mimetype=mimetypes.guess_type(filename)[0])
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/media/<path:filename>')
+def media(filename):
+    # Content-addressed, so any name that exists never changes
+    response = send_from_directory(app.config["IMAGE_STORE_DIR"], filename, max_age=ASSET_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+# ----------- METRICS -----------
+@app.route('/metrics')
+def metrics():
+    token = app.config["METRICS_TOKEN"]
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    return Response(request_metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route('/admin/slow_queries')
+def admin_slow_queries():
+    if "user_id" not in session or session.get("role") != "admin":
+        return redirect(url_for('login'))
+    return jsonify(threshold_ms=app.config["SLOW_QUERY_MS"], total=slow_query_log.total,
+                   queries=slow_query_log.entries())
+
+@app.route('/admin/outbox')
+def admin_outbox():
+    if "user_id" not in session or session.get("role") != "admin":
+        return redirect(url_for('login'))
+    db = get_read_db()
+    counts = dict(db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+    oldest = db.execute("""SELECT MIN(available_at) FROM outbox
+                           WHERE status = 'pending' AND attempts = 0""").fetchone()[0]
+    failures = [dict(row) for row in db.execute(
+        """SELECT id, topic, idempotency_key, attempts, last_error FROM outbox
+           WHERE last_error IS NOT NULL ORDER BY id DESC LIMIT 20""")]
+    return jsonify(counts=counts, handlers={topic: [h.__name__ for h in funcs]
+                                            for topic, funcs in OUTBOX_HANDLERS.items()},
+                   oldest_pending_age_s=round(time.time() - oldest, 1) if oldest else 0,
+                   recent_errors=failures)
 
 # ----------- ERROR HANDLERS -----------
 @app.errorhandler(404)
@@ -628,6 +4251,147 @@ def not_found_error(error):
 def internal_error(error):
     return render_template('auth/login.html', error="Internal server error"), 500
 
+# ---------------- APP FACTORY ------------------
+# Importing this module only defines the app; it opens no database and
+# starts no threads. create_app() does the startup work worth sharing:
+# under a pre-fork server (gunicorn --preload wsgi:app) it runs once in the
+# master, and every worker forks with compiled templates, a warm first
+# catalog page and the hot pages in the OS cache. Connections and threads
+# never cross a fork: workers open their own on first use.
+WARM_QUERIES = [
+    "SELECT COUNT(*) FROM products INDEXED BY idx_products_catalog WHERE stock > 0",
+    "SELECT COUNT(*) FROM users INDEXED BY sqlite_autoindex_users_1",
+    "SELECT COUNT(*) FROM orders INDEXED BY idx_orders_user",
+    "SELECT COUNT(*) FROM product_sales",
+    "SELECT COUNT(*) FROM seller_sales",
+    "SELECT COUNT(*) FROM catalog_facets",
+]
+
+def precompile_templates():
+    """Compile every page template into the Jinja cache; return (compiled, failed) names."""
+    compiled, failed = [], []
+    for name in app.jinja_env.list_templates(extensions=["html"]):
+        try:
+            app.jinja_env.get_template(name)
+            compiled.append(name)
+        except TemplateError as e:
+            failed.append(name)
+            print(f"⚠️ Template {name} does not compile: {e}")
+    return compiled, failed
+
+def warm_caches(db):
+    """Read the hot indexes once and fill the catalog and fragment caches for /home."""
+    for sql in WARM_QUERIES:
+        db.execute(sql).fetchone()
+    # Cards link with url_for, so they render inside a request; paths come
+    # from APPLICATION_ROOT just as they would for a real one
+    with app.test_request_context("/home"):
+        products, _, _ = catalog_cache.get(("home", None, None, app.config["CATALOG_PAGE_SIZE"], CatalogFilters()),
+                                           lambda: get_catalog_page(db), in_stock=True)
+        catalog_cache.get(("facets", None), lambda: get_catalog_facets(db), in_stock=True)
+        render_product_grid(products)
+
+def create_app(config=None):
+    """Apply config and do the shared startup work; returns the app.
+
+    config overrides the environment's settings, and DATABASE in it picks
+    the database file. There is one app per process: each call starts
+    again from the environment's settings, closes the pooled connections
+    and replaces the caches, metrics and queues, so nothing carries over
+    from an earlier call. The schema must already be current: run `flask migrate` once
+    per deploy rather than from every worker.
+    """
+    global DATABASE, catalog_cache, fragment_cache, password_hasher, asset_manifest, built_assets
+    global slow_query_log, request_metrics, compression_stats, hot_products, flash_sale_queue, outbox_sink
+    started = time.perf_counter()
+    config = dict(config or {})
+    close_pools()
+    DATABASE = config.pop("DATABASE", DATABASE)
+    app.config.update(_default_config)
+    app.config.update(config)
+    catalog_cache = make_catalog_cache()
+    fragment_cache = FragmentCache(app.config["FRAGMENT_CACHE_SIZE"])
+    password_hasher = make_password_hasher()
+    slow_query_log = SlowQueryLog(app.config["SLOW_QUERY_LOG_SIZE"])
+    request_metrics = RequestMetrics()
+    compression_stats = CompressionStats()
+    hot_products = HotProducts()
+    flash_sale_queue = FlashSaleQueue()
+    outbox_sink = LocalSink(app.config["OUTBOX_SINK_PATH"])
+    try:
+        asset_manifest = build_assets()
+    except OSError as e:
+        # Keep whatever an earlier build left
+        print(f"Error building static assets: {e}")
+    built_assets = set(asset_manifest.values())
+
+    db = connect_db(readonly=True)
+    try:
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        latest = MIGRATIONS[-1][0]
+        if version < latest:
+            raise RuntimeError(f"database schema is at version {version}, expected {latest}: "
+                               f"run `flask migrate` first")
+        if not app.config["OUTBOX_WORKER"] or app.config["OUTBOX_POLL_INTERVAL"] <= 0:
+            warn_undrained_outbox(db)
+        if app.config["STARTUP_WARM"]:
+            phase = time.perf_counter()
+            precompile_templates()
+            STARTUP_TIMINGS["templates"] = time.perf_counter() - phase
+            phase = time.perf_counter()
+            warm_caches(db)
+            STARTUP_TIMINGS["warm_db"] = time.perf_counter() - phase
+    finally:
+        db.close()
+    close_pools()
+    STARTUP_TIMINGS["create_app"] = time.perf_counter() - started
+    return app
+
+def _reset_after_fork():
+    # The parent's connections and pool threads are unusable in a child;
+    # drop them without closing (closing would touch the parent's locks).
+    # Any lock or event another thread held at fork() stays held in the
+    # child, so each one is replaced rather than released
+    global _process_started, password_hasher, _image_pool, flash_sale_queue
+    global _pools_lock, _image_pool_lock, _flash_sale_writer_lock, outbox_wakeup
+    global _archiver_started, _outbox_worker_started, _flash_sale_writer_started
+    _process_started = time.perf_counter()
+    _pools.clear()
+    _pools_lock = threading.Lock()
+    password_hasher = make_password_hasher()
+    _image_pool = None
+    _image_pool_lock = threading.Lock()
+    _archiver_started = threading.Event()
+    _outbox_worker_started = threading.Event()
+    _flash_sale_writer_started = threading.Event()
+    _flash_sale_writer_lock = threading.Lock()
+    outbox_wakeup = threading.Event()
+    flash_sale_queue = FlashSaleQueue()
+    for state in (catalog_cache, fragment_cache, slow_query_log, request_metrics,
+                  compression_stats, hot_products, outbox_sink):
+        state.after_fork()
+    STARTUP_TIMINGS.pop("worker_ready", None)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+@app.cli.command("migrate")
+@click.option("--seed", is_flag=True, help="Also add a small synthetic dataset if there is none yet.")
+def migrate_command(seed):
+    """Apply pending schema migrations; run once per deploy, before the workers start."""
+    db = get_db()
+    print(f"✅ Database ready (schema version {run_migrations(db)})")
+    if not seed:
+        return
+    if db.execute("SELECT 1 FROM users WHERE email LIKE '%@seed.example' LIMIT 1").fetchone():
+        print("🌱 Synthetic data already present")
+        return
+    counts = seed_synthetic_data(db, users=500, sellers=50, products=5000, orders=50000)
+    rebuild_recommendations(db)
+    print(f"🌱 Seeded {counts}")
+
+STARTUP_TIMINGS["import"] = time.perf_counter() - _process_started
+
 # ---------------- RUN APP ------------------
 if __name__ == '__main__':
     try:
@@ -644,6 +4408,9 @@ if __name__ == '__main__':
         
         # Initialize database
         init_db()
+        create_app()
+        start_order_archiver()
+        start_outbox_worker()
         
         print("\n🌐 Server starting...")
         print("🔗 Open: http://127.0.0.1:5000")
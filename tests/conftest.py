@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "routes", "customers"))
+import customers  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A freshly migrated database; the app's pools, caches and sinks point at tmp_path."""
+    monkeypatch.setattr(customers, "DATABASE", str(tmp_path / "test.db"))
+    monkeypatch.setitem(customers.app.config, "IMAGE_STORE_DIR", str(tmp_path / "media"))
+    monkeypatch.setitem(customers.app.config, "OUTBOX_SINK_PATH", str(tmp_path / "outbox.jsonl"))
+    monkeypatch.setattr(customers.outbox_sink, "path", str(tmp_path / "outbox.jsonl"))
+    # Tests drain the outbox themselves
+    monkeypatch.setitem(customers.app.config, "OUTBOX_WORKER", False)
+    customers.init_db()
+    customers.catalog_cache.invalidate()
+    db = customers.connect_db()
+    yield db
+    db.close()
+    customers.close_pools()
+
+
+@pytest.fixture
+def login(db):
+    """login(role) -> (test client signed in as a user with that role, user id)."""
+    def login(role):
+        row = db.execute("SELECT id FROM users WHERE role = ? LIMIT 1", (role,)).fetchone()
+        if row is None:
+            user_id = db.execute("INSERT INTO users (username, email, password, role) VALUES (?, ?, 'x', ?)",
+                                 (role, f"{role}@test", role)).lastrowid
+            db.commit()
+        else:
+            user_id = row[0]
+        client = customers.app.test_client()
+        with client.session_transaction() as sess:
+            sess.update(user_id=user_id, role=role, username=role)
+        return client, user_id
+    return login
@@ -0,0 +1,37 @@
+import customers
+
+
+def test_products_etag_revalidates_until_a_product_changes(db, login):
+    client, _ = login("user")
+    first = client.get("/api/v1/products?limit=5")
+    assert first.status_code == 200 and first.headers["ETag"]
+    assert "no-cache" in first.headers["Cache-Control"]
+
+    again = client.get("/api/v1/products?limit=5", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304 and not again.get_data()
+
+    # Another query string is another body, so another ETag
+    other = client.get("/api/v1/products?limit=6", headers={"If-None-Match": first.headers["ETag"]})
+    assert other.status_code == 200 and other.headers["ETag"] != first.headers["ETag"]
+
+    product_id = first.get_json()["products"][0]["id"]
+    db.execute("UPDATE products SET price = price + 1 WHERE id = ?", (product_id,))
+    db.commit()
+    changed = client.get("/api/v1/products?limit=5", headers={"If-None-Match": first.headers["ETag"]})
+    assert changed.status_code == 200 and changed.headers["ETag"] != first.headers["ETag"]
+    price = next(p["price"] for p in changed.get_json()["products"] if p["id"] == product_id)
+    assert price == db.execute("SELECT price FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+
+
+def test_product_if_modified_since_and_404(db, login):
+    client, _ = login("user")
+    product_id = db.execute("SELECT id FROM products LIMIT 1").fetchone()[0]
+    first = client.get(f"/api/v1/products/{product_id}?fields=id,name")
+    assert first.get_json() == {"id": product_id, "name": first.get_json()["name"]}
+
+    since = client.get(f"/api/v1/products/{product_id}?fields=id,name",
+                       headers={"If-Modified-Since": first.headers["Last-Modified"]})
+    assert since.status_code == 304
+
+    assert client.get("/api/v1/products/999999").status_code == 404
+    assert client.get("/api/v1/products?fields=id,secret").status_code == 400
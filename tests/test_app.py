@@ -0,0 +1,57 @@
+import os
+import threading
+
+import pytest
+
+import customers
+
+
+def test_create_app_starts_from_the_environment_each_call(db):
+    customers.create_app({"DATABASE": customers.DATABASE, "STARTUP_WARM": False, "CATALOG_PAGE_SIZE": 7})
+    assert customers.app.config["CATALOG_PAGE_SIZE"] == 7
+    metrics, cache = customers.request_metrics, customers.catalog_cache
+    metrics.observe_lock_wait(0.5)
+
+    customers.create_app({"DATABASE": customers.DATABASE, "STARTUP_WARM": False})
+    assert customers.app.config["CATALOG_PAGE_SIZE"] == customers._default_config["CATALOG_PAGE_SIZE"]
+    assert customers.request_metrics is not metrics and customers.catalog_cache is not cache
+    assert "sql_lock_waits_total 0\n" in customers.request_metrics.render()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork()")
+def test_worker_does_not_inherit_locks_held_at_fork(db):
+    held = [customers._pools_lock, customers._flash_sale_writer_lock, customers._image_pool_lock]
+    held += [state._lock for state in (customers.catalog_cache, customers.fragment_cache, customers.slow_query_log,
+                                       customers.request_metrics, customers.compression_stats,
+                                       customers.hot_products, customers.outbox_sink)]
+    for lock in held:
+        lock.acquire()
+    try:
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            done = []
+
+            def use_everything():
+                with customers.app.app_context():
+                    customers.get_read_db()
+                customers.catalog_cache.stats()
+                customers.fragment_cache.stats()
+                customers.slow_query_log.entries()
+                customers.request_metrics.render()
+                customers.compression_stats.stats()
+                customers.hot_products.record(1)
+                customers.outbox_sink.send("test", "key", {})
+                done.append(True)
+            worker = threading.Thread(target=use_everything, daemon=True)
+            worker.start()
+            worker.join(5)
+            os.write(write, b"ok" if done else b"blocked")
+            os._exit(0)
+        os.close(write)
+        result = os.read(read, 16)
+        os.waitpid(pid, 0)
+    finally:
+        for lock in held:
+            lock.release()
+    assert result == b"ok"
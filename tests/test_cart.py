@@ -0,0 +1,39 @@
+import customers
+
+
+def test_deleted_product_leaves_cart_and_checkout_works(db, login):
+    shopper, user_id = login("user")
+    admin, _ = login("admin")
+    kept, deleted = [row[0] for row in db.execute("SELECT id FROM products WHERE stock > 0 LIMIT 2")]
+
+    shopper.post(f"/cart/add/{kept}", data={"quantity": 1})
+    shopper.post(f"/cart/add/{deleted}", data={"quantity": 1})
+    admin.get(f"/admin/delete_product/{deleted}")
+
+    assert [row[0] for row in db.execute("SELECT product_id FROM cart_items WHERE user_id = ?", (user_id,))] == [kept]
+    assert shopper.post("/checkout").headers["Location"].endswith("/orders")
+    assert [row[0] for row in db.execute("SELECT product_id FROM orders WHERE user_id = ?", (user_id,))] == [kept]
+    assert not db.execute("SELECT COUNT(*) FROM cart_items WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def test_adding_an_unknown_product_is_a_404(db, login):
+    shopper, user_id = login("user")
+    missing = db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM products").fetchone()[0]
+
+    assert shopper.post(f"/cart/add/{missing}", data={"quantity": 1}).status_code == 404
+    assert not db.execute("SELECT COUNT(*) FROM cart_items WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def test_checkout_drops_lines_whose_product_is_gone(db, login):
+    shopper, user_id = login("user")
+    kept = db.execute("SELECT id FROM products WHERE stock > 0 LIMIT 1").fetchone()[0]
+    missing = db.execute("SELECT MAX(id) + 1 FROM products").fetchone()[0]
+    shopper.post(f"/cart/add/{kept}", data={"quantity": 1})
+    # A line left behind by an older build, before adds checked the product
+    db.execute("INSERT INTO cart_items (user_id, product_id, quantity) VALUES (?, ?, 1)", (user_id, missing))
+    db.commit()
+
+    response = shopper.post("/checkout", follow_redirects=True)
+    assert "no longer available" in response.get_data(as_text=True)
+    assert [row[0] for row in db.execute("SELECT product_id FROM orders WHERE user_id = ?", (user_id,))] == [kept]
+    assert not db.execute("SELECT COUNT(*) FROM cart_items WHERE user_id = ?", (user_id,)).fetchone()[0]
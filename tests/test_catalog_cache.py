@@ -0,0 +1,42 @@
+import customers
+
+
+def fill(db, loads):
+    """Read the in-stock page, the page with sold-out products and the facets; record each load."""
+    def loader(name, load):
+        def run():
+            loads.append(name)
+            return load()
+        return run
+
+    F = customers.CatalogFilters
+    cache = customers.catalog_cache
+    cache.get(("page", F()), loader("in stock", lambda: customers.get_catalog_page(db)), in_stock=True)
+    cache.get(("page", F(in_stock=False)),
+              loader("all", lambda: customers.get_catalog_page(db, filters=F(in_stock=False))))
+    cache.get(("facets", None), loader("facets", lambda: customers.get_catalog_facets(db)), in_stock=True)
+
+
+def test_purchase_keeps_cache_until_a_product_sells_out(db):
+    user_id = db.execute("INSERT INTO users (username, email, password, role) VALUES ('u', 'u@test', 'x', 'user')").lastrowid
+    product_id = db.execute("INSERT INTO products (name, price, stock) VALUES ('last two', 10, 2)").lastrowid
+    db.commit()
+    loads = []
+    fill(db, loads)
+    assert loads == ["in stock", "all", "facets"]
+
+    loads.clear()
+    assert customers.place_order(db, user_id, product_id)
+    fill(db, loads)
+    assert loads == []
+
+    assert customers.place_bulk_order(db, user_id, [(product_id, 1)]) == []
+    fill(db, loads)
+    assert loads == ["in stock", "facets"]
+    products, _, _ = customers.catalog_cache.get(("page", customers.CatalogFilters()), list, in_stock=True)
+    assert product_id not in [row["id"] for row in products]
+
+    loads.clear()
+    assert not customers.place_order(db, user_id, product_id)
+    fill(db, loads)
+    assert loads == []
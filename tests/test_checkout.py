@@ -0,0 +1,54 @@
+import json
+import threading
+
+import customers
+
+
+def test_parallel_purchases_never_oversell(db):
+    """A scaled-down benchmarks/checkout_concurrency.py: 8 threads, 200 attempts, 50 in stock."""
+    threads, attempts, stock = 8, 200, 50
+    product_id = db.execute("INSERT INTO products (name, price, stock) VALUES ('hot', 10, ?)", (stock,)).lastrowid
+    db.commit()
+    sold, errors = [], []
+    start = threading.Barrier(threads)
+
+    def buyer(user_id):
+        conn = customers.connect_db()
+        start.wait()
+        for _ in range(attempts // threads):
+            try:
+                if customers.place_order(conn, user_id, product_id):
+                    sold.append(1)
+            except Exception as e:
+                errors.append(e)
+        conn.close()
+
+    workers = [threading.Thread(target=buyer, args=(i + 1,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    left = db.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+    orders, units = db.execute("SELECT COUNT(*), COALESCE(SUM(quantity), 0) FROM orders WHERE product_id = ?",
+                               (product_id,)).fetchone()
+    assert not errors, errors[:3]
+    assert left >= 0
+    assert orders == units == len(sold) == stock - left == stock
+
+
+def test_bulk_order_queues_one_event_per_order(db):
+    ids = [db.execute("INSERT INTO products (name, price, stock) VALUES (?, ?, 5)", (name, price)).lastrowid
+           for name, price in (("tea", 4.0), ("pot", 20.0), ("cup", 6.5))]
+    db.commit()
+    assert customers.place_order(db, 1, ids[0])
+    assert customers.place_bulk_order(db, 2, [(pid, 2) for pid in ids]) == []
+
+    orders = db.execute("SELECT id, user_id, product_id, quantity, unit_price FROM orders WHERE product_id IN (?,?,?)"
+                        " ORDER BY id", ids).fetchall()
+    events = [(row[0], json.loads(row[1])) for row in db.execute(
+        "SELECT idempotency_key, payload FROM outbox WHERE topic = 'order.placed' ORDER BY id")][-len(orders):]
+    assert [key for key, _ in events] == [f"order:{order['id']}" for order in orders]
+    assert [(p["user_id"], p["product_id"], p["quantity"], p["price"]) for _, p in events] == \
+        [(order["user_id"], order["product_id"], order["quantity"], order["unit_price"]) for order in orders]
+    assert [p["stock_left"] for _, p in events][1:] == [2, 3, 3]
@@ -0,0 +1,17 @@
+import customers
+
+
+def test_open_downloads_leave_the_read_pool_alone(db, login, monkeypatch):
+    monkeypatch.setitem(customers.app.config, "DB_POOL_SIZE", 1)
+    monkeypatch.setitem(customers.app.config, "DB_BUSY_TIMEOUT_MS", 200)
+    admin, _ = login("admin")
+    downloads = [admin.get("/admin/export/users", buffered=False) for _ in range(3)]
+    chunks = [response.response for response in downloads]
+    for chunk in chunks:
+        assert next(chunk).startswith(b"id,username")
+        assert next(chunk).startswith(b"1,admin,")
+
+    pool = customers.get_pool(readonly=True)
+    pool.release(pool.acquire())
+    for response in downloads:
+        response.close()
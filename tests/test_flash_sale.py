@@ -0,0 +1,44 @@
+import threading
+
+import customers
+
+
+def hot_product(db, stock):
+    product_id = db.execute("INSERT INTO products (name, price, stock) VALUES ('hot', 10, ?)", (stock,)).lastrowid
+    db.commit()
+    return product_id
+
+
+def test_batch_allocates_stock_in_arrival_order(db, login):
+    _, user_id = login("user")
+    product_id = hot_product(db, 3)
+    batch = [customers.PendingPurchase(user_id, product_id, quantity) for quantity in (1, 2, 1, 1)]
+
+    assert customers.commit_flash_sale_batch(db, batch) == [True, True, False, False]
+    assert db.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()[0] == 0
+    orders = db.execute("SELECT quantity FROM orders WHERE product_id = ? ORDER BY id", (product_id,)).fetchall()
+    assert [row[0] for row in orders] == [1, 2]
+    assert db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0] == 2
+
+
+def test_writer_answers_every_waiting_purchase(db, login, monkeypatch):
+    _, user_id = login("user")
+    product_id = hot_product(db, 4)
+    monkeypatch.setattr(customers, "flash_sale_queue", customers.FlashSaleQueue())
+    purchases = [customers.PendingPurchase(user_id, product_id, 1) for _ in range(10)]
+    for purchase in purchases:
+        customers.flash_sale_queue.submit(purchase)
+
+    stop = threading.Event()
+    writer = threading.Thread(target=customers.run_flash_sale_writer, args=(customers.connect_db(), stop))
+    writer.start()
+    try:
+        assert all(purchase.done.wait(10) for purchase in purchases)
+    finally:
+        stop.set()
+        writer.join()
+
+    assert [purchase.result for purchase in purchases] == [True] * 4 + [False] * 6
+    assert db.execute("SELECT COUNT(*) FROM orders WHERE product_id = ?", (product_id,)).fetchone()[0] == 4
+    stats = customers.flash_sale_queue.stats()
+    assert stats["purchases"] == 10 and stats["sold_out"] == 6 and stats["fallbacks"] == 0
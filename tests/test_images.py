@@ -0,0 +1,37 @@
+import io
+import os
+
+import customers
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 64
+
+
+def stored_files(db):
+    store = customers.app.config["IMAGE_STORE_DIR"]
+    return [name for _, _, names in os.walk(store) for name in names]
+
+
+def add_product(client):
+    return client.post("/admin/add_product", data={"name": "lamp", "price": "10", "stock": "1",
+                                                   "image_file": (io.BytesIO(PNG), "lamp.png")})
+
+
+def test_failed_insert_leaves_no_image_file(db, login, monkeypatch):
+    queued = []
+    monkeypatch.setattr(customers, "queue_image_variants", lambda *args: queued.append(args))
+    admin, _ = login("admin")
+
+    db.execute("CREATE TRIGGER reject_products BEFORE INSERT ON products BEGIN SELECT RAISE(ABORT, 'rejected'); END")
+    db.commit()
+    add_product(admin)
+    assert stored_files(db) == []
+    assert not db.execute("SELECT COUNT(*) FROM product_images").fetchone()[0]
+    assert queued == []
+
+    db.execute("DROP TRIGGER reject_products")
+    db.commit()
+    add_product(admin)
+    image_key, ext = db.execute("SELECT hash, ext FROM product_images").fetchone()
+    assert stored_files(db) == [f"{image_key}.{ext}"]
+    assert db.execute("SELECT COUNT(*) FROM products WHERE image_key = ?", (image_key,)).fetchone()[0] == 1
+    assert [args[0] for args in queued] == [image_key]
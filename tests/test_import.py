@@ -0,0 +1,61 @@
+import io
+
+import customers
+
+
+def upload(client, name, text):
+    return client.post("/seller/import_products?format=json",
+                       data={"file": (io.BytesIO(text.encode()), name)}).get_json()
+
+
+def test_csv_import_reports_bad_rows_and_keeps_good_ones(db, login):
+    seller, seller_id = login("seller")
+    summary = upload(seller, "products.csv", "sku,name,price,stock\n"
+                                             "a1,Lamp,10,5\n"
+                                             ",No sku,1,1\n"
+                                             "a2,,1,1\n"
+                                             "a3,Chair,cheap,1\n"
+                                             "a4,Desk,99.5,2\n")
+    assert summary["imported"] == 2 and summary["failed"] == 3
+    assert summary["errors"] == [{"line": 3, "error": "sku is required"},
+                                 {"line": 4, "error": "name, price, and stock are required"},
+                                 {"line": 5, "error": "invalid price or stock number"}]
+    rows = db.execute("SELECT sku, name, price, stock FROM products WHERE seller_id = ? ORDER BY sku",
+                      (seller_id,)).fetchall()
+    assert [tuple(row) for row in rows] == [("a1", "Lamp", 10, 5), ("a4", "Desk", 99.5, 2)]
+
+
+def test_jsonl_import_upserts_by_sku_and_keeps_search_in_sync(db, login):
+    seller, seller_id = login("seller")
+    assert upload(seller, "p.jsonl", '{"sku": "a1", "name": "Walnut lamp", "price": 10, "stock": 5}\n')["imported"] == 1
+    summary = upload(seller, "p.jsonl", '{"sku": "a1", "name": "Oak lamp", "price": 12, "stock": 4}\n'
+                                        'not json\n'
+                                        '[1, 2]\n'
+                                        '\n'
+                                        '{"sku": "a2", "name": "Rug", "price": 30}\n')
+    assert summary["imported"] == 1
+    assert summary["errors"] == [{"line": 2, "error": "unreadable row"},
+                                 {"line": 3, "error": "unreadable row"},
+                                 {"line": 5, "error": "name, price, and stock are required"}]
+    assert db.execute("SELECT name, price, stock FROM products WHERE seller_id = ?",
+                      (seller_id,)).fetchall()[0][:] == ("Oak lamp", 12, 4)
+    assert db.execute("SELECT deferred FROM search_sync").fetchone()[0] == 0
+    found = [row[0] for row in db.execute("SELECT name FROM products_fts WHERE products_fts MATCH 'lamp'")]
+    assert found == ["Oak lamp"]
+
+
+def test_import_needs_a_file(db, login):
+    seller, _ = login("seller")
+    response = seller.post("/seller/import_products?format=json", data={})
+    assert response.status_code == 400
+
+
+def test_seeded_products_are_all_searchable(db):
+    before = db.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+    customers.seed_synthetic_data(db, users=5, sellers=2, products=30, orders=20, batch_size=8)
+    assert db.execute("SELECT deferred FROM search_sync").fetchone()[0] == 0
+    products = db.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+    indexed = db.execute("SELECT COUNT(*) FROM products_fts").fetchone()[0]
+    assert products == indexed == before + 30
+    mark = db.execute("SELECT applied_through FROM recommendation_state").fetchone()[0]
+    assert mark == db.execute("SELECT MAX(id) FROM orders").fetchone()[0]
@@ -0,0 +1,35 @@
+import logging
+import threading
+
+import customers
+
+
+def metric(name):
+    line = next(line for line in customers.request_metrics.render().splitlines() if line.startswith(name + " "))
+    return float(line.split()[1])
+
+
+def test_waiting_for_the_write_lock_is_lock_wait_not_a_slow_query(db, monkeypatch):
+    monkeypatch.setitem(customers.app.config, "SLOW_QUERY_MS", 20)
+    slow, waited = customers.slow_query_log.total, metric("sql_lock_wait_seconds_total")
+    db.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.1, db.rollback).start()
+
+    other = customers.connect_db()
+    customers.run_write_transaction(other, lambda other: other.execute("UPDATE products SET stock = stock"))
+    other.close()
+
+    assert customers.slow_query_log.total == slow
+    assert metric("sql_lock_wait_seconds_total") - waited >= 0.08
+
+
+def test_slow_queries_are_logged_at_most_once_an_interval(db, monkeypatch, caplog):
+    monkeypatch.setitem(customers.app.config, "SLOW_QUERY_MS", 0)
+    monkeypatch.setitem(customers.app.config, "SLOW_QUERY_LOG_INTERVAL", 3600)
+    monkeypatch.setattr(customers, "slow_query_log", customers.SlowQueryLog(10))
+
+    with caplog.at_level(logging.WARNING, logger=customers.app.logger.name):
+        for _ in range(5):
+            db.execute("SELECT COUNT(*) FROM products").fetchone()
+    assert customers.slow_query_log.total == 5
+    assert len([r for r in caplog.records if r.getMessage().startswith("Slow query")]) == 1
@@ -0,0 +1,37 @@
+import customers
+
+
+def test_fresh_database_reaches_latest_version(db):
+    latest = customers.MIGRATIONS[-1][0]
+    assert db.execute("PRAGMA user_version").fetchone()[0] == latest
+    products = db.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    assert customers.run_migrations(db) == latest
+    assert db.execute("SELECT COUNT(*) FROM products").fetchone()[0] == products
+
+
+def test_upgrade_keeps_existing_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(customers, "DATABASE", str(tmp_path / "old.db"))
+    db = customers.connect_db()
+    with monkeypatch.context() as m:
+        m.setattr(customers, "MIGRATIONS", customers.MIGRATIONS[:1])
+        assert customers.run_migrations(db) == 1
+    user_id = db.execute("INSERT INTO users (username, email, password) VALUES ('old', 'old@test', 'x')").lastrowid
+    product_id, price, name = db.execute("SELECT id, price, name FROM products LIMIT 1").fetchone()
+    db.execute("INSERT INTO orders (user_id, product_id, quantity) VALUES (?, ?, 2)", (user_id, product_id))
+    db.commit()
+
+    assert customers.run_migrations(db) == customers.MIGRATIONS[-1][0]
+    order = db.execute("SELECT * FROM orders WHERE user_id = ?", (user_id,)).fetchone()
+    assert (order["quantity"], order["unit_price"], order["product_name"]) == (2, price, name)
+    assert not customers.check_query_plans(db)
+    assert not customers.check_aggregates(db)
+    db.close()
+
+
+def test_check_query_plans_reports_a_missing_index(db):
+    assert customers.check_query_plans(db) == []
+
+    db.execute("DROP INDEX idx_orders_user")
+    problems = customers.check_query_plans(db)
+    assert [(name, index) for name, index, _ in problems] == [("user orders", "idx_orders_user")]
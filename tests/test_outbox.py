@@ -0,0 +1,89 @@
+import json
+import time
+
+import customers
+
+
+def enqueue(db, key, topic="test.event"):
+    customers.run_write_transaction(db, lambda db: customers.enqueue_event(db, topic, key, {"n": 1}))
+
+
+def make_due(db):
+    db.execute("UPDATE outbox SET available_at = 0 WHERE status = 'pending'")
+    db.commit()
+
+
+def test_enqueue_ignores_a_repeated_key(db):
+    enqueue(db, "k1")
+    enqueue(db, "k1")
+    assert db.execute("SELECT COUNT(*) FROM outbox WHERE idempotency_key = 'k1'").fetchone()[0] == 1
+
+
+def test_claimed_events_are_leased(db):
+    enqueue(db, "k1")
+    assert [row["idempotency_key"] for row in customers.claim_outbox_batch(db, 10)] == ["k1"]
+    assert customers.claim_outbox_batch(db, 10) == []
+    leased_until = db.execute("SELECT available_at FROM outbox WHERE idempotency_key = 'k1'").fetchone()[0]
+    assert leased_until > time.time()
+
+
+def test_retry_reruns_only_the_failed_handler(db, monkeypatch):
+    calls = []
+
+    def steady(event):
+        calls.append(("steady", event["attempt"]))
+
+    def flaky(event):
+        calls.append(("flaky", event["attempt"]))
+        if event["attempt"] == 1:
+            raise RuntimeError("down")
+
+    monkeypatch.setitem(customers.OUTBOX_HANDLERS, "test.event", [steady, flaky])
+    enqueue(db, "k1")
+
+    assert customers.drain_outbox(db) == (0, 1, 0)
+    row = db.execute("SELECT status, available_at, last_error FROM outbox").fetchone()
+    assert row["status"] == "pending" and row["available_at"] > time.time()
+    assert "flaky: down" in row["last_error"]
+
+    make_due(db)
+    assert customers.drain_outbox(db) == (1, 0, 0)
+    assert calls == [("steady", 1), ("flaky", 1), ("flaky", 2)]
+    assert db.execute("SELECT status FROM outbox").fetchone()[0] == "done"
+
+
+def test_event_fails_after_max_attempts(db, monkeypatch):
+    def broken(event):
+        raise RuntimeError("down")
+
+    monkeypatch.setitem(customers.OUTBOX_HANDLERS, "test.event", [broken])
+    monkeypatch.setitem(customers.app.config, "OUTBOX_MAX_ATTEMPTS", 2)
+    enqueue(db, "k1")
+
+    assert customers.drain_outbox(db) == (0, 1, 0)
+    make_due(db)
+    assert customers.drain_outbox(db) == (0, 0, 1)
+    make_due(db)
+    assert customers.drain_outbox(db) == (0, 0, 0)
+    assert db.execute("SELECT status, attempts FROM outbox").fetchone()[:] == ("failed", 2)
+
+
+def test_order_events_reach_the_sink_once(db, login):
+    _, user_id = login("user")
+    product_id = db.execute("SELECT id FROM products WHERE stock > 0 LIMIT 1").fetchone()[0]
+    assert customers.place_order(db, user_id, product_id)
+
+    while any(customers.drain_outbox(db)):
+        pass
+    with open(customers.outbox_sink.path) as f:
+        channels = [json.loads(line)["channel"] for line in f]
+    assert channels.count("email") == 1 and channels.count("analytics") == 1
+
+
+def test_overdue_events_are_reported_when_nothing_drains(db, caplog):
+    enqueue(db, "k1")
+    assert customers.warn_undrained_outbox(db) == 0
+
+    make_due(db)
+    assert customers.warn_undrained_outbox(db) == 1
+    assert "flask drain-outbox --watch" in caplog.text
@@ -0,0 +1,20 @@
+import customers
+
+
+def test_orders_update_recommendations_when_they_commit(db):
+    """No outbox worker runs in tests, so the counts must come from the order transactions."""
+    ids = [db.execute("INSERT INTO products (name, price, stock) VALUES (?, 10, 50)", (name,)).lastrowid
+           for name in ("tea", "pot", "cup")]
+    db.commit()
+    tea, pot, cup = ids
+
+    assert customers.place_order(db, 1, tea)
+    assert customers.place_bulk_order(db, 1, [(pot, 1), (cup, 2)]) == []
+    assert customers.place_order(db, 2, tea)
+    assert customers.commit_flash_sale_batch(db, [customers.PendingPurchase(2, pot, 1)]) == [True]
+
+    assert [row["id"] for row in customers.get_recommendations(db, [tea])] == [pot, cup]
+    assert dict(db.execute("SELECT other_id, baskets FROM co_purchases WHERE product_id = ?", (tea,))) == {pot: 2, cup: 1}
+    mark = db.execute("SELECT applied_through FROM recommendation_state").fetchone()[0]
+    assert mark == db.execute("SELECT MAX(id) FROM orders").fetchone()[0]
+    assert customers.apply_co_purchases(db) == 0
@@ -0,0 +1,15 @@
+"""WSGI entry point for pre-fork servers.
+
+    flask --app routes/customers/customers.py migrate
+    gunicorn --preload --workers 4 wsgi:app
+
+With --preload, create_app() runs once in the master, so the workers fork
+with compiled templates and warm caches.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "routes", "customers"))
+from customers import create_app  # noqa: E402
+
+app = create_app()